@@ -1,14 +1,23 @@
 """
 图片生成路由
 """
-from flask import Blueprint, request, Response
+from flask import Blueprint, request, Response, current_app
 import logging
 import json
-import time
+import math
 from datetime import datetime
+from typing import Optional
 
 from services.image_service import ImageService
-from services.progress_service import ProgressService
+from services.progress_service import ProgressService, FINISHED_STATUSES
+from services.generation_scheduler import GenerationScheduler
+from services.admission_controller import AdmissionController
+from services.image_result_cache import ImageResultCache
+from services.reference_image_service import ReferenceImageService
+from generators.clients.image import get_all_provider_limits, get_all_circuit_breakers, get_all_endpoint_stats
+from generators.clients.rate_limiter import get_all_rate_limits
+from utils.file_utils import FileUtils
+from utils.http_pool import get_http_pool_stats
 from ..utils.response import success_response, error_response
 
 logger = logging.getLogger(__name__)
@@ -28,10 +37,15 @@ def generate_images():
         "topic": "主题（可选）",
         "reference_image": "参考图片URL（可选）",
         "generator_type": "生成器类型（可选，默认mock）",
-        "image_model_config": {...},
+        "image_model_config": {...（可含 endpoints: 等价备用端点列表 [{url, apiKey?, model?, apiFormat?, weight?}]）},
         "image_generation_config": {...},
-        "full_outline": "完整内容大纲（可选）"
+        "full_outline": "完整内容大纲（可选）",
+        "cache": "是否复用已生成的相同图片（可选，默认true）",
+        "client_id": "客户端标识（可选，用于按客户端订阅所有任务的进度）"
     }
+    
+    服务地址已熔断时返回 503；生成队列积压超出预算时返回 429（排队页数超限）或 503（预计等待过长），
+    均带 Retry-After 响应头；接受时返回排队位置和预计完成秒数
     """
     try:
         data = request.get_json()
@@ -43,6 +57,8 @@ def generate_images():
         image_model_config = data.get('image_model_config', {})
         image_generation_config = data.get('image_generation_config', {})
         full_outline = data.get('full_outline', '')
+        use_cache = data.get('cache', True) is not False
+        client_id = data.get('client_id')
         
         if not task_id or not pages:
             return error_response('任务ID和页面信息不能为空', 400)
@@ -58,18 +74,49 @@ def generate_images():
         if not is_valid:
             return error_response(error_msg, 400)
         
+        # 服务地址已熔断时直接拒绝，避免创建注定失败的任务
+        circuit_retry_after = image_service.get_circuit_retry_after()
+        if circuit_retry_after > 0:
+            retry_after = math.ceil(circuit_retry_after)
+            response, status_code = error_response(
+                f'图片生成服务暂时不可用（已熔断），请约 {retry_after} 秒后重试',
+                503,
+                retry_after=retry_after
+            )
+            response.headers['Retry-After'] = str(retry_after)
+            return response, status_code
+        
+        admission = AdmissionController()
+        decision = admission.admit(len(pages), image_service.get_throughput_key())
+        if not decision['admitted']:
+            response, status_code = error_response(
+                decision['message'],
+                decision['status_code'],
+                retry_after=decision['retry_after'],
+                estimated_wait=decision['estimated_wait']
+            )
+            response.headers['Retry-After'] = str(decision['retry_after'])
+            return response, status_code
+        
+        # 批次准备在调度器中异步执行，页面进入调度队列（由调度器计入积压）后再释放预留
         image_service.generate_batch(
             task_id=task_id,
             pages=pages,
             topic=topic,
             reference_image=reference_image,
             image_generation_config=image_generation_config,
-            full_outline=full_outline
+            full_outline=full_outline,
+            use_cache=use_cache,
+            client_id=client_id,
+            on_queued=lambda: admission.release(decision)
         )
         
         return success_response({
             'task_id': task_id,
-            'total_pages': len(pages)
+            'total_pages': len(pages),
+            'queue_position': decision['queue_position'],
+            'estimated_wait': decision['estimated_wait'],
+            'eta_seconds': decision['eta_seconds']
         }, '图片生成任务已启动')
         
     except Exception as e:
@@ -77,67 +124,479 @@ def generate_images():
         return error_response(str(e), 500)
 
 
-@image_bp.route('/progress/<task_id>', methods=['GET'])
-def get_progress(task_id):
+@image_bp.route('/tasks/<task_id>/retry', methods=['POST'])
+def retry_task(task_id):
     """
-    获取任务进度（SSE端点）
+    只重试任务中失败的页面
+    
+    复用原任务的页面、参考图和模型配置，新结果通过 /progress/<task_id> 推送
+    
+    请求体（可选）:
+    {
+        "image_model_config": {...}  任务使用自定义 API 密钥时提供（任务日志不保存密钥，其他工作进程处理重试时需要）
+    }
     """
-    def generate_progress():
-        progress_service = ProgressService()
+    try:
+        if not ProgressService().task_exists(task_id):
+            return error_response('任务不存在或已过期', 404, task_id=task_id)
+        
+        data = request.get_json(silent=True) or {}
+        image_service = ImageService()
+        success, error_msg, retry_pages = image_service.retry_failed_pages(
+            task_id,
+            model_config=data.get('image_model_config')
+        )
+        
+        if not success:
+            return error_response(error_msg, 409, task_id=task_id)
+        
+        return success_response({
+            'task_id': task_id,
+            'retry_pages': retry_pages
+        }, f'已重新提交 {len(retry_pages)} 个失败页面')
+        
+    except Exception as e:
+        logger.error(f'Error retrying task {task_id}: {e}', exc_info=True)
+        return error_response(str(e), 500)
+
 
+@image_bp.route('/tasks/<task_id>/cancel', methods=['POST'])
+def cancel_task(task_id):
+    """
+    取消图片生成任务
+    
+    排队中的页面不再调用服务商，执行中的页面在宽限期后放弃，最终结果通过 /progress/<task_id> 推送
+    """
+    try:
+        progress_service = ProgressService()
         if not progress_service.task_exists(task_id):
-            error_data = {
-                'error': '任务已过期或不存在',
+            return error_response('任务不存在或已过期', 404, task_id=task_id)
+        
+        if not ImageService().cancel_task(task_id):
+            return error_response('任务已结束，无法取消', 409, task_id=task_id)
+        
+        return success_response({'task_id': task_id}, '任务取消中')
+        
+    except Exception as e:
+        logger.error(f'Error cancelling task {task_id}: {e}', exc_info=True)
+        return error_response(str(e), 500)
+
+
+@image_bp.route('/generation/queue', methods=['GET'])
+def get_generation_queue():
+    """获取全局图片生成队列状态"""
+    try:
+        scheduler = GenerationScheduler()
+        stats = scheduler.get_stats()
+        stats['admission'] = AdmissionController().get_stats()
+        return success_response(stats)
+        
+    except Exception as e:
+        logger.error(f'Error getting generation queue: {e}', exc_info=True)
+        return error_response(str(e), 500)
+
+
+@image_bp.route('/generation/queue/<task_id>', methods=['GET'])
+def get_generation_queue_position(task_id):
+    """获取任务在全局图片生成队列中的位置"""
+    try:
+        scheduler = GenerationScheduler()
+        position = scheduler.get_task_position(task_id)
+        
+        if position is None:
+            return error_response('任务不在生成队列中', 404, task_id=task_id)
+        
+        return success_response(position)
+        
+    except Exception as e:
+        logger.error(f'Error getting queue position for {task_id}: {e}', exc_info=True)
+        return error_response(str(e), 500)
+
+
+@image_bp.route('/generation/providers', methods=['GET'])
+def get_generation_providers():
+    """获取各图片服务商当前的自适应并发上限"""
+    try:
+        return success_response(get_all_provider_limits())
+        
+    except Exception as e:
+        logger.error(f'Error getting provider limits: {e}', exc_info=True)
+        return error_response(str(e), 500)
+
+
+@image_bp.route('/generation/circuit-breakers', methods=['GET'])
+def get_generation_circuit_breakers():
+    """获取各图片服务地址的熔断状态和滚动错误率"""
+    try:
+        return success_response(get_all_circuit_breakers())
+        
+    except Exception as e:
+        logger.error(f'Error getting circuit breakers: {e}', exc_info=True)
+        return error_response(str(e), 500)
+
+
+@image_bp.route('/generation/endpoints', methods=['GET'])
+def get_generation_endpoints():
+    """获取各图片端点最近请求的 p50/p95 延迟、错误率和对冲统计"""
+    try:
+        return success_response(get_all_endpoint_stats())
+        
+    except Exception as e:
+        logger.error(f'Error getting endpoint stats: {e}', exc_info=True)
+        return error_response(str(e), 500)
+
+
+@image_bp.route('/generation/rate-limits', methods=['GET'])
+def get_generation_rate_limits():
+    """获取各 API 密钥令牌桶的剩余令牌和限速等待统计（密钥以摘要标识）"""
+    try:
+        return success_response(get_all_rate_limits())
+        
+    except Exception as e:
+        logger.error(f'Error getting rate limits: {e}', exc_info=True)
+        return error_response(str(e), 500)
+
+
+@image_bp.route('/generation/http-pool', methods=['GET'])
+def get_generation_http_pool():
+    """获取图片服务商 HTTP 连接池的复用统计"""
+    try:
+        return success_response(get_http_pool_stats())
+        
+    except Exception as e:
+        logger.error(f'Error getting http pool stats: {e}', exc_info=True)
+        return error_response(str(e), 500)
+
+
+@image_bp.route('/generation/cache', methods=['GET'])
+def get_generation_cache():
+    """获取图片结果缓存的命中率统计，以及参考图预处理缓存和内容寻址存储的去重统计"""
+    try:
+        stats = ImageResultCache().get_stats()
+        stats['reference_images'] = ReferenceImageService().get_stats()
+        stats['content_store'] = FileUtils().content_store.get_stats()
+        return success_response(stats)
+        
+    except Exception as e:
+        logger.error(f'Error getting image cache stats: {e}', exc_info=True)
+        return error_response(str(e), 500)
+
+
+def _snapshot_data(progress: dict, compact: bool = False) -> dict:
+    """
+    构造完整快照数据
+    
+    Args:
+        progress: 任务进度
+        compact: 精简快照，省略图片和失败记录的时间戳
+    """
+    images = progress['images']
+    failed_pages = progress.get('failed_pages', [])
+    if compact:
+        images = [{'page_number': img['page_number'], 'url': img['url']} for img in images]
+        failed_pages = [
+            {'page_number': failed['page_number'], 'error': failed['error']} for failed in failed_pages
+        ]
+    
+    data = {
+        'type': 'snapshot',
+        'task_id': progress['task_id'],
+        'status': progress['status'],
+        'progress': progress['progress'],
+        'total_pages': progress['total_pages'],
+        'completed_pages': progress['completed_pages'],
+        'current_page': progress['current_page'],
+        'message': progress['message'],
+        'images': images,
+        'failed_pages': failed_pages,
+        'calls_avoided': progress.get('calls_avoided', 0),
+        'timestamp': datetime.now().isoformat()
+    }
+    return data
+
+
+def _snapshot_event(progress: dict, seq: Optional[int], done: bool = False, compact: bool = False) -> str:
+    """
+    构造完整快照事件（连接建立、任务结束或补发失败时发送）
+    
+    Args:
+        progress: 任务进度
+        seq: 快照对应的事件序号（作为 SSE id，多路复用推送时为None）
+        done: 任务是否已结束
+        compact: 精简快照，省略图片和失败记录的时间戳（断线重连落后太多时使用）
+    """
+    data = _snapshot_data(progress, compact)
+    if done:
+        data['done'] = True
+    if seq is None:
+        return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return f"id: {seq}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _parse_last_event_id() -> Optional[int]:
+    """读取断线重连时浏览器带上的 Last-Event-ID（也支持 last_event_id 查询参数）"""
+    raw = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    if raw is None:
+        return None
+    try:
+        value = int(raw)
+    except ValueError:
+        return None
+    return value if value >= 0 else None
+
+
+def _parse_task_ids() -> list:
+    """读取 ids 查询参数（逗号分隔，可重复传参），去重并保持顺序"""
+    task_ids = []
+    for raw in request.args.getlist('ids'):
+        for task_id in raw.split(','):
+            task_id = task_id.strip()
+            if task_id and task_id not in task_ids:
+                task_ids.append(task_id)
+    return task_ids
+
+
+@image_bp.route('/progress', methods=['GET'])
+def get_progress_batch():
+    """
+    批量获取多个任务的进度快照
+    
+    查询参数:
+        ids: 任务ID列表，逗号分隔
+    
+    返回的每个快照带 seq（当前事件序号），不存在的任务列在 missing 中
+    """
+    task_ids = _parse_task_ids()
+    if not task_ids:
+        return error_response('任务ID不能为空', 400)
+    
+    max_tasks = current_app.config['PROGRESS_STREAM_MAX_TASKS']
+    if len(task_ids) > max_tasks:
+        return error_response(f'一次最多查询 {max_tasks} 个任务', 400)
+    
+    snapshots = ProgressService().get_snapshots(task_ids)
+    tasks = {}
+    for task_id, (progress, seq) in snapshots.items():
+        tasks[task_id] = _snapshot_data(progress)
+        tasks[task_id]['seq'] = seq
+    
+    return success_response({
+        'tasks': tasks,
+        'missing': [task_id for task_id in task_ids if task_id not in snapshots]
+    })
+
+
+@image_bp.route('/progress/stream', methods=['GET'])
+def stream_progress():
+    """
+    多路复用的进度推送（SSE端点），一个连接订阅多个任务
+    
+    查询参数:
+        ids: 任务ID列表，逗号分隔
+        client_id: 订阅该客户端的所有任务，包括连接后新建的任务
+    
+    每个任务先推送一次完整快照，之后推送增量事件（事件中的 task_id 区分任务）；
+    任务结束时推送带 done 的快照，任务被清理时推送 removed 事件。
+    只按 ids 订阅时，所有任务结束后推送 end 事件并关闭连接。
+    
+    多个任务的事件序号无法合并为一个 Last-Event-ID，断线重连时重新推送所有任务的快照。
+    """
+    keepalive_interval = current_app.config['SSE_KEEPALIVE_INTERVAL']
+    retry_ms = current_app.config['SSE_RETRY_MS']
+    max_tasks = current_app.config['PROGRESS_STREAM_MAX_TASKS']
+    task_ids = _parse_task_ids()
+    client_id = request.args.get('client_id') or None
+    
+    if not task_ids and not client_id:
+        return error_response('请指定任务ID或客户端标识', 400)
+    if len(task_ids) > max_tasks:
+        return error_response(f'一次最多订阅 {max_tasks} 个任务', 400)
+    
+    def generate_progress():
+        progress_service = ProgressService()
+        cursors = {}
+        finished = set()
+        # 超出订阅上限而放弃的客户端任务，有任务移除腾出名额后重新接纳
+        ignored = set()
+        
+        def removed_event(task_id: str) -> str:
+            cursors.pop(task_id, None)
+            finished.discard(task_id)
+            ignored.clear()
+            data = {
+                'type': 'removed',
                 'task_id': task_id,
                 'message': '该任务可能已完成或已被清理，请刷新页面重新生成',
                 'code': 'TASK_NOT_FOUND'
             }
-            yield f"data: {json.dumps(error_data)}\n\n"
-            return
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
         
-        logger.info(f"开始SSE进度推送: {task_id}")
+        def snapshot_event(task_id: str) -> str:
+            snapshot = progress_service.get_snapshot(task_id)
+            if snapshot is None:
+                return removed_event(task_id)
+            progress, cursors[task_id] = snapshot
+            done = progress['status'] in FINISHED_STATUSES
+            if done:
+                finished.add(task_id)
+            else:
+                finished.discard(task_id)
+            return _snapshot_event(progress, None, done=done)
         
-        while True:
-            try:
-                progress = progress_service.get_progress(task_id)
-                
-                if not progress:
-                    logger.error(f"无法获取任务进度: {task_id}")
+        try:
+            yield f"retry: {retry_ms}\n\n"
+            logger.info(f"开始多路SSE进度推送: 任务数={len(task_ids)}, 客户端={client_id}")
+            
+            for task_id in task_ids:
+                yield snapshot_event(task_id)
+            
+            while True:
+                if not client_id and len(finished) == len(cursors):
+                    yield f"data: {json.dumps({'type': 'end'})}\n\n"
+                    logger.info(f"多路SSE进度推送完成: 任务数={len(task_ids)}")
                     break
                 
-                sse_data = {
-                    'task_id': progress['task_id'],
-                    'status': progress['status'],
-                    'progress': progress['progress'],
-                    'total_pages': progress['total_pages'],
-                    'completed_pages': progress['completed_pages'],
-                    'current_page': progress['current_page'],
-                    'message': progress['message'],
-                    'images': progress['images'],
-                    'failed_pages': progress.get('failed_pages', []),
-                    'timestamp': datetime.now().isoformat()
-                }
+                changes = progress_service.wait_for_many(cursors, keepalive_interval, client_id, ignored)
+                produced = False
+                
+                for task_id, result in changes.items():
+                    if result is None:
+                        produced = True
+                        yield removed_event(task_id)
+                        continue
+                    
+                    events, missed = result
+                    if missed:
+                        # 新出现的任务或增量事件已被挤出缓冲区，改发快照
+                        if task_id not in cursors and len(cursors) >= max_tasks:
+                            ignored.add(task_id)
+                            continue
+                        produced = True
+                        yield snapshot_event(task_id)
+                        continue
+                    
+                    produced = True
+                    for event in events:
+                        yield f"data: {event.data}\n\n"
+                        cursors[task_id] = event.seq
+                    
+                    if any(event.terminal for event in events):
+                        # 任务结束时补发带 done 的完整快照
+                        yield snapshot_event(task_id)
+                    else:
+                        # 已结束的任务被重试时重新视为进行中
+                        finished.discard(task_id)
                 
-                yield f"data: {json.dumps(sse_data)}\n\n"
+                if not produced:
+                    yield ": keepalive\n\n"
                 
+        except Exception as e:
+            logger.error(f"多路SSE推送错误: {e}", exc_info=True)
+            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    
+    return Response(
+        generate_progress(),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+            'Connection': 'keep-alive'
+        }
+    )
+
+
+@image_bp.route('/progress/<task_id>', methods=['GET'])
+def get_progress(task_id):
+    """
+    获取任务进度（SSE端点）
+    
+    连接时先推送完整快照，之后阻塞等待进度变化，只推送增量事件
+    (status/progress/page_completed/page_failed)；任务结束时再推送一次带 done 的完整快照。
+    空闲时定期发送保活注释。
+    
+    每个事件带递增的 id。断线重连时浏览器带上 Last-Event-ID，只补发错过的事件；
+    错过的事件已被挤出缓冲区时改发精简快照。
+    """
+    keepalive_interval = current_app.config['SSE_KEEPALIVE_INTERVAL']
+    retry_ms = current_app.config['SSE_RETRY_MS']
+    last_event_id = _parse_last_event_id()
+    
+    def generate_progress():
+        progress_service = ProgressService()
+        task_not_found = {
+            'error': '任务已过期或不存在',
+            'task_id': task_id,
+            'message': '该任务可能已完成或已被清理，请刷新页面重新生成',
+            'code': 'TASK_NOT_FOUND'
+        }
+        
+        snapshot = progress_service.get_snapshot(task_id)
+        if snapshot is None:
+            yield f"data: {json.dumps(task_not_found)}\n\n"
+            return
+        
+        progress, current_seq = snapshot
+        
+        try:
+            yield f"retry: {retry_ms}\n\n"
+            
+            if last_event_id is None or last_event_id > current_seq:
+                # 新连接（或序号来自已重建的任务），从完整快照开始
+                logger.info(f"开始SSE进度推送: {task_id}")
                 if progress_service.is_task_completed(task_id):
-                    final_data = {
-                        'done': True,
-                        'status': progress['status'],
-                        'task_id': task_id,
-                        'images': progress['images'],  # 🔧 修复：包含完整的图片数组
-                        'failed_pages': progress.get('failed_pages', [])
-                    }
-                    yield f"data: {json.dumps(final_data)}\n\n"
-                    logger.info(f"SSE进度推送完成: {task_id}, 图片数量: {len(progress['images'])}")
+                    yield _snapshot_event(progress, current_seq, done=True)
+                    return
+                yield _snapshot_event(progress, current_seq)
+                last_seq = current_seq
+            else:
+                # 断线重连，只补发 last_event_id 之后的事件
+                logger.info(f"SSE断线重连: {task_id}, 补发 {current_seq - last_event_id} 个事件")
+                if last_event_id == current_seq and progress_service.is_task_completed(task_id):
+                    yield _snapshot_event(progress, current_seq, done=True, compact=True)
+                    return
+                last_seq = last_event_id
+            
+            while True:
+                result = progress_service.wait_for_events(task_id, last_seq, keepalive_interval)
+                if result is None:
+                    logger.error(f"任务已被清理，停止SSE推送: {task_id}")
+                    yield f"data: {json.dumps(task_not_found)}\n\n"
                     break
                 
-                time.sleep(0.5)
+                events, missed = result
+                
+                if missed:
+                    # 订阅者落后太多，增量事件已被挤出缓冲区，改发精简快照
+                    snapshot = progress_service.get_snapshot(task_id)
+                    if snapshot is None:
+                        continue
+                    progress, last_seq = snapshot
+                    done = progress_service.is_task_completed(task_id)
+                    yield _snapshot_event(progress, last_seq, done=done, compact=True)
+                    if done:
+                        break
+                    continue
+                
+                if not events:
+                    yield ": keepalive\n\n"
+                    continue
+                
+                for event in events:
+                    yield f"id: {event.seq}\ndata: {event.data}\n\n"
+                    last_seq = event.seq
+                
+                if any(event.terminal for event in events) and progress_service.is_task_completed(task_id):
+                    snapshot = progress_service.get_snapshot(task_id)
+                    if snapshot is None:
+                        break
+                    progress, last_seq = snapshot
+                    yield _snapshot_event(progress, last_seq, done=True)
+                    logger.info(f"SSE进度推送完成: {task_id}, 图片数量: {len(progress['images'])}")
+                    break
                 
-            except Exception as e:
-                logger.error(f"SSE推送错误: {e}", exc_info=True)
-                yield f"data: {json.dumps({'error': str(e), 'task_id': task_id})}\n\n"
-                break
+        except Exception as e:
+            logger.error(f"SSE推送错误: {e}", exc_info=True)
+            yield f"data: {json.dumps({'error': str(e), 'task_id': task_id})}\n\n"
     
     return Response(
         generate_progress(),
@@ -147,4 +606,4 @@ def get_progress(task_id):
             'X-Accel-Buffering': 'no',
             'Connection': 'keep-alive'
         }
-    )
\ No newline at end of file
+    )
@@ -4,6 +4,8 @@
 from flask import Blueprint, request, jsonify
 import logging
 import asyncio
+import time
+from datetime import datetime
 
 from services.trending_service import get_trending_service
 from ..utils.response import success_response, error_response
@@ -26,6 +28,121 @@ def get_trending_sources():
         return error_response(str(e), 500)
 
 
+@trending_bp.route('/trending/stats', methods=['GET'])
+def get_trending_stats():
+    """获取各数据源的缓存状态和抓取统计（含合并的并发请求数）"""
+    try:
+        trending_service = get_trending_service()
+        return success_response(trending_service.get_stats())
+        
+    except Exception as e:
+        logger.error(f'Error getting trending stats: {e}', exc_info=True)
+        return error_response(str(e), 500)
+
+
+def _parse_time(value, default: float) -> float:
+    """解析时间参数（Unix 时间戳或 ISO 8601 字符串），未提供时返回默认值"""
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def _get_history():
+    """获取热榜历史存储，未启用时返回None"""
+    return get_trending_service().history
+
+
+@trending_bp.route('/trending/history/<source_id>/trajectory', methods=['GET'])
+def get_trending_trajectory(source_id):
+    """
+    查询话题的排名轨迹（在榜时长、最高排名和每次快照的排名/热度）
+    
+    Query Parameters:
+        title: 话题标题（精确匹配）
+        start: 起始时间（Unix 时间戳或 ISO 8601），默认7天前
+        end: 结束时间，默认现在
+    """
+    try:
+        history = _get_history()
+        if history is None:
+            return error_response('热榜历史未启用', 404)
+        
+        title = request.args.get('title', '').strip()
+        if not title:
+            return error_response('缺少 title 参数', 400)
+        
+        end = _parse_time(request.args.get('end'), time.time())
+        start = _parse_time(request.args.get('start'), end - 7 * 86400)
+        return success_response(history.get_trajectory(source_id, title, start, end))
+        
+    except ValueError as e:
+        return error_response(f'时间参数格式错误: {e}', 400)
+    except Exception as e:
+        logger.error(f'Error getting trending trajectory for {source_id}: {e}', exc_info=True)
+        return error_response(str(e), 500)
+
+
+@trending_bp.route('/trending/history/<source_id>/top', methods=['GET'])
+def get_trending_top_at(source_id):
+    """
+    查询指定时刻的榜单
+    
+    Query Parameters:
+        at: 查询时刻（Unix 时间戳或 ISO 8601），默认现在
+        limit: 返回前几名，默认10
+    """
+    try:
+        history = _get_history()
+        if history is None:
+            return error_response('热榜历史未启用', 404)
+        
+        at = _parse_time(request.args.get('at'), time.time())
+        limit = max(1, request.args.get('limit', 10, type=int))
+        result = history.get_top(source_id, at, limit)
+        if result is None:
+            return error_response('该时刻之前没有历史榜单', 404)
+        return success_response(result)
+        
+    except ValueError as e:
+        return error_response(f'时间参数格式错误: {e}', 400)
+    except Exception as e:
+        logger.error(f'Error getting trending top for {source_id}: {e}', exc_info=True)
+        return error_response(str(e), 500)
+
+
+@trending_bp.route('/trending/history/<source_id>/movers', methods=['GET'])
+def get_trending_movers(source_id):
+    """
+    查询一段时间内排名上升和下降最多的话题
+    
+    Query Parameters:
+        hours: 时间窗口（小时），默认1
+        end: 窗口结束时间（Unix 时间戳或 ISO 8601），默认现在
+        limit: 返回条数，默认10
+    """
+    try:
+        history = _get_history()
+        if history is None:
+            return error_response('热榜历史未启用', 404)
+        
+        end = _parse_time(request.args.get('end'), time.time())
+        hours = request.args.get('hours', 1, type=float)
+        limit = max(1, request.args.get('limit', 10, type=int))
+        result = history.get_movers(source_id, end - hours * 3600, end, limit)
+        if result is None:
+            return error_response('时间窗口内的历史快照不足', 404)
+        return success_response(result)
+        
+    except ValueError as e:
+        return error_response(f'时间参数格式错误: {e}', 400)
+    except Exception as e:
+        logger.error(f'Error getting trending movers for {source_id}: {e}', exc_info=True)
+        return error_response(str(e), 500)
+
+
 @trending_bp.route('/trending/<source_id>', methods=['GET'])
 def get_trending_by_source(source_id):
     """
@@ -10,6 +10,7 @@ import logging
 from pathlib import Path
 
 from config import config
+from utils.content_store import ContentStore
 
 # 加载环境变量
 load_dotenv()
@@ -49,9 +50,35 @@ def create_app(config_name='default'):
     # 注册静态文件路由
     register_static_routes(app)
     
+    # 初始化共享服务
+    init_services(app)
+    
     return app
 
 
+def init_services(app):
+    """初始化进程级共享服务"""
+    from services.generation_scheduler import GenerationScheduler
+    from utils.http_pool import HTTPSessionPool
+    
+    # 全局图片生成调度器，所有批次共享同一并发上限
+    scheduler = GenerationScheduler(max_workers=app.config['MAX_CONCURRENT_GENERATIONS'])
+    
+    # 单个服务地址的连接池大小与调度器并发一致，避免连接被丢弃重建
+    HTTPSessionPool().configure(scheduler.max_workers)
+    
+    # 恢复上次运行中断的批次、启动热榜后台刷新（调试模式下只在重载器启动的子进程中执行）
+    if not app.config['DEBUG'] or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        from services.image_service import ImageService
+        # 使用服务端配置的生成器从 Flask 配置读取密钥和地址，需要应用上下文
+        with app.app_context():
+            ImageService.resume_journaled_batches()
+        
+        if app.config['TRENDING_BACKGROUND_REFRESH']:
+            from services.trending_service import get_trending_service
+            get_trending_service().start_refresher()
+
+
 def register_blueprints(app):
     """注册所有蓝图"""
     from api import (
@@ -143,8 +170,16 @@ def register_static_routes(app):
         - /uploads/references/xxx.png - 参考图片
         - /uploads/generated/xxx.png - 生成的图片
         - /uploads/temp/xxx.png - 临时文件
+        
+        内容寻址文件（路径为 sha256 摘要）内容永不变化，允许客户端永久缓存
         """
-        return send_from_directory('uploads', filename)
+        response = send_from_directory('uploads', filename)
+        if ContentStore.is_content_path(filename):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = 31536000
+            response.cache_control.immutable = True
+        return response
 
 
 if __name__ == '__main__':
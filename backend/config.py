@@ -40,9 +40,90 @@ class Config:
     IMAGE_API_KEY = os.getenv('IMAGE_API_KEY', '')
     IMAGE_API_URL = os.getenv('IMAGE_API_URL', '')
     IMAGE_MODEL = os.getenv('IMAGE_MODEL', 'dall-e-3')
+    # 与 IMAGE_API_URL 等价的备用端点（逗号分隔，共用密钥、模型和格式），主端点故障或响应慢时切换
+    IMAGE_API_FALLBACK_URLS = [url.strip() for url in os.getenv('IMAGE_API_FALLBACK_URLS', '').split(',') if url.strip()]
+    # 多端点选择策略: ordered（按顺序）/ weighted（按权重随机）/ latency（按 p50 延迟和错误率）
+    IMAGE_ROUTER_STRATEGY = os.getenv('IMAGE_ROUTER_STRATEGY', 'latency')
+    IMAGE_ROUTER_LATENCY_SAMPLES = int(os.getenv('IMAGE_ROUTER_LATENCY_SAMPLES', '100'))  # 每个端点保留的最近请求数
+    # 对冲请求：端点超过其 p95 延迟未返回时向下一个端点再发一次（会增加调用量）
+    IMAGE_HEDGE_ENABLED = os.getenv('IMAGE_HEDGE_ENABLED', 'False') == 'True'
+    IMAGE_HEDGE_MIN_DELAY = float(os.getenv('IMAGE_HEDGE_MIN_DELAY', '3'))  # 对冲前最短等待（秒）
+    IMAGE_HEDGE_MIN_SAMPLES = int(os.getenv('IMAGE_HEDGE_MIN_SAMPLES', '10'))  # 样本不足时不对冲
     
     # 并发配置
     MAX_CONCURRENT_GENERATIONS = int(os.getenv('MAX_CONCURRENT_GENERATIONS', '25'))
+    PROVIDER_INITIAL_CONCURRENCY = int(os.getenv('PROVIDER_INITIAL_CONCURRENCY', '0'))  # 单个服务商的初始并发上限，0 表示等于全局并发，仅在 429/503 时下调
+    HTTP_POOL_MAX_HOSTS = int(os.getenv('HTTP_POOL_MAX_HOSTS', '32'))  # 保持 keep-alive 会话的服务地址数上限，超出时关闭最久未用的
+    CANCEL_GRACE_PERIOD = float(os.getenv('CANCEL_GRACE_PERIOD', '5'))  # 取消任务后等待执行中页面完成的宽限期（秒）
+    
+    # 准入控制（排队工作量超出预算时拒绝新任务，0 表示不限制）
+    ADMISSION_MAX_QUEUED_PAGES = int(os.getenv('ADMISSION_MAX_QUEUED_PAGES', '500'))  # 排队页数上限，超出返回 429
+    ADMISSION_MAX_WAIT_SECONDS = float(os.getenv('ADMISSION_MAX_WAIT_SECONDS', '600'))  # 预计等待秒数上限，超出返回 503
+    ADMISSION_DEFAULT_PAGE_SECONDS = float(os.getenv('ADMISSION_DEFAULT_PAGE_SECONDS', '30'))  # 尚无统计时的单页耗时估计
+    
+    # 按 API 密钥限速（令牌桶，同一密钥的所有任务共享；RPM/RPS 均为 0 时不限速）
+    API_KEY_RATE_LIMIT_RPM = float(os.getenv('API_KEY_RATE_LIMIT_RPM', '0'))  # 每分钟请求数
+    API_KEY_RATE_LIMIT_RPS = float(os.getenv('API_KEY_RATE_LIMIT_RPS', '0'))  # 每秒请求数（与 RPM 同时配置时取较严格者）
+    API_KEY_RATE_LIMIT_BURST = int(os.getenv('API_KEY_RATE_LIMIT_BURST', '5'))  # 允许的突发请求数
+    API_KEY_RATE_LIMIT_MAX_WAIT = float(os.getenv('API_KEY_RATE_LIMIT_MAX_WAIT', '30'))  # 单次最长等待（秒），超出后页面延迟重新排队
+    RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')  # memory（进程内）或 sqlite（多进程共享）
+    RATE_LIMIT_DB_PATH = os.getenv('RATE_LIMIT_DB_PATH') or str(STORAGE_FOLDER / 'rate_limits.db')
+    
+    # 图片服务商熔断（按服务地址统计滑动窗口内的连接错误、超时和 5xx）
+    CIRCUIT_BREAKER_ENABLED = os.getenv('CIRCUIT_BREAKER_ENABLED', 'True') == 'True'
+    CIRCUIT_BREAKER_WINDOW = float(os.getenv('CIRCUIT_BREAKER_WINDOW', '60'))  # 失败率统计窗口（秒）
+    CIRCUIT_BREAKER_MIN_REQUESTS = int(os.getenv('CIRCUIT_BREAKER_MIN_REQUESTS', '5'))  # 窗口内最少请求数
+    CIRCUIT_BREAKER_FAILURE_RATE = float(os.getenv('CIRCUIT_BREAKER_FAILURE_RATE', '0.5'))  # 熔断失败率阈值
+    CIRCUIT_BREAKER_OPEN_SECONDS = float(os.getenv('CIRCUIT_BREAKER_OPEN_SECONDS', '30'))  # 熔断冷却时间（秒）
+    CIRCUIT_BREAKER_HALF_OPEN_PROBES = int(os.getenv('CIRCUIT_BREAKER_HALF_OPEN_PROBES', '1'))  # 半开状态探测请求数
+    
+    # 生成时限（超时的页面按时记为失败并释放并发名额）
+    PAGE_TIMEOUT = float(os.getenv('PAGE_TIMEOUT', '180'))  # 单页时限（秒，从请求发出计时，不含本地限速等待）
+    TASK_TIMEOUT = float(os.getenv('TASK_TIMEOUT', '1800'))  # 任务整体时限（秒，从提交计时，含排队时间）
+    MAX_ABANDONED_WORKERS = int(os.getenv('MAX_ABANDONED_WORKERS', '0'))  # 超时后补充新线程的卡住线程上限，0 表示等于全局并发
+    # 各 API 格式的覆盖配置，未指定的字段使用上面的默认值
+    GENERATION_TIMEOUTS = {
+        'openai_chat': {'page': 240},
+        'openai_dalle': {},
+        'gemini': {'page': 120},
+    }
+    
+    # 进度推送（SSE）空闲时发送保活注释的间隔（秒）
+    SSE_KEEPALIVE_INTERVAL = float(os.getenv('SSE_KEEPALIVE_INTERVAL', '15'))
+    # 每个任务保留的最近进度事件数，断线重连时按 Last-Event-ID 补发，落后更多则改发精简快照
+    PROGRESS_EVENT_BUFFER_SIZE = int(os.getenv('PROGRESS_EVENT_BUFFER_SIZE', '256'))
+    # 浏览器断线后的重连间隔（毫秒，SSE retry 字段）
+    SSE_RETRY_MS = int(os.getenv('SSE_RETRY_MS', '3000'))
+    # 进度存储后端：memory（进程内）/ sqlite（多个工作进程共享同一数据库文件）
+    PROGRESS_BACKEND = os.getenv('PROGRESS_BACKEND', 'memory')
+    PROGRESS_DB_PATH = os.getenv('PROGRESS_DB_PATH') or str(STORAGE_FOLDER / 'progress.db')
+    PROGRESS_POLL_INTERVAL = float(os.getenv('PROGRESS_POLL_INTERVAL', '0.25'))  # sqlite 后端跨进程轮询新事件的间隔（秒）
+    PROGRESS_STREAM_MAX_TASKS = int(os.getenv('PROGRESS_STREAM_MAX_TASKS', '200'))  # 多路复用推送和批量查询一次最多包含的任务数
+    
+    # 任务日志：记录进行中批次的参数和页面结果，服务重启后恢复进度并重新排队剩余页面
+    TASK_JOURNAL_ENABLED = os.getenv('TASK_JOURNAL_ENABLED', 'True') == 'True'
+    TASK_JOURNAL_PATH = os.getenv('TASK_JOURNAL_PATH') or str(STORAGE_FOLDER / 'task_journal.db')
+    RETAINED_BATCHES_MAX_BYTES = int(os.getenv('RETAINED_BATCHES_MAX_BYTES', str(64 * 1024 * 1024)))  # 未启用任务日志时内存中保留的已结束批次上下文上限（字节）
+    
+    # 参考图片编码缓存（按路径+mtime+大小缓存 base64 Data URL）
+    REFERENCE_CACHE_MAX_BYTES = int(os.getenv('REFERENCE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))  # 默认64MB
+    CONTENT_GC_MIN_AGE_DAYS = int(os.getenv('CONTENT_GC_MIN_AGE_DAYS', '30'))  # 未被引用的内容寻址文件超过此天数未写入或复用时删除，0 表示不清理
+    
+    # 参考图片预处理（上传给服务商前缩放并重新压缩，去除元数据）
+    REFERENCE_MAX_EDGE = int(os.getenv('REFERENCE_MAX_EDGE', '1536'))  # 最长边（像素）
+    REFERENCE_FORMAT = os.getenv('REFERENCE_FORMAT', 'JPEG')  # 输出格式：JPEG / WEBP
+    REFERENCE_QUALITY = int(os.getenv('REFERENCE_QUALITY', '85'))  # 压缩质量 1-95
+    # 各 API 格式的覆盖配置，未指定的字段使用上面的默认值
+    REFERENCE_PROFILES = {
+        'openai_chat': {},
+        'openai_dalle': {'max_edge': 1024},
+        'gemini': {'format': 'WEBP'},
+    }
+    
+    # 图片结果缓存（相同提示词/尺寸/参考图/模型直接复用已生成的本地图片）
+    IMAGE_RESULT_CACHE_ENABLED = os.getenv('IMAGE_RESULT_CACHE_ENABLED', 'True') == 'True'
+    IMAGE_RESULT_CACHE_TTL = int(os.getenv('IMAGE_RESULT_CACHE_TTL', '86400'))  # 缓存有效期（秒），默认1天
+    IMAGE_RESULT_CACHE_MAX_ENTRIES = int(os.getenv('IMAGE_RESULT_CACHE_MAX_ENTRIES', '5000'))  # 最大缓存条目数
     
     # 图片配置
     IMAGE_WIDTH = 1080
@@ -55,6 +136,16 @@ class Config:
     TRENDING_MAX_RETRIES = int(os.getenv('TRENDING_MAX_RETRIES', '2'))  # 最大重试次数，优化为2次
     TRENDING_PROXY = os.getenv('TRENDING_PROXY', '')  # 代理地址，如 http://127.0.0.1:7890
     TRENDING_BACKOFF_FACTOR = float(os.getenv('TRENDING_BACKOFF_FACTOR', '0.5'))  # 重试退避因子，优化为0.5
+    TRENDING_BACKGROUND_REFRESH = os.getenv('TRENDING_BACKGROUND_REFRESH', 'true').lower() == 'true'  # 是否启用后台刷新
+    TRENDING_REFRESH_AHEAD = float(os.getenv('TRENDING_REFRESH_AHEAD', '0.8'))  # 在刷新间隔的多少比例时提前刷新
+    TRENDING_REFRESH_RETRY_BASE = float(os.getenv('TRENDING_REFRESH_RETRY_BASE', '15'))  # 后台刷新失败的首次重试间隔（秒）
+    TRENDING_SNAPSHOT_ENABLED = os.getenv('TRENDING_SNAPSHOT_ENABLED', 'True') == 'True'  # 是否持久化热榜快照
+    TRENDING_SNAPSHOT_PATH = os.getenv('TRENDING_SNAPSHOT_PATH') or str(STORAGE_FOLDER / 'trending_snapshot.db')
+    TRENDING_HISTORY_ENABLED = os.getenv('TRENDING_HISTORY_ENABLED', 'True') == 'True'  # 是否记录热榜历史
+    TRENDING_HISTORY_PATH = os.getenv('TRENDING_HISTORY_PATH') or str(STORAGE_FOLDER / 'trending_history.db')
+    TRENDING_HISTORY_RETENTION_DAYS = int(os.getenv('TRENDING_HISTORY_RETENTION_DAYS', '90'))  # 历史保留天数，0 表示不清理
+    TRENDING_MAX_CONNECTIONS = int(os.getenv('TRENDING_MAX_CONNECTIONS', '50'))  # 共享连接池最大连接数
+    TRENDING_MAX_CONNECTIONS_PER_HOST = int(os.getenv('TRENDING_MAX_CONNECTIONS_PER_HOST', '4'))  # 单个主机最大并发连接数
     
     # 小红书配置
     XHS_COOKIE = os.getenv('XHS_COOKIE', '')  # 小红书 cookie（可选，用于服务端默认配置）
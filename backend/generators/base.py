@@ -275,7 +275,8 @@ class BaseGenerator(ABC):
     def _create_error_result(
         self,
         content_type: ContentType,
-        error: str
+        error: str,
+        **metadata
     ) -> GenerationResult:
         """
         创建失败的生成结果
@@ -283,6 +284,7 @@ class BaseGenerator(ABC):
         Args:
             content_type: 内容类型
             error: 错误信息
+            **metadata: 其他元数据（如限流信息）
             
         Returns:
             GenerationResult对象
@@ -290,6 +292,7 @@ class BaseGenerator(ABC):
         return GenerationResult(
             success=False,
             content_type=content_type,
+            metadata=metadata,
             error=error
         )
     
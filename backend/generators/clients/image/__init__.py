@@ -3,5 +3,12 @@
 """
 from .image_api_client import ImageAPIClient
 from .mock_client import MockImageClient
+from .provider_limiter import ProviderThrottledError, get_all_provider_limits
+from .circuit_breaker import CircuitOpenError, find_circuit_breaker, get_all_circuit_breakers
+from .endpoint_router import EndpointRouter, get_all_endpoint_stats
 
-__all__ = ['ImageAPIClient', 'MockImageClient']
\ No newline at end of file
+__all__ = [
+    'ImageAPIClient', 'MockImageClient', 'ProviderThrottledError', 'get_all_provider_limits',
+    'CircuitOpenError', 'find_circuit_breaker', 'get_all_circuit_breakers',
+    'EndpointRouter', 'get_all_endpoint_stats'
+]
\ No newline at end of file
@@ -0,0 +1,276 @@
+"""
+图片服务商熔断器
+按服务地址统计滑动时间窗口内的请求失败率（连接错误、超时、5xx），失败率超过阈值时熔断：
+- closed: 正常放行，持续统计失败率
+- open: 直接拒绝请求，不再占用工作线程等待超时，冷却期结束后进入 half_open
+- half_open: 只放行少量探测请求，探测成功则恢复 closed，失败则重新 open
+"""
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+# 半开状态下探测名额已满时，建议其他请求稍后再试的间隔（秒）
+PROBE_RETRY_AFTER = 2.0
+
+
+class CircuitOpenError(Exception):
+    """服务商已熔断，请求未发出
+
+    probing 为 True 表示处于半开状态、探测请求尚未返回，稍后即可能恢复
+    """
+
+    def __init__(self, message: str, retry_after: float, probing: bool = False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.probing = probing
+
+
+class CircuitBreaker:
+    """单个服务地址的熔断器"""
+
+    def __init__(
+        self,
+        key: str,
+        window: Optional[float] = None,
+        min_requests: Optional[int] = None,
+        failure_rate: Optional[float] = None,
+        open_seconds: Optional[float] = None,
+        half_open_probes: Optional[int] = None
+    ):
+        """
+        初始化熔断器
+
+        Args:
+            key: 服务地址
+            window: 失败率统计窗口（秒）
+            min_requests: 窗口内至少多少个请求才判定熔断
+            failure_rate: 熔断的失败率阈值 (0-1)
+            open_seconds: 熔断后的冷却时间（秒）
+            half_open_probes: 半开状态下允许同时进行的探测请求数
+        """
+        self.key = key
+        self.window = window or Config.CIRCUIT_BREAKER_WINDOW
+        self.min_requests = max(1, min_requests or Config.CIRCUIT_BREAKER_MIN_REQUESTS)
+        self.failure_rate = failure_rate or Config.CIRCUIT_BREAKER_FAILURE_RATE
+        self.open_seconds = open_seconds or Config.CIRCUIT_BREAKER_OPEN_SECONDS
+        self.half_open_probes = max(1, half_open_probes or Config.CIRCUIT_BREAKER_HALF_OPEN_PROBES)
+
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        # 窗口内的请求结果: (时间戳, 是否成功)
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._lock = threading.Lock()
+
+        self._open_count = 0
+        self._rejected_count = 0
+
+    def _trim(self, now: float):
+        """丢弃窗口外的结果（调用方需持有 _lock）"""
+        cutoff = now - self.window
+        while self._outcomes and self._outcomes[0][0] < cutoff:
+            self._outcomes.popleft()
+
+    def _error_rate(self) -> Tuple[int, int, float]:
+        """窗口内的请求数、失败数和失败率（调用方需持有 _lock）"""
+        total = len(self._outcomes)
+        failures = sum(1 for _, ok in self._outcomes if not ok)
+        return total, failures, (failures / total if total else 0.0)
+
+    def _open(self, now: float):
+        """进入熔断状态（调用方需持有 _lock）"""
+        self._state = OPEN
+        self._opened_at = now
+        self._probes_in_flight = 0
+        self._open_count += 1
+
+    def _refresh_state(self, now: float):
+        """冷却期结束后转为半开（调用方需持有 _lock）"""
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probes_in_flight = 0
+            logger.info(f"服务商熔断冷却结束，进入半开探测: {self.key}")
+
+    @property
+    def state(self) -> str:
+        """当前状态"""
+        with self._lock:
+            self._refresh_state(time.monotonic())
+            return self._state
+
+    def retry_after(self) -> float:
+        """熔断剩余冷却时间（秒），未熔断时为0"""
+        with self._lock:
+            now = time.monotonic()
+            self._refresh_state(now)
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self.open_seconds - now)
+
+    def before_request(self) -> bool:
+        """
+        请求前检查是否放行
+
+        Returns:
+            是否为半开状态下的探测请求（需原样传给 record_success/record_failure）
+
+        Raises:
+            CircuitOpenError: 已熔断或半开探测名额已满
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refresh_state(now)
+
+            if self._state == CLOSED:
+                return False
+
+            if self._state == HALF_OPEN and self._probes_in_flight < self.half_open_probes:
+                self._probes_in_flight += 1
+                return True
+
+            self._rejected_count += 1
+            if self._state == HALF_OPEN:
+                raise CircuitOpenError('服务商正在恢复探测中', retry_after=PROBE_RETRY_AFTER, probing=True)
+            retry_after = max(1.0, self._opened_at + self.open_seconds - now)
+            raise CircuitOpenError(
+                f"图片生成服务暂时不可用（连续请求失败已熔断），约 {retry_after:.0f} 秒后恢复",
+                retry_after=retry_after
+            )
+
+    def record_success(self, probe: bool = False):
+        """
+        记录成功（服务商有响应，包括 4xx 和限流）
+
+        Args:
+            probe: before_request() 的返回值
+        """
+        with self._lock:
+            now = time.monotonic()
+            if probe and self._state == HALF_OPEN:
+                # 探测成功，恢复正常并清空旧的失败记录
+                self._state = CLOSED
+                self._probes_in_flight = 0
+                self._outcomes.clear()
+                logger.info(f"服务商探测成功，熔断恢复: {self.key}")
+            self._outcomes.append((now, True))
+            self._trim(now)
+
+    def record_failure(self, probe: bool = False):
+        """
+        记录失败（连接错误、超时、5xx），失败率超过阈值时熔断
+
+        Args:
+            probe: before_request() 的返回值
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._outcomes.append((now, False))
+            self._trim(now)
+
+            if self._state == HALF_OPEN:
+                if probe:
+                    self._open(now)
+                    logger.warning(f"服务商探测失败，重新熔断 {self.open_seconds:.0f}s: {self.key}")
+                return
+
+            if self._state == CLOSED:
+                total, failures, rate = self._error_rate()
+                if total >= self.min_requests and rate >= self.failure_rate:
+                    self._open(now)
+                    logger.warning(
+                        f"服务商失败率 {rate:.0%} ({failures}/{total})，熔断 {self.open_seconds:.0f}s: {self.key}"
+                    )
+
+    def release_probe(self, probe: bool):
+        """请求未得出结果（如被中断）时归还半开探测名额"""
+        if not probe:
+            return
+        with self._lock:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取熔断器状态和滚动错误率
+
+        Returns:
+            状态字典，health_score 为 0-1 的健康分（熔断时为0）
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refresh_state(now)
+            self._trim(now)
+            total, failures, rate = self._error_rate()
+            return {
+                'endpoint': self.key,
+                'state': self._state,
+                'requests': total,
+                'failures': failures,
+                'error_rate': round(rate, 3),
+                'health_score': 0.0 if self._state == OPEN else round(1 - rate, 3),
+                'open_remaining': round(
+                    max(0.0, self._opened_at + self.open_seconds - now) if self._state == OPEN else 0.0, 2
+                ),
+                'window_seconds': self.window,
+                'opened': self._open_count,
+                'rejected': self._rejected_count
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(api_url: str) -> CircuitBreaker:
+    """
+    获取（或创建）服务地址对应的熔断器，进程内共享
+
+    Args:
+        api_url: API 地址
+
+    Returns:
+        CircuitBreaker 实例
+    """
+    key = api_url.rstrip('/')
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(key)
+            _breakers[key] = breaker
+        return breaker
+
+
+def find_circuit_breaker(api_url: str) -> Optional[CircuitBreaker]:
+    """
+    查找服务地址已有的熔断器（不创建）
+
+    Args:
+        api_url: API 地址
+
+    Returns:
+        CircuitBreaker 实例，从未请求过该地址时返回None
+    """
+    with _breakers_lock:
+        return _breakers.get(api_url.rstrip('/'))
+
+
+def get_all_circuit_breakers() -> List[Dict[str, Any]]:
+    """
+    获取所有服务地址的熔断状态
+
+    Returns:
+        各熔断器状态列表
+    """
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return [breaker.get_stats() for breaker in breakers]
@@ -0,0 +1,432 @@
+"""
+图片服务多端点路由
+同一模型配置可以对应多个等价的服务端点，路由器按策略排序后依次尝试：
+- ordered: 按配置顺序，已熔断的端点排到最后
+- weighted: 按权重随机排序
+- latency: 按观测到的 p50 延迟和错误率打分，尚无样本的端点优先试用
+
+端点出错（连接错误、超时、5xx、限流、熔断）时切换到下一个端点；4xx 等请求本身的错误直接返回。
+本地 API 密钥限速等待过久时，不再切换到使用同一密钥的端点（共享同一令牌桶，只会重复等待），
+没有其他密钥的端点可用时由调用方重新排队。
+启用对冲请求时，首个端点超过其 p95 延迟仍未返回，就向下一个端点再发一次，取先成功的结果。
+"""
+import logging
+import math
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from requests.exceptions import ConnectionError, Timeout
+
+from config import Config
+from utils.http_pool import get_request_listener, set_request_listener
+from ..rate_limiter import add_wait_time, take_wait_time
+from .circuit_breaker import OPEN, CircuitOpenError
+from .image_api_client import ImageAPIClient, ImageAPIError
+from .provider_limiter import ProviderThrottledError
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ('ordered', 'weighted', 'latency')
+
+# 错误率对延迟打分的放大系数：错误率 25% 的端点相当于慢一倍
+ERROR_RATE_PENALTY = 4.0
+
+
+class EndpointStats:
+    """单个端点最近请求的延迟和错误统计（进程内按服务地址共享）"""
+
+    def __init__(self, key: str, max_samples: int):
+        """
+        初始化统计
+
+        Args:
+            key: 服务地址
+            max_samples: 保留的最近请求数
+        """
+        self.key = key
+        # 最近请求的结果: 成功为耗时（秒），失败为None
+        self._samples: Deque[Optional[float]] = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+        self._hedged_count = 0
+        self._hedge_wins = 0
+
+    def record(self, latency: Optional[float]):
+        """记录一次请求结果（失败传None）"""
+        with self._lock:
+            self._samples.append(latency)
+
+    def record_hedge(self, won: bool):
+        """记录一次以该端点为对冲目标的请求"""
+        with self._lock:
+            self._hedged_count += 1
+            if won:
+                self._hedge_wins += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        计算延迟分位数和错误率
+
+        Returns:
+            {'samples', 'p50', 'p95', 'error_rate'}，没有成功样本时分位数为None
+        """
+        with self._lock:
+            samples = list(self._samples)
+        latencies = sorted(value for value in samples if value is not None)
+        return {
+            'samples': len(latencies),
+            'p50': _percentile(latencies, 50),
+            'p95': _percentile(latencies, 95),
+            'error_rate': (len(samples) - len(latencies)) / len(samples) if samples else 0.0
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取统计信息（用于接口展示）"""
+        snapshot = self.snapshot()
+        with self._lock:
+            hedged, wins = self._hedged_count, self._hedge_wins
+        return {
+            'endpoint': self.key,
+            'samples': snapshot['samples'],
+            'p50': round(snapshot['p50'], 2) if snapshot['p50'] is not None else None,
+            'p95': round(snapshot['p95'], 2) if snapshot['p95'] is not None else None,
+            'error_rate': round(snapshot['error_rate'], 3),
+            'hedged': hedged,
+            'hedge_wins': wins
+        }
+
+
+def _percentile(sorted_values: List[float], percent: float) -> Optional[float]:
+    """已排序样本的分位数（最近秩法）"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+_stats: Dict[str, EndpointStats] = {}
+_stats_lock = threading.Lock()
+
+
+def get_endpoint_stats(api_url: str) -> EndpointStats:
+    """获取（或创建）服务地址的延迟统计"""
+    key = api_url.rstrip('/')
+    with _stats_lock:
+        stats = _stats.get(key)
+        if stats is None:
+            stats = EndpointStats(key, Config.IMAGE_ROUTER_LATENCY_SAMPLES)
+            _stats[key] = stats
+        return stats
+
+
+def get_all_endpoint_stats() -> List[Dict[str, Any]]:
+    """
+    获取所有端点的延迟分位数、错误率和对冲统计
+
+    Returns:
+        各端点统计列表
+    """
+    with _stats_lock:
+        stats = list(_stats.values())
+    return [item.get_stats() for item in stats]
+
+
+# 对冲请求使用的共享线程池（首次对冲时创建）
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+_hedge_executor_lock = threading.Lock()
+
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    """获取对冲请求线程池"""
+    global _hedge_executor
+    with _hedge_executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(
+                max_workers=Config.MAX_CONCURRENT_GENERATIONS * 2,
+                thread_name_prefix='image-hedge'
+            )
+        return _hedge_executor
+
+
+def _is_retryable(error: BaseException) -> bool:
+    """端点本身的故障可以换端点重试，请求参数等错误换端点也无济于事"""
+    if isinstance(error, (ConnectionError, Timeout, CircuitOpenError, ProviderThrottledError)):
+        return True
+    if isinstance(error, ImageAPIError):
+        return error.status_code >= 500 or error.status_code in (0, 408)
+    return False
+
+
+class EndpointRouter:
+    """多端点图片客户端：与 ImageAPIClient 接口一致，按策略选择端点并故障切换"""
+
+    def __init__(
+        self,
+        clients: List[ImageAPIClient],
+        weights: Optional[List[float]] = None,
+        strategy: Optional[str] = None,
+        hedge: Optional[bool] = None
+    ):
+        """
+        初始化路由器
+
+        Args:
+            clients: 等价端点的客户端列表，第一个为主端点
+            weights: 各端点权重（weighted/latency 策略使用），默认均为1
+            strategy: 选择策略 (ordered/weighted/latency)，默认 IMAGE_ROUTER_STRATEGY
+            hedge: 是否启用对冲请求，默认 IMAGE_HEDGE_ENABLED
+        """
+        if not clients:
+            raise ValueError("至少需要一个服务端点")
+        self.clients = clients
+        self.weights = [max(0.01, float(w)) for w in (weights or [1.0] * len(clients))]
+        self.strategy = strategy or Config.IMAGE_ROUTER_STRATEGY
+        if self.strategy not in STRATEGIES:
+            raise ValueError(f"不支持的路由策略: {self.strategy}，支持的策略: {STRATEGIES}")
+        self.hedge = Config.IMAGE_HEDGE_ENABLED if hedge is None else hedge
+        self._stats = [get_endpoint_stats(client.api_url) for client in clients]
+
+        logger.info(
+            f"多端点路由初始化: {len(clients)} 个端点, 策略={self.strategy}, 对冲={self.hedge}"
+        )
+
+    # 与 ImageAPIClient 保持一致的属性（结果缓存键、参考图压缩、时限配置按主端点计算）
+    @property
+    def api_url(self) -> str:
+        return self.clients[0].api_url
+
+    @property
+    def model(self) -> str:
+        return self.clients[0].model
+
+    @property
+    def api_format(self) -> str:
+        return self.clients[0].api_format
+
+    def _rank(self) -> List[int]:
+        """
+        按策略排列端点顺序，已熔断的端点排到最后
+
+        Returns:
+            端点下标列表
+        """
+        indexes = list(range(len(self.clients)))
+
+        if self.strategy == 'weighted':
+            # 按权重无放回抽样
+            indexes.sort(key=lambda i: -random.random() ** (1.0 / self.weights[i]))
+        elif self.strategy == 'latency':
+            snapshots = [stats.snapshot() for stats in self._stats]
+
+            def score(i: int) -> tuple:
+                snapshot = snapshots[i]
+                if snapshot['p50'] is None:
+                    # 没有成功样本：从未请求过的优先试用，只失败过的排后
+                    return (0 if snapshot['error_rate'] == 0 else 2, 0.0)
+                penalty = 1 + ERROR_RATE_PENALTY * snapshot['error_rate']
+                return (1, snapshot['p50'] * penalty / self.weights[i])
+
+            indexes.sort(key=lambda i: (score(i), random.random()))
+
+        def is_open(i: int) -> bool:
+            breaker = self.clients[i].breaker
+            return breaker is not None and breaker.state == OPEN
+
+        return [i for i in indexes if not is_open(i)] + [i for i in indexes if is_open(i)]
+
+    def _call(self, index: int, prompt: str, width: int, height: int, reference_image: Optional[str]) -> str:
+        """调用单个端点并记录延迟"""
+        started = time.monotonic()
+        try:
+            result = self.clients[index].generate(prompt, width, height, reference_image)
+        except (ProviderThrottledError, CircuitOpenError):
+            # 限流和熔断是请求未完成的信号，不计入端点延迟统计
+            raise
+        except BaseException:
+            self._stats[index].record(None)
+            raise
+        self._stats[index].record(time.monotonic() - started)
+        return result
+
+    def _call_hedged(
+        self,
+        index: int,
+        listener,
+        prompt: str,
+        width: int,
+        height: int,
+        reference_image: Optional[str]
+    ) -> Tuple[Optional[str], Optional[BaseException], float]:
+        """
+        在对冲线程中调用单个端点
+
+        限速等待时间记在执行线程上，连同结果一起返回给发起线程汇总；
+        发起线程的请求回调（单页计时）转交到执行线程。
+
+        Returns:
+            (结果, 异常, 限速等待秒数)
+        """
+        set_request_listener(listener)
+        take_wait_time()
+        try:
+            result = self._call(index, prompt, width, height, reference_image)
+            return result, None, take_wait_time()
+        except Exception as e:
+            return None, e, take_wait_time()
+        finally:
+            set_request_listener(None)
+
+    def _drop_key_limited(self, error: BaseException, index: int, queue: List[int]):
+        """
+        API 密钥限速等待过久时，从待试端点中移除使用同一密钥的端点
+
+        Args:
+            error: 端点返回的异常
+            index: 出错的端点下标
+            queue: 待试端点下标列表（原地修改）
+        """
+        limiter = self.clients[index].rate_limiter
+        if not getattr(error, 'key_limited', False) or limiter is None:
+            return
+        skipped = [i for i in queue if self.clients[i].rate_limiter is limiter]
+        if skipped:
+            queue[:] = [i for i in queue if i not in skipped]
+            logger.info(
+                f"API 密钥限速等待过久，跳过使用同一密钥的端点: "
+                f"{[self.clients[i].api_url for i in skipped]}"
+            )
+
+    def _hedge_delay(self, index: int) -> Optional[float]:
+        """对冲等待时间：端点的 p95 延迟，样本不足时不对冲"""
+        snapshot = self._stats[index].snapshot()
+        if snapshot['samples'] < Config.IMAGE_HEDGE_MIN_SAMPLES or snapshot['p95'] is None:
+            return None
+        return max(Config.IMAGE_HEDGE_MIN_DELAY, snapshot['p95'])
+
+    def generate(
+        self,
+        prompt: str,
+        width: int = 1024,
+        height: int = 1024,
+        reference_image: Optional[str] = None
+    ) -> str:
+        """
+        生成图片，端点故障时切换到下一个端点
+
+        Args:
+            prompt: 图片描述
+            width: 宽度
+            height: 高度
+            reference_image: 参考图片（base64 或 URL）
+
+        Returns:
+            图片 URL 或 base64 数据
+        """
+        order = self._rank()
+        if self.hedge and len(order) > 1:
+            return self._generate_hedged(order, prompt, width, height, reference_image)
+
+        errors: List[BaseException] = []
+        queue = list(order)
+        while queue:
+            index = queue.pop(0)
+            try:
+                return self._call(index, prompt, width, height, reference_image)
+            except Exception as e:
+                if not _is_retryable(e):
+                    raise
+                errors.append(e)
+                self._drop_key_limited(e, index, queue)
+                if queue:
+                    logger.warning(
+                        f"图片端点失败，切换到下一个端点: {self.clients[index].api_url}, {e}"
+                    )
+        raise self._combine_errors(errors)
+
+    def _generate_hedged(
+        self,
+        order: List[int],
+        prompt: str,
+        width: int,
+        height: int,
+        reference_image: Optional[str]
+    ) -> str:
+        """
+        带对冲的生成：首个端点超过 p95 延迟未返回时并行请求下一个端点，先成功者胜出
+
+        出错的端点同样会切换到下一个端点；落败请求的结果直接丢弃。
+        各请求的限速等待时间计入当前线程，与不对冲时一样由调用方取出。
+        """
+        executor = _get_hedge_executor()
+        listener = get_request_listener()
+        queue = list(order)
+        in_flight: Dict[Future, int] = {}
+        errors: List[BaseException] = []
+        hedged_index: Optional[int] = None
+
+        def launch():
+            index = queue.pop(0)
+            future = executor.submit(
+                self._call_hedged, index, listener, prompt, width, height, reference_image
+            )
+            in_flight[future] = index
+            return index
+
+        primary = launch()
+        while in_flight:
+            timeout = None
+            if hedged_index is None and queue and len(in_flight) == 1:
+                timeout = self._hedge_delay(next(iter(in_flight.values())))
+
+            done, _ = wait(list(in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # 超过 p95 仍未返回，向下一个端点发出对冲请求
+                hedged_index = launch()
+                logger.info(
+                    f"图片端点响应慢，对冲请求: {self.clients[primary].api_url} -> "
+                    f"{self.clients[hedged_index].api_url} (等待 {timeout:.1f}s)"
+                )
+                continue
+
+            for future in done:
+                index = in_flight.pop(future)
+                result, error, waited = future.result()
+                add_wait_time(waited)
+                if error is not None:
+                    if not _is_retryable(error):
+                        raise error
+                    errors.append(error)
+                    self._drop_key_limited(error, index, queue)
+                    continue
+                if hedged_index is not None:
+                    self._stats[hedged_index].record_hedge(won=index == hedged_index)
+                return result
+
+            if not in_flight and queue:
+                launch()
+
+        if hedged_index is not None:
+            self._stats[hedged_index].record_hedge(won=False)
+        raise self._combine_errors(errors)
+
+    @staticmethod
+    def _combine_errors(errors: List[BaseException]) -> BaseException:
+        """
+        所有端点都失败时的最终异常：全部被限流则按最短 Retry-After 重新排队，否则返回最后一个错误
+        """
+        if errors and all(isinstance(e, ProviderThrottledError) for e in errors):
+            retry_afters = [e.retry_after for e in errors if e.retry_after]
+            local = all(e.local for e in errors)
+            return ProviderThrottledError(
+                str(errors[-1]),
+                retry_after=min(retry_afters) if retry_afters else None,
+                status_code=errors[-1].status_code,
+                local=local,
+                key_limited=all(e.key_limited for e in errors),
+                # 请求均未发出时，挂起到任一并发名额已满的端点释放名额
+                limiter=next((e.limiter for e in errors if e.limiter is not None), None) if local else None
+            )
+        return errors[-1]
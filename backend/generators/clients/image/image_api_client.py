@@ -6,10 +6,19 @@
 - gemini: Google Gemini API 格式
 """
 import logging
-import requests
 from requests.exceptions import HTTPError, ConnectionError, Timeout
 from typing import Optional
 
+from config import Config
+from utils.http_pool import get_http_session, notify_request_sent
+from ..rate_limiter import RateLimitExceeded, get_api_key_limiter
+from .circuit_breaker import CircuitOpenError, get_circuit_breaker
+from .provider_limiter import (
+    ProviderThrottledError,
+    THROTTLE_STATUS_CODES,
+    get_provider_limiter,
+    parse_retry_after
+)
 from .image_utils import (
     clean_base64,
     calculate_aspect_ratio,
@@ -20,12 +29,33 @@ from .image_utils import (
 logger = logging.getLogger(__name__)
 
 
+class ImageAPIError(Exception):
+    """图片 API 返回的 HTTP 错误（带友好错误信息和状态码）"""
+
+    def __init__(self, message: str, status_code: int = 0):
+        super().__init__(message)
+        self.status_code = status_code
+
+
 class ImageAPIClient:
     """通用图片 API 客户端"""
     
     # 支持的 API 格式
     SUPPORTED_FORMATS = ['openai_chat', 'openai_dalle', 'gemini']
     
+    # HTTP 状态码对应的友好错误信息
+    HTTP_ERROR_MESSAGES = {
+        400: "请求参数错误，请检查图片生成配置",
+        401: "API 密钥无效或已过期，请检查配置",
+        403: "API 访问被拒绝，请检查账户权限",
+        404: "API 端点不存在，请检查 API 地址配置",
+        429: "请求过于频繁，API 已限流，请稍后重试",
+        500: "图片生成服务内部错误，请稍后重试",
+        502: "图片生成服务网关错误，请稍后重试",
+        503: "图片生成服务暂时不可用，可能正在维护中，请稍后重试",
+        504: "图片生成服务响应超时，请稍后重试",
+    }
+    
     def __init__(self, api_key: str, api_url: str, model: str = "dall-e-3", api_format: str = "openai_dalle"):
         """
         初始化图片 API 客户端
@@ -43,6 +73,12 @@ class ImageAPIClient:
         self.api_url = api_url.rstrip('/')
         self.model = model
         self.api_format = api_format
+        # 同一 (api_url, model) 的所有客户端共享自适应并发限制器
+        self.limiter = get_provider_limiter(self.api_url, self.model)
+        # 同一 API 密钥的所有客户端共享令牌桶（未配置限速时为None）
+        self.rate_limiter = get_api_key_limiter(api_key)
+        # 同一服务地址的所有客户端共享熔断器
+        self.breaker = get_circuit_breaker(self.api_url) if Config.CIRCUIT_BREAKER_ENABLED else None
         
         logger.info(f"图片 API 客户端初始化: URL={self.api_url}, Model={self.model}, Format={self.api_format}")
     
@@ -91,20 +127,16 @@ class ImageAPIClient:
         }
         
         try:
-            response = requests.post(
+            result = self._post_json(
                 api_endpoint,
-                json=payload,
+                payload,
                 headers={
                     'Authorization': f'Bearer {self.api_key}',
                     'Content-Type': 'application/json',
                     'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-                },
-                timeout=120
+                }
             )
             
-            response.raise_for_status()
-            result = response.json()
-            
             return self._extract_from_chat_response(result)
         except HTTPError as e:
             raise self._create_friendly_error(e, api_endpoint)
@@ -135,20 +167,16 @@ class ImageAPIClient:
             payload['image'] = clean_base64(reference_image)
         
         try:
-            response = requests.post(
+            result = self._post_json(
                 api_endpoint,
-                json=payload,
+                payload,
                 headers={
                     'Authorization': f'Bearer {self.api_key}',
                     'Content-Type': 'application/json',
                     'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-                },
-                timeout=120
+                }
             )
             
-            response.raise_for_status()
-            result = response.json()
-            
             return self._extract_from_dalle_response(result)
         except HTTPError as e:
             raise self._create_friendly_error(e, api_endpoint)
@@ -190,19 +218,15 @@ class ImageAPIClient:
         }
         
         try:
-            response = requests.post(
+            result = self._post_json(
                 api_endpoint,
-                json=payload,
+                payload,
                 headers={
                     'Content-Type': 'application/json',
                     'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-                },
-                timeout=120
+                }
             )
             
-            response.raise_for_status()
-            result = response.json()
-            
             return self._extract_from_gemini_response(result)
         except HTTPError as e:
             raise self._create_friendly_error(e, api_endpoint)
@@ -211,6 +235,105 @@ class ImageAPIClient:
         except Timeout:
             raise Timeout("图片生成请求超时，请稍后重试")
     
+    def _post_json(self, api_endpoint: str, payload: dict, headers: dict) -> dict:
+        """
+        发送 JSON 请求：先检查熔断，再按 API 密钥限速，最后受服务商自适应并发上限控制
+        
+        429/503 不直接报错，而是反馈给限制器（上限减半、遵守 Retry-After）
+        并抛出 ProviderThrottledError，由调度层延迟后重新排队。
+        等待密钥令牌超过上限、熔断器半开探测尚未返回时同样抛出 ProviderThrottledError（local=True）。
+        连接错误、超时和其他 5xx 计入熔断器的失败率，服务地址已熔断时直接抛出 CircuitOpenError。
+        
+        Args:
+            api_endpoint: 请求地址
+            payload: 请求体
+            headers: 请求头
+            
+        Returns:
+            响应 JSON
+        """
+        try:
+            probe = self.breaker.before_request() if self.breaker else False
+        except CircuitOpenError as e:
+            if not e.probing:
+                raise
+            # 半开探测进行中：稍后重新排队，等待探测结果而不是直接失败
+            raise ProviderThrottledError(str(e), retry_after=e.retry_after, local=True)
+        
+        try:
+            if self.rate_limiter is not None:
+                try:
+                    self.rate_limiter.acquire(max_wait=Config.API_KEY_RATE_LIMIT_MAX_WAIT)
+                except RateLimitExceeded as e:
+                    raise ProviderThrottledError(
+                        str(e), retry_after=e.retry_after, local=True, key_limited=True
+                    )
+            
+            # 优先使用调度器为本作业预留的名额；未经调度器（如多端点路由）时不等待，名额已满即重新排队
+            acquired_at = self.limiter.claim_reservation()
+            if acquired_at is None:
+                acquired_at = self.limiter.try_acquire()
+            if acquired_at is None:
+                raise ProviderThrottledError(
+                    "服务商并发名额已满", retry_after=self.limiter.retry_in(), local=True, limiter=self.limiter
+                )
+        except BaseException:
+            self._release_probe(probe)
+            raise
+        
+        try:
+            # 单页时限从这里开始计时
+            notify_request_sent()
+            # 复用按服务地址共享的 keep-alive 连接
+            response = get_http_session(api_endpoint).post(
+                api_endpoint,
+                json=payload,
+                headers=headers,
+                timeout=120
+            )
+        except (ConnectionError, Timeout):
+            self.limiter.release()
+            if self.breaker:
+                self.breaker.record_failure(probe)
+            raise
+        except BaseException:
+            self.limiter.release()
+            self._release_probe(probe)
+            raise
+        
+        if self.breaker:
+            # 服务商有响应即视为可用（4xx 和限流不计入失败），其余 5xx 计为失败
+            if response.status_code >= 500 and response.status_code not in THROTTLE_STATUS_CODES:
+                self.breaker.record_failure(probe)
+            else:
+                self.breaker.record_success(probe)
+        
+        if response.status_code in THROTTLE_STATUS_CODES:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            self.limiter.on_throttle(acquired_at, retry_after)
+            logger.warning(
+                f"图片 API 限流: {response.status_code}, Retry-After={retry_after}, "
+                f"当前并发上限={self.limiter.limit}"
+            )
+            raise ProviderThrottledError(
+                self.HTTP_ERROR_MESSAGES[response.status_code],
+                retry_after=retry_after,
+                status_code=response.status_code
+            )
+        
+        if response.ok:
+            self.limiter.on_success()
+        else:
+            self.limiter.release()
+        
+        response.raise_for_status()
+        return response.json()
+    
+    def _release_probe(self, probe: bool):
+        """请求未发出时归还熔断器的半开探测名额"""
+        if self.breaker:
+            self.breaker.release_probe(probe)
+    
     @staticmethod
     def _extract_from_chat_response(result: dict) -> str:
         """从 Chat API 响应中提取图片 URL"""
@@ -280,19 +403,7 @@ class ImageAPIClient:
         status_code = http_error.response.status_code if http_error.response is not None else 0
         
         # 根据状态码提供友好的错误信息
-        error_messages = {
-            400: "请求参数错误，请检查图片生成配置",
-            401: "API 密钥无效或已过期，请检查配置",
-            403: "API 访问被拒绝，请检查账户权限",
-            404: "API 端点不存在，请检查 API 地址配置",
-            429: "请求过于频繁，API 已限流，请稍后重试",
-            500: "图片生成服务内部错误，请稍后重试",
-            502: "图片生成服务网关错误，请稍后重试",
-            503: "图片生成服务暂时不可用，可能正在维护中，请稍后重试",
-            504: "图片生成服务响应超时，请稍后重试",
-        }
-        
-        friendly_message = error_messages.get(
+        friendly_message = self.HTTP_ERROR_MESSAGES.get(
             status_code,
             f"图片生成服务返回错误 (HTTP {status_code})"
         )
@@ -300,4 +411,4 @@ class ImageAPIClient:
         # 记录详细错误日志
         logger.error(f"图片 API 错误: {status_code} - {http_error} - 端点: {api_endpoint}")
         
-        return Exception(friendly_message)
\ No newline at end of file
+        return ImageAPIError(friendly_message, status_code)
\ No newline at end of file
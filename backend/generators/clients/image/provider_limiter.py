@@ -0,0 +1,299 @@
+"""
+图片服务商自适应并发控制
+按 (api_url, model) 维护 AIMD 并发上限：初始为配置的并发数，成功时加性增长，429/503 时减半并遵守 Retry-After
+
+名额获取不阻塞：调度器在把作业交给工作线程前为其预留名额，没有空闲名额时作业挂起，
+名额释放时由回调唤醒，因此单个服务商被限流不会占住共享的工作线程。
+"""
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional, Tuple, List, Any
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# 视为"服务商要求降速"的状态码
+THROTTLE_STATUS_CODES = {429, 503}
+
+# 名额已满时作业重新排队的间隔（秒）
+FULL_RETRY_INTERVAL = 0.5
+
+# Retry-After 缺失时的默认退避时间（秒）
+DEFAULT_RETRY_AFTER = 5.0
+
+
+class ProviderThrottledError(Exception):
+    """服务商限流异常（HTTP 429/503），调用方应延迟后重新排队而不是直接失败
+
+    local 为 True 表示请求未发出（本地 API 密钥限速、并发名额已满、熔断探测中）；
+    key_limited 为 True 表示是 API 密钥令牌桶等待过久，同一密钥的其他端点同样受限；
+    limiter 为并发名额已满的服务商限制器，调用方可据此挂起页面直到名额释放
+    """
+
+    def __init__(
+        self,
+        message: str,
+        retry_after: Optional[float] = None,
+        status_code: int = 0,
+        local: bool = False,
+        key_limited: bool = False,
+        limiter: Optional['ProviderLimiter'] = None
+    ):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status_code = status_code
+        self.local = local
+        self.key_limited = key_limited
+        self.limiter = limiter
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    解析 Retry-After 响应头
+
+    Args:
+        value: 头部值（秒数或 HTTP 日期）
+
+    Returns:
+        需要等待的秒数，无法解析时返回None
+    """
+    if not value:
+        return None
+
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class ProviderLimiter:
+    """单个服务商的自适应并发限制器（AIMD）"""
+
+    def __init__(
+        self,
+        key: Tuple[str, str],
+        initial_limit: Optional[int] = None,
+        min_limit: int = 1,
+        max_limit: Optional[int] = None
+    ):
+        """
+        初始化限制器
+
+        Args:
+            key: (api_url, model)
+            initial_limit: 初始并发上限，默认 PROVIDER_INITIAL_CONCURRENCY（0 表示等于最大并发上限）
+            min_limit: 最小并发上限
+            max_limit: 最大并发上限，默认 MAX_CONCURRENT_GENERATIONS
+        """
+        self.key = key
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit or Config.MAX_CONCURRENT_GENERATIONS)
+        if initial_limit is None:
+            initial_limit = Config.PROVIDER_INITIAL_CONCURRENCY or self.max_limit
+        self._limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self._in_flight = 0
+        self._blocked_until = 0.0
+        self._last_decrease_at = 0.0
+        self._lock = threading.Lock()
+        # 调度器为当前线程预留名额的获取时间戳
+        self._reservations = threading.local()
+        # 名额释放回调（调度器据此唤醒等待名额的作业）
+        self._release_listeners: List[Callable[['ProviderLimiter'], None]] = []
+
+        self._success_count = 0
+        self._throttle_count = 0
+
+    @property
+    def limit(self) -> int:
+        """当前生效的并发上限"""
+        return int(self._limit)
+
+    def try_acquire(self) -> Optional[float]:
+        """
+        尝试获取一个并发名额（不阻塞）
+
+        Returns:
+            获取名额的时间戳（用于 on_throttle 判断是否需要减半），超过上限或处于 Retry-After 窗口时返回None
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._blocked_until <= now and self._in_flight < int(self._limit):
+                self._in_flight += 1
+                return now
+            return None
+
+    def available(self) -> int:
+        """当前空闲名额数（处于 Retry-After 窗口时为0）"""
+        with self._lock:
+            if self._blocked_until > time.monotonic():
+                return 0
+            return max(0, int(self._limit) - self._in_flight)
+
+    def blocked_for(self) -> float:
+        """Retry-After 窗口的剩余秒数，不在窗口内时为0"""
+        with self._lock:
+            return max(0.0, self._blocked_until - time.monotonic())
+
+    def add_release_listener(self, listener: Callable[['ProviderLimiter'], None]):
+        """
+        登记名额释放回调（在限制器锁外调用，参数为限制器本身）
+
+        Args:
+            listener: 回调函数
+        """
+        with self._lock:
+            if listener not in self._release_listeners:
+                self._release_listeners.append(listener)
+
+    def _notify_released(self):
+        """通知名额已释放（调用方不能持有 _lock）"""
+        for listener in list(self._release_listeners):
+            try:
+                listener(self)
+            except Exception as e:
+                logger.error(f"名额释放回调异常: {self.key[0]}, {e}", exc_info=True)
+
+    def retry_in(self) -> float:
+        """
+        没有空闲名额时建议的重新排队间隔
+
+        Returns:
+            处于 Retry-After 窗口时为剩余秒数，否则为 FULL_RETRY_INTERVAL
+        """
+        with self._lock:
+            blocked_for = self._blocked_until - time.monotonic()
+        return blocked_for if blocked_for > 0 else FULL_RETRY_INTERVAL
+
+    def reserve(self) -> bool:
+        """
+        为当前线程预留一个名额（调度器在执行作业前调用），之后由同一线程中的请求通过 claim_reservation() 取用
+
+        Returns:
+            是否预留成功
+        """
+        acquired_at = self.try_acquire()
+        if acquired_at is None:
+            return False
+        self._reservations.acquired_at = acquired_at
+        return True
+
+    def claim_reservation(self) -> Optional[float]:
+        """
+        取用当前线程预留的名额
+
+        Returns:
+            预留时的时间戳，没有预留时返回None
+        """
+        acquired_at = getattr(self._reservations, 'acquired_at', None)
+        self._reservations.acquired_at = None
+        return acquired_at
+
+    def cancel_reservation(self):
+        """作业结束后归还未被请求取用的预留名额（如命中缓存或请求前出错）"""
+        if self.claim_reservation() is not None:
+            self.release()
+
+    def release(self):
+        """归还并发名额（不反馈结果，如网络错误）"""
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+        self._notify_released()
+
+    def on_success(self):
+        """请求成功：归还名额并加性增长（约每轮 limit 个成功请求 +1）"""
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+            self._success_count += 1
+            self._limit = min(float(self.max_limit), self._limit + 1.0 / self._limit)
+        self._notify_released()
+
+    def on_throttle(self, acquired_at: float, retry_after: Optional[float] = None):
+        """
+        请求被限流：归还名额、上限减半并进入 Retry-After 等待窗口
+
+        同一拥塞窗口内的多个 429 只减半一次：只有在上次减半之后发出的请求才会再次触发减半。
+
+        Args:
+            acquired_at: try_acquire() 返回的时间戳
+            retry_after: 服务商要求的等待时间（秒）
+        """
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+            self._throttle_count += 1
+            now = time.monotonic()
+
+            if acquired_at >= self._last_decrease_at:
+                self._limit = max(float(self.min_limit), self._limit / 2)
+                self._last_decrease_at = now
+                logger.warning(
+                    f"服务商限流，并发上限降为 {self.limit}: {self.key[0]} ({self.key[1]})"
+                )
+
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+        self._notify_released()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取限制器状态
+
+        Returns:
+            状态字典
+        """
+        with self._lock:
+            return {
+                'api_url': self.key[0],
+                'model': self.key[1],
+                'limit': int(self._limit),
+                'in_flight': self._in_flight,
+                'max_limit': self.max_limit,
+                'blocked_for': round(max(0.0, self._blocked_until - time.monotonic()), 2),
+                'successes': self._success_count,
+                'throttled': self._throttle_count
+            }
+
+
+_limiters: Dict[Tuple[str, str], ProviderLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_provider_limiter(api_url: str, model: str) -> ProviderLimiter:
+    """
+    获取（或创建）指定服务商的限制器，进程内按 (api_url, model) 共享
+
+    Args:
+        api_url: API 地址
+        model: 模型名称
+
+    Returns:
+        ProviderLimiter 实例
+    """
+    key = (api_url.rstrip('/'), model)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = ProviderLimiter(key)
+            _limiters[key] = limiter
+        return limiter
+
+
+def get_all_provider_limits() -> List[Dict[str, Any]]:
+    """
+    获取所有服务商当前的并发上限
+
+    Returns:
+        各服务商状态列表
+    """
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return [limiter.get_stats() for limiter in limiters]
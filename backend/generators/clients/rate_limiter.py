@@ -0,0 +1,302 @@
+"""
+按 API 密钥的令牌桶限速
+同一密钥的所有客户端（所有任务、图片和文本调用）共享一个令牌桶，按 RPM/RPS 匀速补充令牌，
+允许一定突发。令牌不足时调用方排队等待，预计等待超过上限时直接拒绝，由调用方稍后重试。
+
+桶状态默认保存在进程内；RATE_LIMIT_BACKEND=sqlite 时保存在共享 SQLite 文件中，多个工作进程共用同一限额。
+"""
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    """等待令牌的时间超过上限"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# 当前线程累计的限速等待时间（秒），由调用方在一次生成结束后取出
+_wait_local = threading.local()
+
+
+def take_wait_time() -> float:
+    """
+    取出并清零当前线程累计的限速等待时间
+
+    Returns:
+        等待秒数
+    """
+    waited = getattr(_wait_local, 'seconds', 0.0)
+    _wait_local.seconds = 0.0
+    return waited
+
+
+def add_wait_time(seconds: float):
+    """
+    计入当前线程的限速等待时间（请求在其他线程中执行时，由发起线程汇总）
+
+    Args:
+        seconds: 等待秒数
+    """
+    if seconds > 0:
+        _wait_local.seconds = getattr(_wait_local, 'seconds', 0.0) + seconds
+
+
+def hash_api_key(api_key: str) -> str:
+    """API 密钥的摘要（桶标识，不在内存和日志中保留明文密钥）"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+
+class TokenBucket:
+    """单个 API 密钥的令牌桶（进程内）"""
+
+    def __init__(self, key: str, rate: float, burst: int):
+        """
+        初始化令牌桶
+
+        Args:
+            key: API 密钥摘要
+            rate: 每秒补充的令牌数
+            burst: 桶容量（允许的突发请求数）
+        """
+        self.key = key
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._acquired_count = 0
+        self._waited_count = 0
+        self._rejected_count = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _reserve(self, max_wait: Optional[float]) -> float:
+        """
+        预订一个令牌：令牌不足时记为欠账，返回需要等待的秒数
+
+        Raises:
+            RateLimitExceeded: 需要等待的时间超过 max_wait（此时不预订）
+        """
+        with self._lock:
+            now = time.monotonic()
+            tokens = min(float(self.burst), self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            wait = max(0.0, (1 - tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                self._tokens = tokens
+                raise RateLimitExceeded('API 密钥请求频率超出限制', retry_after=wait)
+            self._tokens = tokens - 1
+            return wait
+
+    def acquire(self, max_wait: Optional[float] = None) -> float:
+        """
+        获取一个令牌，不足时阻塞等待
+
+        Args:
+            max_wait: 最长等待时间（秒），None 表示一直等待
+
+        Returns:
+            实际等待的秒数（同时计入当前线程的累计等待时间）
+
+        Raises:
+            RateLimitExceeded: 预计等待时间超过 max_wait
+        """
+        try:
+            wait = self._reserve(max_wait)
+        except RateLimitExceeded:
+            with self._stats_lock:
+                self._rejected_count += 1
+            raise
+
+        if wait > 0:
+            time.sleep(wait)
+            _wait_local.seconds = getattr(_wait_local, 'seconds', 0.0) + wait
+
+        with self._stats_lock:
+            self._acquired_count += 1
+            if wait > 0:
+                self._waited_count += 1
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+        return wait
+
+    def _available_tokens(self) -> float:
+        """当前可用令牌数（负数表示已有排队的欠账）"""
+        with self._lock:
+            elapsed = time.monotonic() - self._updated_at
+            return min(float(self.burst), self._tokens + elapsed * self.rate)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取令牌桶状态
+
+        Returns:
+            状态字典
+        """
+        tokens = self._available_tokens()
+        with self._stats_lock:
+            return {
+                'key': self.key,
+                'rpm': round(self.rate * 60, 2),
+                'burst': self.burst,
+                'tokens': round(tokens, 2),
+                'acquired': self._acquired_count,
+                'waited': self._waited_count,
+                'rejected': self._rejected_count,
+                'total_wait_seconds': round(self._total_wait, 2),
+                'avg_wait_seconds': round(self._total_wait / self._waited_count, 2) if self._waited_count else 0,
+                'max_wait_seconds': round(self._max_wait, 2)
+            }
+
+
+class SQLiteTokenBucket(TokenBucket):
+    """单个 API 密钥的令牌桶（SQLite，多进程共享同一限额）"""
+
+    _local = threading.local()
+
+    def __init__(self, key: str, rate: float, burst: int, db_path: Path):
+        """
+        初始化令牌桶
+
+        Args:
+            key: API 密钥摘要
+            rate: 每秒补充的令牌数
+            burst: 桶容量
+            db_path: 数据库文件路径
+        """
+        super().__init__(key, rate, burst)
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS rate_limit_buckets ('
+            ' key TEXT PRIMARY KEY,'
+            ' tokens REAL NOT NULL,'
+            ' updated_at REAL NOT NULL'
+            ')'
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        """获取当前线程的数据库连接（每个线程每个文件一个连接）"""
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        conn = connections.get(self.db_path)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            connections[self.db_path] = conn
+        return conn
+
+    def _load(self, conn: sqlite3.Connection, now: float) -> float:
+        """读取并补充令牌（调用方需在事务内）"""
+        row = conn.execute(
+            'SELECT tokens, updated_at FROM rate_limit_buckets WHERE key = ?', (self.key,)
+        ).fetchone()
+        if row is None:
+            return float(self.burst)
+        tokens, updated_at = row
+        return min(float(self.burst), tokens + max(0.0, now - updated_at) * self.rate)
+
+    def _reserve(self, max_wait: Optional[float]) -> float:
+        """预订一个令牌（各进程通过数据库事务串行扣减）"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # 跨进程需要统一的时钟，使用墙上时间
+            now = time.time()
+            tokens = self._load(conn, now)
+            wait = max(0.0, (1 - tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                conn.execute('ROLLBACK')
+                raise RateLimitExceeded('API 密钥请求频率超出限制', retry_after=wait)
+            conn.execute(
+                'INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated_at) VALUES (?, ?, ?)',
+                (self.key, tokens - 1, now)
+            )
+            conn.execute('COMMIT')
+            return wait
+        except RateLimitExceeded:
+            raise
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _available_tokens(self) -> float:
+        """当前可用令牌数（所有进程共享）"""
+        return self._load(self._connect(), time.time())
+
+
+def get_rate_limit_settings() -> Optional[tuple]:
+    """
+    读取限速配置
+
+    Returns:
+        (每秒令牌数, 桶容量)，未配置 RPM/RPS 时返回None
+    """
+    rates = []
+    if Config.API_KEY_RATE_LIMIT_RPM > 0:
+        rates.append(Config.API_KEY_RATE_LIMIT_RPM / 60.0)
+    if Config.API_KEY_RATE_LIMIT_RPS > 0:
+        rates.append(Config.API_KEY_RATE_LIMIT_RPS)
+    if not rates:
+        return None
+    return min(rates), Config.API_KEY_RATE_LIMIT_BURST
+
+
+_buckets: Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def get_api_key_limiter(api_key: str) -> Optional[TokenBucket]:
+    """
+    获取（或创建）API 密钥对应的令牌桶，进程内按密钥摘要共享
+
+    Args:
+        api_key: API 密钥
+
+    Returns:
+        TokenBucket 实例，未配置限速或密钥为空时返回None
+    """
+    settings = get_rate_limit_settings()
+    if not api_key or settings is None:
+        return None
+
+    rate, burst = settings
+    key = hash_api_key(api_key)
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            if Config.RATE_LIMIT_BACKEND == 'sqlite':
+                bucket = SQLiteTokenBucket(key, rate, burst, Config.RATE_LIMIT_DB_PATH)
+            else:
+                bucket = TokenBucket(key, rate, burst)
+            _buckets[key] = bucket
+            logger.info(f"API 密钥限速已启用: {key}, RPM={rate * 60:.1f}, 突发={bucket.burst}, 存储={Config.RATE_LIMIT_BACKEND}")
+        return bucket
+
+
+def get_all_rate_limits() -> List[Dict[str, Any]]:
+    """
+    获取所有 API 密钥令牌桶的状态和等待统计
+
+    Returns:
+        各令牌桶状态列表
+    """
+    with _buckets_lock:
+        buckets = list(_buckets.values())
+    return [bucket.get_stats() for bucket in buckets]
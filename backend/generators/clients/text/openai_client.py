@@ -7,6 +7,9 @@ import json
 import re
 from typing import Dict, Any
 
+from config import Config
+from ..rate_limiter import get_api_key_limiter
+
 try:
     from openai import OpenAI
 except ImportError:
@@ -38,6 +41,8 @@ class OpenAITextClient:
         
         self.base_url = base_url or "https://api.openai.com/v1"
         self.model = model
+        # 与同一 API 密钥的图片请求共享令牌桶（未配置限速时为None）
+        self.rate_limiter = get_api_key_limiter(api_key)
         
         # 添加默认 User-Agent 以绕过某些网关的拦截
         default_headers = {
@@ -62,7 +67,15 @@ class OpenAITextClient:
             
         Returns:
             生成的文本内容
+            
+        Raises:
+            RateLimitExceeded: 等待 API 密钥令牌超过上限
         """
+        if self.rate_limiter is not None:
+            waited = self.rate_limiter.acquire(max_wait=Config.API_KEY_RATE_LIMIT_MAX_WAIT)
+            if waited > 0:
+                logger.info(f"OpenAI 文本请求限速等待 {waited:.1f}s")
+        
         response = self.client.chat.completions.create(
             model=self.model,
             messages=[
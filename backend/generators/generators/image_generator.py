@@ -3,11 +3,11 @@
 组合提示词构建和客户端调用，处理图片生成逻辑
 """
 import logging
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
 from ..base import BaseGenerator, ContentType, GenerationResult
 from ..prompts.image_prompts import build_image_prompt
-from ..clients.image import ImageAPIClient, MockImageClient
+from ..clients.image import ImageAPIClient, MockImageClient, ProviderThrottledError, CircuitOpenError, EndpointRouter
 from ..clients.image.image_utils import get_dalle_size
 
 logger = logging.getLogger(__name__)
@@ -45,7 +45,10 @@ class ImageGenerator(BaseGenerator):
             provider: 服务提供商 ('openai', 'image_api' 或 'mock')
             **kwargs: 其他配置参数，应包含所有必要的配置（api_key, api_url, model等）
                       在后台线程中调用时，必须显式传入所有配置
+                      endpoints: 与主端点等价的备用端点 [{url, apiKey?, model?, apiFormat?, weight?}]，
+                      未指定的字段沿用主端点配置
         """
+        endpoints = kwargs.pop('endpoints', None)
         # 从 kwargs 中提取 api_key，避免重复传递给父类
         api_key = kwargs.pop('api_key', '')
         super().__init__(api_key=api_key, **kwargs)
@@ -65,7 +68,8 @@ class ImageGenerator(BaseGenerator):
                 raise ValueError("OPENAI_API_KEY 未配置")
             
             # 使用 ImageAPIClient 的 openai_dalle 格式
-            self.client = ImageAPIClient(
+            self.client = self._create_api_client(
+                endpoints,
                 api_key=final_api_key,
                 api_url=base_url or "https://api.openai.com",
                 model=model,
@@ -81,7 +85,12 @@ class ImageGenerator(BaseGenerator):
             if not final_api_key or not api_url:
                 raise ValueError("IMAGE_API_KEY 或 IMAGE_API_URL 未配置")
             
-            self.client = ImageAPIClient(
+            if endpoints is None and not kwargs.get('api_url'):
+                # 使用服务端配置时，备用端点同样来自服务端配置
+                endpoints = [{'url': url} for url in _get_flask_config('IMAGE_API_FALLBACK_URLS', [])]
+            
+            self.client = self._create_api_client(
+                endpoints,
                 api_key=final_api_key,
                 api_url=api_url,
                 model=model,
@@ -92,6 +101,44 @@ class ImageGenerator(BaseGenerator):
         
         logger.info(f"图片生成器初始化完成: provider={provider}")
     
+    @staticmethod
+    def _create_api_client(
+        endpoints: Optional[List[Dict[str, Any]]],
+        api_key: str,
+        api_url: str,
+        model: str,
+        api_format: str
+    ):
+        """
+        创建 API 客户端，配置了备用端点时返回多端点路由器
+        
+        Args:
+            endpoints: 备用端点列表，未指定的字段沿用主端点配置
+            api_key: 主端点 API 密钥
+            api_url: 主端点地址
+            model: 模型名称
+            api_format: API 格式
+            
+        Returns:
+            ImageAPIClient 或 EndpointRouter
+        """
+        primary = ImageAPIClient(api_key=api_key, api_url=api_url, model=model, api_format=api_format)
+        extra = [endpoint for endpoint in endpoints or [] if endpoint.get('url', '').strip()]
+        if not extra:
+            return primary
+        
+        clients = [primary]
+        weights = [1.0]
+        for endpoint in extra:
+            clients.append(ImageAPIClient(
+                api_key=endpoint.get('apiKey', '').strip() or api_key,
+                api_url=endpoint['url'].strip(),
+                model=endpoint.get('model', '').strip() or model,
+                api_format=endpoint.get('apiFormat') or api_format
+            ))
+            weights.append(float(endpoint.get('weight', 1.0)))
+        return EndpointRouter(clients, weights)
+    
     def generate(
         self,
         content_type: ContentType,
@@ -128,8 +175,8 @@ class ImageGenerator(BaseGenerator):
             # 2. 调用客户端生成
             if isinstance(self.client, MockImageClient):
                 image_url = self.client.generate(prompt, width, height, reference_image)
-            elif isinstance(self.client, ImageAPIClient):
-                # ImageAPIClient 统一处理所有格式
+            elif isinstance(self.client, (ImageAPIClient, EndpointRouter)):
+                # ImageAPIClient 统一处理所有格式，EndpointRouter 在多个等价端点间路由
                 image_url = self.client.generate(prompt, width, height, reference_image)
             else:
                 raise ValueError(f"未知的客户端类型: {type(self.client)}")
@@ -142,6 +189,26 @@ class ImageGenerator(BaseGenerator):
                 height=height
             )
             
+        except ProviderThrottledError as e:
+            # 限流不是失败，交由调用方延迟后重新排队
+            logger.warning(f"图片生成被限流: {e}, Retry-After={e.retry_after}")
+            return self._create_error_result(
+                ContentType.IMAGE,
+                str(e),
+                throttled=True,
+                retry_after=e.retry_after,
+                rate_limited=e.local,
+                full_limiter=e.limiter
+            )
+        except CircuitOpenError as e:
+            # 服务商已熔断，请求未发出，直接失败
+            logger.warning(f"图片生成服务已熔断: {e}")
+            return self._create_error_result(
+                ContentType.IMAGE,
+                str(e),
+                circuit_open=True,
+                retry_after=e.retry_after
+            )
         except Exception as e:
             logger.error(f"图片生成失败: {e}", exc_info=True)
             return self._create_error_result(ContentType.IMAGE, str(e))
\ No newline at end of file
@@ -0,0 +1,156 @@
+"""
+生成任务准入控制
+新任务提交前按全局调度队列的积压工作量判断是否接受：
+排队页数超出预算返回 429，预计等待时间超出上限返回 503，两者都附带建议的重试时间；
+接受的任务返回排队位置和按各服务商实测吞吐估算的完成时间。
+"""
+import logging
+import math
+import threading
+from typing import Any, Dict, Optional
+
+from config import Config
+from .generation_scheduler import GenerationScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionController:
+    """准入控制器类 - 线程安全的单例模式
+
+    调度器只能看到已提交的作业，已准入但尚未提交完页面的任务先登记为预留，
+    避免并发请求同时通过检查后一起超出预算。
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        """单例模式实现"""
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        """初始化准入控制器"""
+        if not hasattr(self, '_initialized'):
+            self.scheduler = GenerationScheduler()
+            self.max_queued_pages = Config.ADMISSION_MAX_QUEUED_PAGES
+            self.max_wait_seconds = Config.ADMISSION_MAX_WAIT_SECONDS
+            self._admit_lock = threading.Lock()
+            # 已准入、页面尚未全部提交到调度器的预留工作量
+            self._reserved_pages = 0
+            self._reserved_seconds = 0.0
+            self._admitted_count = 0
+            self._rejected_count = {429: 0, 503: 0}
+            self._initialized = True
+            logger.info(
+                f"准入控制已初始化: 排队页数上限={self.max_queued_pages or '不限'}, "
+                f"等待时间上限={self.max_wait_seconds or '不限'}s"
+            )
+
+    def admit(self, pages: int, provider: Optional[str] = None) -> Dict[str, Any]:
+        """
+        判断新任务是否可以进入生成队列，接受时预留其工作量
+
+        Args:
+            pages: 任务页数
+            provider: 服务商标识（用于估算单页耗时）
+
+        Returns:
+            准入结果:
+            - 接受: {'admitted': True, 'queue_position': 前面排队的页数, 'eta_seconds': 预计完成秒数, ...}
+            - 拒绝: {'admitted': False, 'status_code': 429/503, 'message': 原因,
+                     'retry_after': 建议重试秒数, 'estimated_wait': 预计等待秒数}
+            接受的结果需在页面提交完成后传给 release() 释放预留
+        """
+        workers = self.scheduler.max_workers
+        page_seconds = self.scheduler.estimate_page_seconds(provider)
+
+        with self._admit_lock:
+            load = self.scheduler.get_load()
+            pending = load['pending'] + self._reserved_pages
+            backlog = load['backlog_seconds'] + self._reserved_seconds
+
+            # 全部工作线程都被占用时才需要排队，等待时间按积压工作量均摊到所有线程估算
+            if load['running'] + pending < workers:
+                wait = 0.0
+            else:
+                wait = backlog / workers
+
+            if self.max_queued_pages and pending > 0 and pending + pages > self.max_queued_pages:
+                # 需要先完成的页数按积压的平均单页耗时折算
+                excess = pending + pages - self.max_queued_pages
+                average = backlog / pending if pending else page_seconds
+                return self._reject(
+                    429,
+                    f'生成队列已满（排队 {pending} 页，上限 {self.max_queued_pages} 页），请稍后重试',
+                    retry_after=excess * average / workers,
+                    estimated_wait=wait
+                )
+
+            if self.max_wait_seconds and wait > self.max_wait_seconds:
+                return self._reject(
+                    503,
+                    f'生成服务繁忙，预计等待 {math.ceil(wait)} 秒，请稍后重试',
+                    retry_after=wait - self.max_wait_seconds,
+                    estimated_wait=wait
+                )
+
+            seconds = pages * page_seconds
+            self._reserved_pages += pages
+            self._reserved_seconds += seconds
+            self._admitted_count += 1
+
+        # 任务与其他任务轮转共享工作线程，但每页至少需要一个单页耗时
+        eta = max((backlog + seconds) / workers, math.ceil(pages / workers) * page_seconds)
+        return {
+            'admitted': True,
+            'pages': pages,
+            'seconds': seconds,
+            'queue_position': pending,
+            'estimated_wait': math.ceil(wait),
+            'eta_seconds': math.ceil(eta)
+        }
+
+    def _reject(self, status_code: int, message: str, retry_after: float, estimated_wait: float) -> Dict[str, Any]:
+        """记录并构造拒绝结果（调用方需持有 _admit_lock）"""
+        self._rejected_count[status_code] += 1
+        logger.warning(f"拒绝新生成任务 ({status_code}): {message}")
+        return {
+            'admitted': False,
+            'status_code': status_code,
+            'message': message,
+            'retry_after': max(1, math.ceil(retry_after)),
+            'estimated_wait': math.ceil(estimated_wait)
+        }
+
+    def release(self, decision: Dict[str, Any]):
+        """
+        释放已准入任务的预留工作量（页面已提交到调度器或任务启动失败）
+
+        Args:
+            decision: admit() 返回的准入结果
+        """
+        if not decision.get('admitted'):
+            return
+        with self._admit_lock:
+            self._reserved_pages = max(0, self._reserved_pages - decision['pages'])
+            self._reserved_seconds = max(0.0, self._reserved_seconds - decision['seconds'])
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取准入控制统计"""
+        load = self.scheduler.get_load()
+        with self._admit_lock:
+            return {
+                'max_queued_pages': self.max_queued_pages,
+                'max_wait_seconds': self.max_wait_seconds,
+                'pending_pages': load['pending'],
+                'reserved_pages': self._reserved_pages,
+                'estimated_wait_seconds': math.ceil(load['backlog_seconds'] / self.scheduler.max_workers),
+                'admitted': self._admitted_count,
+                'rejected_queue_full': self._rejected_count[429],
+                'rejected_wait_too_long': self._rejected_count[503]
+            }
@@ -0,0 +1,777 @@
+"""
+图片生成调度服务
+进程级共享的页面生成调度器：全局并发上限 + 按任务轮转的公平队列 + 超时看门狗
+"""
+import functools
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from config import Config
+from utils.http_pool import set_request_listener
+
+logger = logging.getLogger(__name__)
+
+# 等待服务商名额的作业兜底重新检查间隔（秒），正常情况下由名额释放回调立即唤醒
+PARKED_RECHECK_SECONDS = 5.0
+
+
+class CancellationToken:
+    """任务取消令牌
+
+    调度器在每个作业开始前检查令牌，已取消任务的作业不再执行。
+    已在执行的作业有一段宽限期：宽限期内完成的结果仍然保留，之后到达的结果被放弃。
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._abandon_at: Optional[float] = None
+
+    def cancel(self, grace_period: float = 0):
+        """
+        取消任务
+
+        Args:
+            grace_period: 执行中作业的宽限期（秒）
+        """
+        if not self._event.is_set():
+            self._abandon_at = time.monotonic() + max(0.0, grace_period)
+            self._event.set()
+
+    @property
+    def is_cancelled(self) -> bool:
+        """是否已取消"""
+        return self._event.is_set()
+
+    @property
+    def is_abandoned(self) -> bool:
+        """是否已取消且超过宽限期（执行中作业的结果应被放弃）"""
+        return self._event.is_set() and time.monotonic() >= self._abandon_at
+
+
+class GenerationTimeoutError(TimeoutError):
+    """页面作业超过单页或任务时限"""
+
+
+class GenerationJob:
+    """调度队列中的单个页面生成作业"""
+
+    def __init__(
+        self,
+        task_id: str,
+        fn: Callable,
+        args: tuple,
+        kwargs: Dict[str, Any],
+        cancel_token: Optional[CancellationToken] = None,
+        page_timeout: Optional[float] = None,
+        task_deadline: Optional[float] = None,
+        provider: Optional[str] = None,
+        limiter: Optional[Any] = None,
+        record_time: bool = True
+    ):
+        self.task_id = task_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.cancel_token = cancel_token
+        self.page_timeout = page_timeout
+        self.task_deadline = task_deadline
+        self.provider = provider
+        self.limiter = limiter
+        self.record_time = record_time
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+        self.not_before = self.enqueued_at
+        self.started_at: Optional[float] = None
+        # 单页时限的计时起点：请求实际发出时设置（见 _restart_page_clock），发出前按开始执行时间加限速等待上限
+        self.page_clock_at: Optional[float] = None
+        # queued -> running -> done / timed_out，由调度器在 _cond 下维护
+        self.state = 'queued'
+        # 是否正挂起等待服务商名额释放（在延迟队列中）
+        self.waiting_for_slot = False
+
+    def deadline(self) -> Optional[float]:
+        """当前生效的截止时间：排队时为任务截止时间，执行中再叠加单页时限"""
+        deadline = self.task_deadline
+        if self.page_clock_at is not None and self.page_timeout:
+            page_deadline = self.page_clock_at + self.page_timeout
+            deadline = page_deadline if deadline is None else min(deadline, page_deadline)
+        return deadline
+
+    def timeout_error(self) -> GenerationTimeoutError:
+        """构造超时异常（区分单页超时和任务整体超时）"""
+        if self.page_clock_at is not None and self.page_timeout and (
+            self.task_deadline is None or self.page_clock_at + self.page_timeout <= self.task_deadline
+        ):
+            return GenerationTimeoutError(f'单页生成超时（{self.page_timeout:g} 秒）')
+        return GenerationTimeoutError('任务整体超时，页面未能按时完成')
+
+
+class GenerationScheduler:
+    """图片生成调度器 - 线程安全的单例模式
+
+    所有批次共享同一组工作线程，全局同时执行的页面数不超过 max_workers。
+    每个 task_id 拥有独立的队列，工作线程按任务轮转取作业，
+    因此 50 页的大任务不会饿死后提交的 6 页小任务。
+
+    每个作业可标注所属服务商，调度器按服务商统计单页执行耗时（指数移动平均），
+    用于估算排队等待时间和准入控制。作业还可带服务商并发限制器：调度器只在该服务商有空闲名额时
+    才把作业交给工作线程（名额预留给执行线程），名额已满时作业挂起，名额释放时按空闲名额数唤醒，
+    服务商处于 Retry-After 窗口时作业延迟到窗口结束，工作线程继续调度其他作业。
+
+    作业可带单页时限和任务截止时间，由看门狗线程按时判定超时：
+    单页时限在请求实际发出时重新计时（发送前的限速等待不计入），
+    执行中的作业超时后 Future 立即以 GenerationTimeoutError 结束，
+    卡住的工作线程被放弃，并补充一个新的工作线程顶替其名额；
+    被放弃的线程超过 MAX_ABANDONED_WORKERS 时不再补充，等其调用返回后直接接着调度作业。
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls, max_workers: Optional[int] = None):
+        """单例模式实现"""
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self, max_workers: Optional[int] = None):
+        """
+        初始化调度器（仅首次生效）
+
+        Args:
+            max_workers: 全局最大并发数，默认读取 MAX_CONCURRENT_GENERATIONS
+        """
+        if not hasattr(self, '_initialized'):
+            self.max_workers = max(1, max_workers or Config.MAX_CONCURRENT_GENERATIONS)
+            # 轮转队列: {task_id: deque[GenerationJob]}，队首任务下一个被调度
+            self._queues: 'OrderedDict[str, Deque[GenerationJob]]' = OrderedDict()
+            self._running: Dict[str, int] = {}
+            self._running_jobs: set = set()
+            # 延迟作业（如被限流后重新排队）: [(not_before, seq, job)]
+            self._delayed: List[Tuple[float, int, GenerationJob]] = []
+            self._delayed_seq = itertools.count()
+            # 工作线程与看门狗共用同一把锁，各自使用独立的条件变量
+            self._mutex = threading.RLock()
+            self._cond = threading.Condition(self._mutex)
+            self._submitted_count = 0
+            self._completed_count = 0
+            self._cancelled_count = 0
+            self._timed_out_count = 0
+            self._deferred_count = 0
+            # 已登记名额释放回调的服务商限制器
+            self._watched_limiters: set = set()
+            # 截止时间堆: [(deadline, seq, job)]，可能含过时条目，由看门狗惰性清理
+            self._deadlines: List[Tuple[float, int, GenerationJob]] = []
+            self._deadline_seq = itertools.count()
+            self._watchdog_cond = threading.Condition(self._mutex)
+            self._worker_seq = itertools.count()
+            self._abandoned_workers = 0
+            self.max_abandoned_workers = Config.MAX_ABANDONED_WORKERS or self.max_workers
+            # 超过放弃上限而未补充的工作线程数，对应的卡住线程返回后继续工作
+            self._unreplaced_workers = 0
+            # 单页执行耗时的指数移动平均: {服务商: 秒}，None 键为所有服务商的总体平均
+            self._page_seconds: Dict[Optional[str], float] = {}
+            self._initialized = True
+
+            self._start_workers()
+            self._start_watchdog()
+            logger.info(f"图片生成调度器已初始化: 全局并发={self.max_workers}")
+
+    def _start_workers(self):
+        """启动固定数量的工作线程"""
+        for _ in range(self.max_workers):
+            self._spawn_worker()
+
+    def _spawn_worker(self):
+        """启动一个工作线程"""
+        worker = threading.Thread(
+            target=self._worker_loop,
+            name=f'generation-worker-{next(self._worker_seq)}',
+            daemon=True
+        )
+        worker.start()
+
+    def _start_watchdog(self):
+        """启动超时看门狗线程"""
+        watchdog = threading.Thread(
+            target=self._watchdog_loop,
+            name='generation-watchdog',
+            daemon=True
+        )
+        watchdog.start()
+
+    def submit(
+        self,
+        task_id: str,
+        fn: Callable,
+        *args,
+        cancel_token: Optional[CancellationToken] = None,
+        page_timeout: Optional[float] = None,
+        task_deadline: Optional[float] = None,
+        provider: Optional[str] = None,
+        limiter: Optional[Any] = None,
+        record_time: bool = True,
+        **kwargs
+    ) -> Future:
+        """
+        提交一个页面作业
+
+        Args:
+            task_id: 所属任务ID（用于公平轮转）
+            fn: 要执行的函数
+            *args, **kwargs: 函数参数
+            cancel_token: 任务取消令牌（不会传给 fn），已取消时作业不再执行
+            page_timeout: 单页时限（秒，从开始执行计时）
+            task_deadline: 任务截止时间（time.monotonic() 时间点），排队中的作业同样受限
+            provider: 服务商标识（用于统计吞吐，不会传给 fn）
+            limiter: 服务商并发限制器（ProviderLimiter，不会传给 fn），没有空闲名额时作业挂起等待名额
+            record_time: 是否计入单页耗时统计（批次准备等非页面作业传 False，不影响排队时间估计）
+
+        Returns:
+            作业对应的 Future
+        """
+        job = GenerationJob(
+            task_id, fn, args, kwargs, cancel_token, page_timeout, task_deadline, provider, limiter, record_time
+        )
+
+        with self._cond:
+            self._enqueue(job)
+            self._track_deadline(job)
+            self._submitted_count += 1
+            self._cond.notify()
+
+        return job.future
+
+    def submit_delayed(
+        self,
+        task_id: str,
+        delay: float,
+        fn: Callable,
+        *args,
+        cancel_token: Optional[CancellationToken] = None,
+        page_timeout: Optional[float] = None,
+        task_deadline: Optional[float] = None,
+        provider: Optional[str] = None,
+        limiter: Optional[Any] = None,
+        **kwargs
+    ) -> Future:
+        """
+        延迟提交一个页面作业，到期后再进入该任务的轮转队列（不占用工作线程等待）
+
+        Args:
+            task_id: 所属任务ID
+            delay: 延迟秒数
+            fn: 要执行的函数
+            *args, **kwargs: 函数参数
+            cancel_token: 任务取消令牌（不会传给 fn）
+            page_timeout: 单页时限（秒）
+            task_deadline: 任务截止时间（time.monotonic() 时间点）
+            provider: 服务商标识（用于统计吞吐）
+            limiter: 服务商并发限制器（不会传给 fn）
+
+        Returns:
+            作业对应的 Future
+        """
+        if delay <= 0:
+            return self.submit(
+                task_id, fn, *args,
+                cancel_token=cancel_token,
+                page_timeout=page_timeout,
+                task_deadline=task_deadline,
+                provider=provider,
+                limiter=limiter,
+                **kwargs
+            )
+
+        job = GenerationJob(
+            task_id, fn, args, kwargs, cancel_token, page_timeout, task_deadline, provider, limiter
+        )
+        job.not_before = job.enqueued_at + delay
+
+        with self._cond:
+            heapq.heappush(self._delayed, (job.not_before, next(self._delayed_seq), job))
+            self._track_deadline(job)
+            self._submitted_count += 1
+            # 唤醒一个工作线程重新计算等待时间
+            self._cond.notify()
+
+        return job.future
+
+    def _enqueue(self, job: GenerationJob):
+        """将作业放入所属任务的队列（调用方需持有 _cond）"""
+        queue = self._queues.get(job.task_id)
+        if queue is None:
+            # 新任务排到轮转队尾
+            queue = deque()
+            self._queues[job.task_id] = queue
+        queue.append(job)
+
+    def _promote_due_jobs(self) -> Optional[float]:
+        """
+        将已到期的延迟作业移入轮转队列（调用方需持有 _cond）
+
+        Returns:
+            距下一个延迟作业到期的秒数，没有延迟作业时返回None
+        """
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, job = heapq.heappop(self._delayed)
+            self._enqueue(job)
+
+        if self._delayed:
+            return self._delayed[0][0] - now
+        return None
+
+    def _pop_next_job(self) -> GenerationJob:
+        """按轮转顺序取出下一个作业（调用方需持有 _cond）"""
+        task_id = next(iter(self._queues))
+        queue = self._queues[task_id]
+        job = queue.popleft()
+
+        if queue:
+            # 还有剩余作业，轮到队尾等待下一轮
+            self._queues.move_to_end(task_id)
+        else:
+            del self._queues[task_id]
+
+        return job
+
+    def _track_deadline(self, job: GenerationJob):
+        """登记作业的截止时间并唤醒看门狗（调用方需持有 _cond）"""
+        deadline = job.deadline()
+        if deadline is None:
+            return
+        heapq.heappush(self._deadlines, (deadline, next(self._deadline_seq), job))
+        self._watchdog_cond.notify()
+
+    def _restart_page_clock(self, job: GenerationJob):
+        """请求实际发出：单页时限从此刻重新计时（在执行作业的线程中调用）"""
+        with self._cond:
+            if job.state == 'running':
+                job.page_clock_at = time.monotonic()
+                self._track_deadline(job)
+
+    def _release_running(self, job: GenerationJob):
+        """作业结束（完成或超时），释放任务的执行计数并记录耗时（调用方需持有 _cond）"""
+        remaining = self._running.get(job.task_id, 1) - 1
+        if remaining > 0:
+            self._running[job.task_id] = remaining
+        else:
+            self._running.pop(job.task_id, None)
+        self._running_jobs.discard(job)
+        self._completed_count += 1
+        if job.record_time:
+            self._record_page_seconds(job.provider, time.monotonic() - job.started_at)
+
+    # 耗时移动平均的平滑系数
+    PAGE_SECONDS_ALPHA = 0.2
+
+    def _record_page_seconds(self, provider: Optional[str], seconds: float):
+        """更新服务商和总体的单页耗时移动平均（调用方需持有 _cond）"""
+        keys = (None,) if provider is None else (provider, None)
+        for key in keys:
+            previous = self._page_seconds.get(key)
+            if previous is None:
+                self._page_seconds[key] = seconds
+            else:
+                self._page_seconds[key] = previous + self.PAGE_SECONDS_ALPHA * (seconds - previous)
+
+    def _estimate_page_seconds(self, provider: Optional[str]) -> float:
+        """单页耗时估计：服务商平均 > 总体平均 > 默认值（调用方需持有 _cond）"""
+        seconds = self._page_seconds.get(provider)
+        if seconds is None:
+            seconds = self._page_seconds.get(None, Config.ADMISSION_DEFAULT_PAGE_SECONDS)
+        return seconds
+
+    def estimate_page_seconds(self, provider: Optional[str] = None) -> float:
+        """
+        估算单页执行耗时
+
+        Args:
+            provider: 服务商标识，尚无统计时使用总体平均或默认值
+
+        Returns:
+            秒数
+        """
+        with self._cond:
+            return self._estimate_page_seconds(provider)
+
+    def get_load(self) -> Dict[str, Any]:
+        """
+        获取当前负载：待执行页数和按服务商耗时估算的剩余工作量
+
+        Returns:
+            {'pending': 排队+延迟作业数, 'running': 执行中作业数,
+             'backlog_seconds': 所有未完成作业的预计总执行秒数（未除以并发数）}
+        """
+        with self._cond:
+            now = time.monotonic()
+            pending_jobs = [job for queue in self._queues.values() for job in queue]
+            pending_jobs.extend(job for _, _, job in self._delayed)
+
+            backlog = sum(self._estimate_page_seconds(job.provider) for job in pending_jobs)
+            for job in self._running_jobs:
+                # 执行中的作业只计剩余部分，超出平均耗时的按即将完成处理
+                backlog += max(0.0, self._estimate_page_seconds(job.provider) - (now - job.started_at))
+
+            return {
+                'pending': len(pending_jobs),
+                'running': len(self._running_jobs),
+                'backlog_seconds': backlog
+            }
+
+    def _take_runnable_job(self) -> Tuple[GenerationJob, Optional[str]]:
+        """
+        取出下一个可执行的作业，没有作业时等待（调用方需持有 _cond）
+
+        服务商没有空闲名额的作业放回延迟队列，稍后重新排队，不占用工作线程等待。
+
+        Returns:
+            (作业, 跳过原因)，跳过原因为 'cancelled'/'expired'，可执行时为None
+        """
+        while True:
+            wait = self._promote_due_jobs()
+            if not self._queues:
+                self._cond.wait(wait)
+                continue
+            job = self._pop_next_job()
+
+            if job.cancel_token is not None and job.cancel_token.is_cancelled:
+                self._cancelled_count += 1
+                return job, 'cancelled'
+            if job.task_deadline is not None and time.monotonic() >= job.task_deadline:
+                self._timed_out_count += 1
+                return job, 'expired'
+
+            if job.limiter is not None and not job.limiter.reserve():
+                blocked_for = job.limiter.blocked_for()
+                if blocked_for > 0:
+                    # Retry-After 窗口内：窗口结束后再试
+                    job.not_before = time.monotonic() + blocked_for
+                else:
+                    # 名额已满：挂起到名额释放时唤醒（见 _wake_parked），兜底定期重新检查
+                    self._watch_limiter(job.limiter)
+                    job.waiting_for_slot = True
+                    job.not_before = time.monotonic() + PARKED_RECHECK_SECONDS
+                heapq.heappush(self._delayed, (job.not_before, next(self._delayed_seq), job))
+                self._deferred_count += 1
+                continue
+            job.waiting_for_slot = False
+            return job, None
+
+    def _watch_limiter(self, limiter: Any):
+        """登记服务商限制器的名额释放回调（调用方需持有 _cond）"""
+        if id(limiter) not in self._watched_limiters:
+            self._watched_limiters.add(id(limiter))
+            limiter.add_release_listener(self._wake_parked)
+
+    def _wake_parked(self, limiter: Any):
+        """
+        服务商释放名额时，按空闲名额数唤醒最早挂起的作业
+
+        Args:
+            limiter: 释放名额的服务商限制器
+        """
+        with self._cond:
+            available = limiter.available()
+            if available <= 0:
+                return
+            parked = sorted(
+                (entry for entry in self._delayed if entry[2].waiting_for_slot and entry[2].limiter is limiter),
+                key=lambda entry: entry[1]
+            )[:available]
+            if not parked:
+                return
+            now = time.monotonic()
+            woken = {id(entry[2]) for entry in parked}
+            self._delayed = [
+                (now, seq, job) if id(job) in woken else (not_before, seq, job)
+                for not_before, seq, job in self._delayed
+            ]
+            heapq.heapify(self._delayed)
+            for _, _, job in parked:
+                job.waiting_for_slot = False
+                job.not_before = now
+            self._cond.notify(len(parked))
+
+    def _worker_loop(self):
+        """工作线程主循环"""
+        while True:
+            with self._cond:
+                job, skip = self._take_runnable_job()
+                if skip:
+                    job.state = 'done'
+                    self._completed_count += 1
+                else:
+                    self._running[job.task_id] = self._running.get(job.task_id, 0) + 1
+                    self._running_jobs.add(job)
+                    job.state = 'running'
+                    job.started_at = time.monotonic()
+                    # 请求发出前允许最长的 API 密钥限速等待，发出后重新计时
+                    job.page_clock_at = job.started_at + Config.API_KEY_RATE_LIMIT_MAX_WAIT
+                    self._track_deadline(job)
+
+            if skip == 'cancelled':
+                # 任务已取消，作业不再执行（Future 标记为已取消并触发回调）
+                job.future.cancel()
+                continue
+            if skip == 'expired':
+                # 排队期间任务已超过截止时间，不再执行
+                job.future.set_exception(job.timeout_error())
+                continue
+
+            outcome = None
+            set_request_listener(functools.partial(self._restart_page_clock, job))
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    try:
+                        outcome = (True, job.fn(*job.args, **job.kwargs))
+                    except BaseException as e:
+                        outcome = (False, e)
+            except Exception as e:
+                logger.error(f"调度作业执行异常: {job.task_id}, {e}", exc_info=True)
+            finally:
+                set_request_listener(None)
+
+            if job.limiter is not None:
+                # 命中缓存或请求前出错时预留的名额未被取用，归还给服务商
+                job.limiter.cancel_reservation()
+
+            with self._cond:
+                if job.state == 'timed_out':
+                    # 看门狗已判定超时，本线程的结果作废
+                    self._abandoned_workers -= 1
+                    if self._unreplaced_workers > 0:
+                        # 超时时没有补充新线程：本线程收回名额继续工作
+                        self._unreplaced_workers -= 1
+                        logger.info(f"超时作业的工作线程已返回，继续调度: {job.task_id}")
+                        continue
+                    logger.info(f"超时作业的工作线程已返回并退出: {job.task_id}")
+                    return
+                job.state = 'done'
+                self._release_running(job)
+
+            if outcome is not None:
+                try:
+                    if outcome[0]:
+                        job.future.set_result(outcome[1])
+                    else:
+                        job.future.set_exception(outcome[1])
+                except Exception as e:
+                    logger.error(f"调度作业回调异常: {job.task_id}, {e}", exc_info=True)
+
+    def _watchdog_loop(self):
+        """看门狗主循环：按最早截止时间休眠，到期后判定超时"""
+        while True:
+            expired: List[GenerationJob] = []
+
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    while self._deadlines and self._deadlines[0][0] <= now:
+                        _, _, job = heapq.heappop(self._deadlines)
+                        if self._expire_job(job, now):
+                            expired.append(job)
+                    if expired:
+                        break
+                    wait = self._deadlines[0][0] - now if self._deadlines else None
+                    self._watchdog_cond.wait(wait)
+
+            for job in expired:
+                try:
+                    job.future.set_exception(job.timeout_error())
+                except Exception as e:
+                    logger.error(f"超时作业回调异常: {job.task_id}, {e}", exc_info=True)
+
+    def _expire_job(self, job: GenerationJob, now: float) -> bool:
+        """
+        判定单个作业是否超时并从调度中移除（调用方需持有 _cond）
+
+        Returns:
+            是否需要以超时结束该作业的 Future
+        """
+        deadline = job.deadline()
+        if job.state not in ('queued', 'running') or deadline is None or deadline > now:
+            # 已结束，或是截止时间已变化的过时条目
+            return False
+
+        if job.state == 'queued':
+            queue = self._queues.get(job.task_id)
+            if queue is not None and job in queue:
+                queue.remove(job)
+                if not queue:
+                    del self._queues[job.task_id]
+            else:
+                remaining_delayed = [entry for entry in self._delayed if entry[2] is not job]
+                if len(remaining_delayed) == len(self._delayed):
+                    # 已被取消撤回
+                    return False
+                heapq.heapify(remaining_delayed)
+                self._delayed = remaining_delayed
+            if not job.future.set_running_or_notify_cancel():
+                return False
+            self._completed_count += 1
+        else:
+            # 执行中的作业：放弃卡住的线程，补充新线程保持并发名额
+            self._release_running(job)
+            self._abandoned_workers += 1
+            if self._abandoned_workers <= self.max_abandoned_workers:
+                self._spawn_worker()
+                logger.warning(
+                    f"页面作业超时: {job.task_id}, 已执行 {now - job.started_at:.1f}s，补充工作线程"
+                )
+            else:
+                # 卡住的线程过多，不再补充，避免无限制地堆积线程
+                self._unreplaced_workers += 1
+                logger.warning(
+                    f"页面作业超时: {job.task_id}, 已执行 {now - job.started_at:.1f}s，"
+                    f"已放弃 {self._abandoned_workers} 个线程，超过上限不再补充"
+                )
+
+        job.state = 'timed_out'
+        self._timed_out_count += 1
+        return True
+
+    def cancel_task(self, task_id: str) -> int:
+        """
+        取消任务所有排队中和延迟中的作业（执行中的作业不受影响）
+
+        Args:
+            task_id: 任务ID
+
+        Returns:
+            被取消的作业数
+        """
+        with self._cond:
+            jobs = list(self._queues.pop(task_id, ()))
+            for job in jobs:
+                job.state = 'done'
+            remaining_delayed = []
+            for entry in self._delayed:
+                if entry[2].task_id == task_id:
+                    entry[2].state = 'done'
+                    jobs.append(entry[2])
+                else:
+                    remaining_delayed.append(entry)
+            if len(remaining_delayed) != len(self._delayed):
+                heapq.heapify(remaining_delayed)
+                self._delayed = remaining_delayed
+
+        # 在锁外取消，Future 回调可能再次调用调度器
+        cancelled = sum(1 for job in jobs if job.future.cancel())
+
+        with self._cond:
+            self._cancelled_count += cancelled
+            self._completed_count += cancelled
+
+        if cancelled:
+            logger.info(f"已取消任务排队中的作业: {task_id}, {cancelled} 个")
+        return cancelled
+
+    def get_queue_depth(self) -> int:
+        """
+        获取全局排队中的作业数
+
+        Returns:
+            排队作业数（不含正在执行的）
+        """
+        with self._cond:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def get_task_position(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """
+        获取任务在调度队列中的位置
+
+        轮转调度下，任务第 j 个排队作业之前会被调度的作业数为：
+        排在它前面的任务各取 min(深度, j)，排在它后面的任务各取 min(深度, j-1)。
+
+        Args:
+            task_id: 任务ID
+
+        Returns:
+            位置信息；任务既不在排队也不在执行时返回None
+        """
+        with self._cond:
+            running = self._running.get(task_id, 0)
+            delayed = sum(1 for _, _, job in self._delayed if job.task_id == task_id)
+            if task_id not in self._queues:
+                if running == 0 and delayed == 0:
+                    return None
+                return {
+                    'task_id': task_id,
+                    'queued': 0,
+                    'running': running,
+                    'delayed': delayed,
+                    'position': 0,
+                    'last_position': 0,
+                    'queue_depth': sum(len(q) for q in self._queues.values())
+                }
+
+            depths = [(tid, len(queue)) for tid, queue in self._queues.items()]
+
+        index = next(i for i, (tid, _) in enumerate(depths) if tid == task_id)
+        queued = depths[index][1]
+
+        def jobs_ahead(j: int) -> int:
+            ahead = sum(min(depth, j) for _, depth in depths[:index])
+            ahead += sum(min(depth, j - 1) for _, depth in depths[index + 1:])
+            return ahead
+
+        return {
+            'task_id': task_id,
+            'queued': queued,
+            'running': running,
+            'delayed': delayed,
+            'position': jobs_ahead(1),
+            'last_position': jobs_ahead(queued) + queued - 1,
+            'queue_depth': sum(depth for _, depth in depths)
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取调度器统计信息
+
+        Returns:
+            统计信息字典
+        """
+        with self._cond:
+            tasks: List[Dict[str, Any]] = [
+                {
+                    'task_id': tid,
+                    'queued': len(queue),
+                    'running': self._running.get(tid, 0)
+                }
+                for tid, queue in self._queues.items()
+            ]
+            queued_ids = set(self._queues)
+            tasks.extend(
+                {'task_id': tid, 'queued': 0, 'running': count}
+                for tid, count in self._running.items()
+                if tid not in queued_ids
+            )
+
+            return {
+                'max_workers': self.max_workers,
+                'queue_depth': sum(len(queue) for queue in self._queues.values()),
+                'running': sum(self._running.values()),
+                'delayed': len(self._delayed),
+                'submitted': self._submitted_count,
+                'completed': self._completed_count,
+                'cancelled': self._cancelled_count,
+                'timed_out': self._timed_out_count,
+                'deferred': self._deferred_count,
+                'abandoned_workers': self._abandoned_workers,
+                'unreplaced_workers': self._unreplaced_workers,
+                'page_seconds': {
+                    (provider or 'all'): round(seconds, 2) for provider, seconds in self._page_seconds.items()
+                },
+                'tasks': tasks
+            }
@@ -0,0 +1,136 @@
+"""
+图片结果缓存
+按 (提示词, 尺寸, 参考图, 服务商, 模型) 缓存已保存到本地的生成结果，
+相同输入再次生成时直接复用本地图片，不再请求服务商
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class ImageResultCache:
+    """图片结果缓存类 - 线程安全的单例模式"""
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        """单例模式实现"""
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        """初始化缓存"""
+        if not hasattr(self, '_initialized'):
+            # LRU 缓存: {key: (local_url, stored_at)}
+            self._entries: 'OrderedDict[str, Tuple[str, float]]' = OrderedDict()
+            self._entries_lock = threading.Lock()
+            self.enabled = Config.IMAGE_RESULT_CACHE_ENABLED
+            self.ttl = Config.IMAGE_RESULT_CACHE_TTL
+            self.max_entries = Config.IMAGE_RESULT_CACHE_MAX_ENTRIES
+            self._hits = 0
+            self._misses = 0
+            self._initialized = True
+            logger.info(
+                f"图片结果缓存已初始化: 启用={self.enabled}, TTL={self.ttl}s, 最大条目={self.max_entries}"
+            )
+
+    @staticmethod
+    def make_key(
+        prompt: str,
+        width: int,
+        height: int,
+        reference_digest: Optional[str],
+        provider: str,
+        model: str
+    ) -> str:
+        """
+        计算缓存键
+
+        Args:
+            prompt: 最终提示词
+            width: 宽度
+            height: 高度
+            reference_digest: 参考图片摘要（无参考图时为None）
+            provider: 服务商标识（API 地址或 mock）
+            model: 模型名称
+
+        Returns:
+            sha256 十六进制键
+        """
+        raw = json.dumps(
+            [prompt, width, height, reference_digest or '', provider, model],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str, validator: Optional[Callable[[str], bool]] = None) -> Optional[str]:
+        """
+        读取缓存
+
+        Args:
+            key: 缓存键
+            validator: 校验缓存结果是否仍可用（如本地文件是否存在），不可用时删除条目
+
+        Returns:
+            本地图片 URL，未命中、已过期或校验失败返回None
+        """
+        with self._entries_lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+
+            local_url, stored_at = entry
+            if time.time() - stored_at > self.ttl or (validator and not validator(local_url)):
+                del self._entries[key]
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return local_url
+
+    def put(self, key: str, local_url: str):
+        """
+        写入缓存，超过最大条目数时淘汰最久未使用的条目
+
+        Args:
+            key: 缓存键
+            local_url: 本地图片 URL（/uploads/...）
+        """
+        with self._entries_lock:
+            self._entries[key] = (local_url, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计
+
+        Returns:
+            统计信息字典
+        """
+        with self._entries_lock:
+            total = self._hits + self._misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / total, 4) if total else 0.0
+            }
@@ -2,16 +2,30 @@
 图片生成服务
 处理批量图片生成的业务逻辑，支持并发生成和实时进度追踪
 """
+import functools
+import hashlib
 import logging
 import threading
-from typing import List, Dict, Any, Optional
-from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
-from datetime import datetime
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Callable, List, Dict, Any, Optional
+from concurrent.futures import Future
+
+from flask import Flask, current_app, has_app_context
 
 from generators.factory import get_image_generator
 from generators.base import BaseGenerator, ContentType
+from generators.clients.image import ImageAPIClient, EndpointRouter, find_circuit_breaker
+from generators.clients.image.provider_limiter import DEFAULT_RETRY_AFTER
+from generators.clients.rate_limiter import take_wait_time
 from .progress_service import ProgressService
+from .generation_scheduler import GenerationScheduler, CancellationToken, GenerationTimeoutError
+from .reference_image_service import ReferenceImageService
+from .image_result_cache import ImageResultCache
+from storage.task_journal import TaskJournal
 from utils.file_utils import FileUtils
+from config import Config
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +33,23 @@ logger = logging.getLogger(__name__)
 class ImageService:
     """图片生成服务类"""
     
+    # 单页被服务商限流后最多重新排队的次数
+    MAX_THROTTLE_RETRIES = 5
+    
+    # 未启用任务日志时，内存中保留已结束批次上下文（用于失败页重试）的最大任务数
+    MAX_RETAINED_BATCHES = 200
+    
+    # 批次上下文注册表: {task_id: (ImageService, batch_state)}，进程内共享
+    # 执行中的批次始终在册；已结束的批次启用任务日志时移除，否则按数量和字节预算保留
+    _batches: 'OrderedDict[str, tuple]' = OrderedDict()
+    _batches_lock = threading.Lock()
+    
+    # 任务日志（首次使用时创建）
+    _task_journal: Optional[TaskJournal] = None
+    
+    # 任务使用的自定义 API 密钥: {task_id: 密钥}，只保存在进程内存中，不写入任务日志
+    _task_secrets: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+    
     def __init__(
         self,
         generator_type: str = 'mock',
@@ -30,7 +61,7 @@ class ImageService:
         
         Args:
             generator_type: 生成器类型 (mock/image_api/openai)
-            max_workers: 最大并发数
+            max_workers: 最大并发数（已弃用，并发由全局调度器统一控制）
             model_config: 模型配置 (url, apiKey, model)
         """
         self.generator_type = generator_type
@@ -38,9 +69,12 @@ class ImageService:
         self.model_config = model_config or {}
         self.generator = None
         self.progress_service = ProgressService()
+        self.scheduler = GenerationScheduler()
+        self.reference_service = ReferenceImageService()
+        self.result_cache = ImageResultCache()
         self.file_utils = FileUtils()
         
-        logger.info(f"图片生成服务已初始化: 生成器={generator_type}, 最大并发={max_workers}, 配置={bool(model_config)}")
+        logger.info(f"图片生成服务已初始化: 生成器={generator_type}, 全局并发={self.scheduler.max_workers}, 配置={bool(model_config)}")
     
     def generate_batch(
         self,
@@ -51,10 +85,13 @@ class ImageService:
         width: int = 1080,
         height: int = 1440,
         image_generation_config: Optional[Dict[str, Any]] = None,
-        full_outline: str = ''
+        full_outline: str = '',
+        use_cache: bool = True,
+        client_id: Optional[str] = None,
+        on_queued: Optional[Callable[[], None]] = None
     ) -> None:
         """
-        批量生成图片（异步后台任务）
+        批量生成图片（提交到全局调度器，异步执行）
         
         Args:
             task_id: 任务ID
@@ -65,143 +102,1020 @@ class ImageService:
             height: 图片高度（已弃用，使用 image_generation_config）
             image_generation_config: 图片生成配置 (quality, aspectRatio)
             full_outline: 完整内容大纲（用于保持风格一致性）
-        """
-        # 计算实际宽高
-        actual_width, actual_height = self._calculate_dimensions(image_generation_config)
-        
-        # 在新线程中运行，不阻塞主线程
-        thread = threading.Thread(
-            target=self._generate_batch_worker,
-            args=(task_id, pages, topic, reference_image, actual_width, actual_height, full_outline),
-            daemon=True
-        )
-        thread.start()
-        logger.info(f"批量生成任务已启动: {task_id}, 共 {len(pages)} 页")
-    
-    def _generate_batch_worker(
-        self,
-        task_id: str,
-        pages: List[Dict[str, Any]],
-        topic: str,
-        reference_image: Optional[str],
-        width: int,
-        height: int,
-        full_outline: str = ''
-    ):
-        """
-        批量生成工作线程
+            use_cache: 是否复用结果缓存（相同提示词/尺寸/参考图/模型的已生成图片）
+            client_id: 发起任务的客户端标识（用于按客户端订阅进度）
+            on_queued: 待生成页面全部提交到调度器（或任务启动失败、已取消）后调用一次
         """
         try:
             # 创建进度任务
             self.progress_service.create_task(
                 task_id=task_id,
                 total_pages=len(pages),
-                topic=topic
+                topic=topic,
+                client_id=client_id
             )
             
             # 启动任务
             self.progress_service.start_task(task_id)
             
-            # 获取生成器（传递模型配置）
-            self.generator = self._create_generator_with_config()
+            # 记录批次参数（API 密钥除外），服务重启后据此恢复
+            batch_params = {
+                'generator_type': self.generator_type,
+                'model_config': self.model_config,
+                'pages': pages,
+                'topic': topic,
+                'reference_image': reference_image,
+                'image_generation_config': image_generation_config,
+                'full_outline': full_outline,
+                'use_cache': use_cache,
+                'client_id': client_id
+            }
+            journal_params, secrets = self._split_secrets(batch_params)
+            if secrets is not None:
+                self._remember_secrets(task_id, secrets)
+            self._journal('start', task_id, journal_params)
+            
+            self._run_batch(task_id, pages, pages, batch_params, on_queued)
             
-            if not self.generator:
-                error_msg = f'无法创建生成器: {self.generator_type}'
-                logger.error(error_msg)
-                self.progress_service.fail_task(task_id, error_msg)
+        except Exception as e:
+            error_msg = f'批量生成失败: {str(e)}'
+            logger.error(f"任务失败: {task_id}, {error_msg}", exc_info=True)
+            self.progress_service.fail_task(task_id, error_msg)
+            self._journal('finish', task_id)
+            if on_queued:
+                on_queued()
+    
+    def _run_batch(
+        self,
+        task_id: str,
+        pages: List[Dict[str, Any]],
+        pending_pages: List[Dict[str, Any]],
+        batch_params: Dict[str, Any],
+        on_queued: Optional[Callable[[], None]] = None
+    ):
+        """
+        将批次准备作为该任务的首个作业提交到全局调度器，调用方（请求线程）立即返回
+        
+        创建生成器、预处理参考图（含缩放和重新编码）在工作线程中执行，完成后再提交待生成的页面。
+        
+        Args:
+            task_id: 任务ID
+            pages: 批次的全部页面（用于构建提示词上下文）
+            pending_pages: 需要生成的页面（恢复任务时只包含未完成的页面）
+            batch_params: 批次参数（主题、参考图、生成配置等）
+            on_queued: 页面提交完成后的回调
+        """
+        # 使用服务端配置的生成器从 Flask 配置读取密钥和地址，工作线程中需要重新进入应用上下文
+        app = current_app._get_current_object() if has_app_context() else None
+        future = self.scheduler.submit(
+            task_id,
+            self._start_batch,
+            task_id, pages, pending_pages, batch_params, app, on_queued,
+            record_time=False
+        )
+        
+        def on_prepare_cancelled(f: Future):
+            # 准备作业排队期间任务被取消时 _start_batch 不会执行，在此结束日志并释放准入预留
+            if f.cancelled():
+                self._journal('finish', task_id)
+                if on_queued:
+                    on_queued()
+        
+        future.add_done_callback(on_prepare_cancelled)
+    
+    def _start_batch(
+        self,
+        task_id: str,
+        pages: List[Dict[str, Any]],
+        pending_pages: List[Dict[str, Any]],
+        batch_params: Dict[str, Any],
+        app: Optional[Flask] = None,
+        on_queued: Optional[Callable[[], None]] = None
+    ):
+        """
+        在调度器工作线程中准备批次，并将待生成的页面提交到全局调度器
+        
+        Args:
+            task_id: 任务ID
+            pages: 批次的全部页面
+            pending_pages: 需要生成的页面
+            batch_params: 批次参数
+            app: 提交时的 Flask 应用（在应用上下文外提交时为None）
+            on_queued: 页面提交完成（或准备失败）后的回调
+        """
+        try:
+            if self.progress_service.is_task_cancelled(task_id):
+                # 准备作业排队期间任务已被取消
+                logger.info(f"任务在开始生成前已取消: {task_id}")
+                self._journal('finish', task_id)
                 return
             
-            # 验证生成器配置
-            if not self.generator.validate_config():
-                error_msg = f'生成器配置无效: {self.generator_type}'
-                logger.error(error_msg)
+            with app.app_context() if app is not None else nullcontext():
+                batch_state, error_msg = self._prepare_batch(pages, len(pending_pages), batch_params)
+            if batch_state is None:
                 self.progress_service.fail_task(task_id, error_msg)
+                self._journal('finish', task_id)
                 return
+            self._register_batch(task_id, batch_state)
             
-            # 使用线程池并发生成图片
-            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                # 提交所有生成任务
-                future_to_page = {}
-                for page in pages:
-                    future = executor.submit(
-                        self._generate_single_image,
-                        page,
-                        reference_image,
-                        width,
-                        height,
-                        topic,
-                        pages,
-                        full_outline
-                    )
-                    future_to_page[future] = page
-                
-                # 处理完成的任务（添加超时机制：每个图片最多5分钟）
-                for future in as_completed(future_to_page):
-                    page = future_to_page[future]
-                    page_number = page.get('page_number', 0)
-                    
-                    try:
-                        result = future.result(timeout=600)  # 5分钟超时
-                        
-                        if result['success']:
-                            # 更新进度
-                            self.progress_service.update_progress(
-                                task_id=task_id,
-                                current_page=page_number,
-                                image_url=result['image_url'],
-                                message=f'第 {page_number} 页生成完成'
-                            )
-                            logger.info(f"页面 {page_number} 生成成功")
-                        else:
-                            # 记录失败页面
-                            error_msg = result.get('error', '未知错误')
-                            self.progress_service.record_failed_page(
-                                task_id=task_id,
-                                page_number=page_number,
-                                error=error_msg
-                            )
-                            logger.error(f"页面 {page_number} 生成失败: {error_msg}")
-                            # 继续生成其他页面，不中断整个任务
-                            
-                    except TimeoutError:
-                        # 超时异常
-                        error_msg = "图片生成超时（超过5分钟）"
-                        self.progress_service.record_failed_page(
-                            task_id=task_id,
-                            page_number=page_number,
-                            error=error_msg
-                        )
-                        logger.error(f"页面 {page_number} 生成超时")
-                    except Exception as e:
-                        # 其他异常情况也记录为失败
-                        error_msg = f"处理结果异常: {str(e)}"
-                        self.progress_service.record_failed_page(
-                            task_id=task_id,
-                            page_number=page_number,
-                            error=error_msg
-                        )
-                        logger.error(f"处理页面 {page_number} 结果时出错: {e}", exc_info=True)
-            
-            # 检查是否所有图片都生成成功
-            progress = self.progress_service.get_progress(task_id)
-            if progress and progress['completed_pages'] == len(pages):
-                self.progress_service.complete_task(
+            if not pending_pages:
+                self._finish_batch(task_id, batch_state)
+                return
+            
+            for page in pending_pages:
+                cached_url = self._get_cached_result(page, batch_state)
+                if cached_url:
+                    # 命中缓存的页面立即完成，不进入调度队列
+                    future = Future()
+                    future.set_result({'success': True, 'image_url': cached_url, 'cached': True})
+                    self._on_page_done(task_id, page, batch_state, future)
+                else:
+                    self._submit_page(task_id, page, batch_state)
+            
+            logger.info(f"批量生成任务已提交: {task_id}, 共 {len(pages)} 页, 待生成 {len(pending_pages)} 页")
+            
+        except Exception as e:
+            error_msg = f'批量生成失败: {str(e)}'
+            logger.error(f"任务失败: {task_id}, {error_msg}", exc_info=True)
+            self.progress_service.fail_task(task_id, error_msg)
+            self._journal('finish', task_id)
+        finally:
+            if on_queued:
+                on_queued()
+    
+    def _prepare_batch(
+        self,
+        pages: List[Dict[str, Any]],
+        pending_count: int,
+        batch_params: Dict[str, Any]
+    ) -> tuple[Optional[Dict[str, Any]], str]:
+        """
+        创建生成器、预处理参考图，构建批次共享状态
+        
+        Args:
+            pages: 批次的全部页面
+            pending_count: 需要生成的页数
+            batch_params: 批次参数（主题、参考图、生成配置等）
+            
+        Returns:
+            (批次共享状态, 错误信息)，无法生成时批次状态为None
+        """
+        topic = batch_params['topic']
+        use_cache = batch_params['use_cache']
+        
+        # 计算实际宽高
+        actual_width, actual_height = self._calculate_dimensions(batch_params['image_generation_config'])
+        
+        # 获取生成器（传递模型配置）
+        self.generator = self._create_generator_with_config()
+        
+        if not self.generator:
+            error_msg = f'无法创建生成器: {self.generator_type}'
+            logger.error(error_msg)
+            return None, error_msg
+        
+        # 验证生成器配置
+        if not self.generator.validate_config():
+            error_msg = f'生成器配置无效: {self.generator_type}'
+            logger.error(error_msg)
+            return None, error_msg
+        
+        # 服务地址已熔断时整批直接失败，不再让每页排队后逐个失败
+        retry_after = self.get_circuit_retry_after()
+        if retry_after > 0:
+            error_msg = f'图片生成服务暂时不可用（已熔断），请约 {retry_after:.0f} 秒后重试'
+            logger.warning(f"服务地址已熔断，批次直接失败: {self._get_endpoint_urls()}")
+            return None, error_msg
+        
+        # 参考图片每个批次只预处理、编码一次，所有页面共享
+        processed_reference = self._process_reference_image(
+            batch_params['reference_image'],
+            api_format=self._get_api_format()
+        )
+        
+        # 结果缓存上下文：参考图摘要 + 服务商 + 模型，与每页提示词和尺寸共同组成缓存键
+        cache_context = None
+        if use_cache and self.result_cache.enabled:
+            provider, model = self._get_provider_identity()
+            reference_digest = None
+            if processed_reference:
+                reference_digest = hashlib.sha256(processed_reference.encode('utf-8')).hexdigest()
+            cache_context = (reference_digest, provider, model)
+        
+        # 所有页面提交到全局调度器，由共享工作线程按任务轮转执行
+        page_timeout, task_timeout = self._get_timeouts()
+        batch_state = {
+            'total': len(pages),
+            'remaining': pending_count,
+            'lock': threading.Lock(),
+            'page_args': (
+                processed_reference, actual_width, actual_height, topic, pages,
+                batch_params['full_outline'], cache_context
+            ),
+            'batch_params': batch_params,
+            'throttle_retries': {},
+            # 已推送过"暂缓发送"进度的页面（之后的本地暂缓只记调试日志）
+            'deferred_pages': set(),
+            'cache_hits': 0,
+            'cancel_token': CancellationToken(),
+            'calls_avoided': 0,
+            'rate_limit_wait': 0.0,
+            'finalized': False,
+            'page_timeout': page_timeout,
+            'task_timeout': task_timeout,
+            'task_deadline': time.monotonic() + task_timeout,
+            'throughput_key': self.get_throughput_key(),
+            'provider_limiter': self._get_provider_limiter()
+        }
+        return batch_state, ''
+    
+    @classmethod
+    def _get_journal(cls) -> Optional[TaskJournal]:
+        """获取进程共享的任务日志（未启用时返回None）"""
+        if not Config.TASK_JOURNAL_ENABLED:
+            return None
+        with cls._batches_lock:
+            if cls._task_journal is None:
+                cls._task_journal = TaskJournal(Config.TASK_JOURNAL_PATH)
+            return cls._task_journal
+    
+    def _journal(self, action: str, task_id: str, *args):
+        """
+        写入任务日志，失败时只记录警告，不影响生成
+        
+        Args:
+            action: 日志操作 (start/append/finish)
+            task_id: 任务ID
+            *args: 操作参数
+        """
+        try:
+            journal = self._get_journal()
+            if journal is not None:
+                getattr(journal, action)(task_id, *args)
+        except Exception as e:
+            logger.warning(f"写入任务日志失败: {task_id}, {action}, {e}")
+    
+    @staticmethod
+    def _split_secrets(batch_params: Dict[str, Any]) -> tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """
+        拆出批次参数中的 API 密钥（主端点和备用端点）
+        
+        Args:
+            batch_params: 批次参数
+            
+        Returns:
+            (不含密钥、可写入任务日志的参数, 密钥)，未使用自定义密钥时密钥为None
+        """
+        model_config = batch_params.get('model_config') or {}
+        endpoints = model_config.get('endpoints') or []
+        secrets = {
+            'apiKey': model_config.get('apiKey', ''),
+            'endpoints': [endpoint.get('apiKey', '') for endpoint in endpoints]
+        }
+        if not secrets['apiKey'] and not any(secrets['endpoints']):
+            return batch_params, None
+        
+        public_config = {key: value for key, value in model_config.items() if key != 'apiKey'}
+        if endpoints:
+            public_config['endpoints'] = [
+                {key: value for key, value in endpoint.items() if key != 'apiKey'} for endpoint in endpoints
+            ]
+        return dict(batch_params, model_config=public_config, api_key_omitted=True), secrets
+    
+    @staticmethod
+    def _merge_secrets(batch_params: Dict[str, Any], secrets: Dict[str, Any]) -> Dict[str, Any]:
+        """将密钥填回从任务日志读取的批次参数（_split_secrets 的逆操作）"""
+        model_config = dict(batch_params['model_config'], apiKey=secrets.get('apiKey', ''))
+        endpoint_keys = secrets.get('endpoints') or []
+        if model_config.get('endpoints'):
+            model_config['endpoints'] = [
+                dict(endpoint, apiKey=endpoint_keys[i]) if i < len(endpoint_keys) and endpoint_keys[i] else endpoint
+                for i, endpoint in enumerate(model_config['endpoints'])
+            ]
+        merged = dict(batch_params, model_config=model_config)
+        merged.pop('api_key_omitted', None)
+        return merged
+    
+    @classmethod
+    def _remember_secrets(cls, task_id: str, secrets: Dict[str, Any]):
+        """在进程内存中保留任务的 API 密钥（供本进程之后重建批次上下文）"""
+        with cls._batches_lock:
+            cls._task_secrets[task_id] = secrets
+            cls._task_secrets.move_to_end(task_id)
+            while len(cls._task_secrets) > cls.MAX_RETAINED_BATCHES:
+                cls._task_secrets.popitem(last=False)
+    
+    @classmethod
+    def _recall_secrets(cls, task_id: str) -> Optional[Dict[str, Any]]:
+        """取回本进程保留的任务 API 密钥"""
+        with cls._batches_lock:
+            return cls._task_secrets.get(task_id)
+    
+    @classmethod
+    def resume_journaled_batches(cls) -> int:
+        """
+        服务启动时恢复任务日志中未结束的批次：重建进度，并重新排队未完成的页面
+        
+        只接管所属进程已退出的批次；已保存到本地但文件丢失的页面会重新生成。
+        
+        Returns:
+            恢复的任务数
+        """
+        journal = cls._get_journal()
+        if journal is None:
+            return 0
+        
+        resumed = 0
+        for task_id, entries in journal.claim_orphans().items():
+            try:
+                if cls._resume_batch(task_id, entries):
+                    resumed += 1
+            except Exception as e:
+                logger.error(f"恢复任务失败: {task_id}, {e}", exc_info=True)
+                ProgressService().fail_task(task_id, f'服务重启后恢复任务失败: {e}')
+                journal.finish(task_id)
+        
+        if resumed:
+            logger.info(f"已恢复 {resumed} 个未完成的批次")
+        return resumed
+    
+    @classmethod
+    def _resume_batch(cls, task_id: str, entries: List[tuple]) -> bool:
+        """
+        按日志记录恢复单个批次
+        
+        Args:
+            task_id: 任务ID
+            entries: 日志记录 [(类型, 内容)]，第一条为批次参数
+            
+        Returns:
+            是否已恢复
+        """
+        if not entries or entries[0][0] != 'created':
+            cls._get_journal().finish(task_id)
+            return False
+        
+        if ProgressService().is_task_cancelled(task_id):
+            # 所属进程退出前任务已被取消（取消请求可能由其他工作进程处理）
+            cls._get_journal().finish(task_id)
+            return False
+        
+        batch_params = entries[0][1]
+        if batch_params.get('api_key_omitted'):
+            secrets = cls._recall_secrets(task_id)
+            if secrets is None:
+                # 任务日志不保存 API 密钥，使用前端自定义密钥的任务无法在新进程中继续
+                ProgressService().fail_task(task_id, '服务重启后无法恢复使用自定义 API 密钥的任务，请重新生成')
+                cls._get_journal().finish(task_id)
+                return False
+            batch_params = cls._merge_secrets(batch_params, secrets)
+        
+        images: Dict[int, str] = {}
+        failures: Dict[int, str] = {}
+        for kind, data in entries[1:]:
+            page_number = data['page_number']
+            if kind == 'page_completed':
+                images[page_number] = data['image_url']
+                failures.pop(page_number, None)
+            elif kind == 'page_failed':
+                failures[page_number] = data['error']
+        
+        file_utils = FileUtils()
+        images = {
+            page_number: url for page_number, url in images.items()
+            if not url.startswith('/uploads/') or file_utils.file_exists(url[len('/uploads/'):])
+        }
+        
+        pages = batch_params['pages']
+        pending_pages = [
+            page for page in pages
+            if page.get('page_number', 0) not in images and page.get('page_number', 0) not in failures
+        ]
+        
+        service = cls(
+            generator_type=batch_params['generator_type'],
+            model_config=batch_params['model_config']
+        )
+        if not service.progress_service.restore_task(
+            task_id,
+            total_pages=len(pages),
+            images=images,
+            failures=failures,
+            pending_pages=len(pending_pages),
+            topic=batch_params['topic'],
+            client_id=batch_params.get('client_id')
+        ):
+            return False
+        
+        service._run_batch(task_id, pages, pending_pages, batch_params)
+        return True
+    
+    def _register_batch(self, task_id: str, batch_state: Dict[str, Any]):
+        """
+        登记批次上下文（页面、主题、参考图、生成器配置），供取消和重试失败页面使用
+        
+        Args:
+            task_id: 任务ID
+            batch_state: 批次共享状态
+        """
+        batch_state['pages_by_number'] = {
+            page.get('page_number', 0): page for page in batch_state['page_args'][4]
+        }
+        processed_reference = batch_state['page_args'][0]
+        batch_params = batch_state['batch_params']
+        # 上下文主要占用：处理后的参考图、原始参考图、页面和大纲文本（按字符数估算）
+        batch_state['retained_bytes'] = (
+            len(processed_reference or '')
+            + len(batch_params.get('reference_image') or '')
+            + len(batch_params.get('full_outline') or '')
+            + len(str(batch_params.get('pages') or ''))
+        )
+        
+        with ImageService._batches_lock:
+            ImageService._batches[task_id] = (self, batch_state)
+            ImageService._batches.move_to_end(task_id)
+    
+    def _release_batch(self, task_id: str, batch_state: Dict[str, Any]):
+        """
+        批次结束后释放上下文
+        
+        启用任务日志时直接移除（重试时按日志重建）；否则在 MAX_RETAINED_BATCHES 个、
+        RETAINED_BATCHES_MAX_BYTES 字节的预算内保留最近结束的批次，超出时淘汰最早结束的。
+        执行中的批次不会被淘汰。
+        
+        Args:
+            task_id: 任务ID
+            batch_state: 批次共享状态
+        """
+        with ImageService._batches_lock:
+            entry = ImageService._batches.get(task_id)
+            if entry is None or entry[1] is not batch_state:
+                return
+            if Config.TASK_JOURNAL_ENABLED:
+                del ImageService._batches[task_id]
+                return
+            
+            ImageService._batches.move_to_end(task_id)
+            finished = [
+                (tid, state) for tid, (_, state) in ImageService._batches.items() if state['finalized']
+            ]
+            count = len(finished)
+            total_bytes = sum(state['retained_bytes'] for _, state in finished)
+            for tid, state in finished:
+                if count <= self.MAX_RETAINED_BATCHES and total_bytes <= Config.RETAINED_BATCHES_MAX_BYTES:
+                    break
+                del ImageService._batches[tid]
+                count -= 1
+                total_bytes -= state['retained_bytes']
+    
+    def _restore_batch_context(
+        self,
+        task_id: str,
+        model_config: Optional[Dict[str, Any]] = None
+    ) -> tuple[Optional[tuple], str]:
+        """
+        按任务日志中保留的批次参数重建批次上下文并登记到本进程
+        
+        Args:
+            task_id: 任务ID
+            model_config: 请求中提供的模型配置（任务使用自定义 API 密钥且本进程未保留密钥时需要）
+            
+        Returns:
+            ((ImageService, 批次共享状态), 错误信息)，无法重建时上下文为None
+        """
+        journal = self._get_journal()
+        batch_params = journal.load_params(task_id) if journal is not None else None
+        if batch_params is None:
+            return None, '任务上下文已过期，请重新生成'
+        
+        if batch_params.get('api_key_omitted'):
+            secrets = self._recall_secrets(task_id)
+            if secrets is None and model_config:
+                secrets = {
+                    'apiKey': model_config.get('apiKey', ''),
+                    'endpoints': [endpoint.get('apiKey', '') for endpoint in model_config.get('endpoints') or []]
+                }
+            if secrets is None or not secrets['apiKey']:
+                return None, '任务使用自定义 API 密钥，请在请求中提供 image_model_config 后重试'
+            batch_params = self._merge_secrets(batch_params, secrets)
+        
+        service = ImageService(
+            generator_type=batch_params['generator_type'],
+            model_config=batch_params['model_config']
+        )
+        batch_state, error_msg = service._prepare_batch(batch_params['pages'], 0, batch_params)
+        if batch_state is None:
+            return None, error_msg
+        
+        with ImageService._batches_lock:
+            entry = ImageService._batches.get(task_id)
+            if entry is not None:
+                # 并发的重试请求已先一步重建
+                return entry, ''
+        service._register_batch(task_id, batch_state)
+        logger.info(f"已按任务日志重建批次上下文: {task_id}")
+        return (service, batch_state), ''
+    
+    def retry_failed_pages(
+        self,
+        task_id: str,
+        model_config: Optional[Dict[str, Any]] = None
+    ) -> tuple[bool, str, List[int]]:
+        """
+        只重新生成已结束任务中失败（含超时）的页面，结果写回同一个任务
+        
+        复用原批次的页面、主题、参考图和生成器配置，进度通过原有 SSE 通道推送。
+        
+        Args:
+            task_id: 任务ID
+            model_config: 模型配置（可选，只用于补充任务日志中未保存的 API 密钥）
+            
+        Returns:
+            (是否成功, 错误信息, 重试的页码列表)
+        """
+        progress = self.progress_service.get_progress(task_id)
+        if not progress:
+            return False, '任务不存在或已过期', []
+        
+        if not self.progress_service.is_task_completed(task_id):
+            return False, '任务仍在进行中，无法重试', []
+        
+        with ImageService._batches_lock:
+            entry = ImageService._batches.get(task_id)
+        if entry is None:
+            # 批次由其他工作进程执行（或本进程已淘汰其上下文），按任务日志重建
+            entry, error_msg = self._restore_batch_context(task_id, model_config)
+            if entry is None:
+                return False, error_msg, []
+        
+        service, batch_state = entry
+        
+        done_pages = {img['page_number'] for img in progress['images']}
+        retry_numbers = sorted({
+            failed['page_number'] for failed in progress['failed_pages']
+            if failed['page_number'] not in done_pages
+            and failed['page_number'] in batch_state['pages_by_number']
+        })
+        if not retry_numbers:
+            return False, '没有需要重试的失败页面', []
+        
+        with batch_state['lock']:
+            if batch_state['remaining'] > 0:
+                return False, '任务仍在进行中，无法重试', []
+            batch_state['remaining'] = len(retry_numbers)
+            batch_state['cache_hits'] = 0
+            batch_state['cancel_token'] = CancellationToken()
+            batch_state['calls_avoided'] = 0
+            batch_state['finalized'] = False
+            batch_state['task_deadline'] = time.monotonic() + batch_state['task_timeout']
+            for page_number in retry_numbers:
+                batch_state['throttle_retries'].pop(page_number, None)
+        
+        self.progress_service.retry_pages(task_id, retry_numbers)
+        
+        # 已结束任务的日志已删除，重新记录批次参数和保留的页面结果
+        retry_set = set(retry_numbers)
+        journal_entries = [
+            ('page_completed', {'page_number': img['page_number'], 'image_url': img['url']})
+            for img in progress['images']
+        ] + [
+            ('page_failed', {'page_number': failed['page_number'], 'error': failed['error']})
+            for failed in progress['failed_pages'] if failed['page_number'] not in retry_set
+        ]
+        service._journal('start', task_id, self._split_secrets(batch_state['batch_params'])[0], journal_entries)
+        
+        for page_number in retry_numbers:
+            service._submit_page(task_id, batch_state['pages_by_number'][page_number], batch_state)
+        
+        logger.info(f"失败页面已重新提交: {task_id}, 页码: {retry_numbers}")
+        return True, '', retry_numbers
+    
+    def _get_provider_identity(self) -> tuple[str, str]:
+        """
+        获取当前生成器的服务商标识和模型（用于结果缓存键）
+        
+        Returns:
+            (服务商标识, 模型名称)
+        """
+        client = getattr(self.generator, 'client', None)
+        if isinstance(client, (ImageAPIClient, EndpointRouter)):
+            # 多端点路由的各端点等价，按主端点计算
+            return client.api_url, client.model
+        return self.generator_type, self.generator_type
+    
+    def _get_provider_limiter(self):
+        """
+        获取调度器预留名额使用的服务商并发限制器
+        
+        Returns:
+            单端点 API 客户端的限制器；多端点路由请求前才选定端点，由客户端自行尝试获取名额，返回None
+        """
+        client = getattr(self.generator, 'client', None)
+        if isinstance(client, ImageAPIClient):
+            return client.limiter
+        return None
+    
+    def get_throughput_key(self) -> str:
+        """
+        获取吞吐统计使用的服务商标识（不需要创建生成器，准入控制在提交前调用）
+        
+        Returns:
+            服务商地址和模型组成的标识，mock 等本地生成器返回生成器类型
+        """
+        endpoint = self._get_endpoint()
+        if endpoint is None:
+            return self.generator_type
+        url, model = endpoint
+        return f'{url}|{model}'
+    
+    def _get_endpoint(self) -> Optional[tuple[str, str]]:
+        """
+        获取配置的服务地址和模型（不创建生成器）
+        
+        Returns:
+            (服务地址, 模型)，mock 等本地生成器返回None
+        """
+        if self.generator_type not in ('image_api', 'openai'):
+            return None
+        if self.model_config:
+            return self.model_config.get('url', '').strip(), self.model_config.get('model', '').strip()
+        return Config.IMAGE_API_URL, Config.IMAGE_MODEL
+    
+    def _get_endpoint_urls(self) -> List[str]:
+        """获取主端点和所有备用端点的地址（不创建生成器）"""
+        endpoint = self._get_endpoint()
+        if endpoint is None or not endpoint[0]:
+            return []
+        if self.model_config:
+            extra = [e.get('url', '').strip() for e in self.model_config.get('endpoints') or []]
+        else:
+            extra = Config.IMAGE_API_FALLBACK_URLS
+        return [endpoint[0]] + [url for url in extra if url]
+    
+    def get_circuit_retry_after(self) -> float:
+        """
+        检查服务地址是否已熔断（配置了备用端点时，全部熔断才算不可用）
+        
+        Returns:
+            最早恢复的端点剩余冷却秒数，有可用端点时返回0
+        """
+        retry_afters = []
+        for url in self._get_endpoint_urls():
+            breaker = find_circuit_breaker(url)
+            retry_after = breaker.retry_after() if breaker else 0.0
+            if retry_after <= 0:
+                return 0.0
+            retry_afters.append(retry_after)
+        return min(retry_afters, default=0.0)
+    
+    def _result_cache_key(
+        self,
+        prompt: str,
+        width: int,
+        height: int,
+        cache_context: tuple
+    ) -> str:
+        """计算单页的结果缓存键"""
+        reference_digest, provider, model = cache_context
+        return self.result_cache.make_key(prompt, width, height, reference_digest, provider, model)
+    
+    def _get_cached_result(self, page: Dict[str, Any], batch_state: Dict[str, Any]) -> Optional[str]:
+        """
+        查询页面的结果缓存
+        
+        Args:
+            page: 页面信息
+            batch_state: 批次共享状态
+            
+        Returns:
+            命中时返回本地图片 URL，否则返回None
+        """
+        reference_image, width, height, topic, pages, full_outline, cache_context = batch_state['page_args']
+        if not cache_context:
+            return None
+        
+        prompt = self._build_prompt(page, topic, pages, full_outline, reference_image)
+        key = self._result_cache_key(prompt, width, height, cache_context)
+        return self.result_cache.get(
+            key,
+            validator=lambda url: self.file_utils.file_exists(url[len('/uploads/'):])
+        )
+    
+    def _submit_page(
+        self,
+        task_id: str,
+        page: Dict[str, Any],
+        batch_state: Dict[str, Any],
+        delay: float = 0,
+        limiter: Optional[Any] = None
+    ):
+        """
+        将单页作业提交到全局调度器
+        
+        Args:
+            task_id: 任务ID
+            page: 页面信息
+            batch_state: 批次共享状态
+            delay: 延迟秒数（限流后重新排队时使用）
+            limiter: 作业需要的服务商并发限制器，默认使用批次的限制器（单端点时）
+        """
+        cancel_token = batch_state['cancel_token']
+        future = self.scheduler.submit_delayed(
+            task_id,
+            delay,
+            functools.partial(self._run_page, task_id, batch_state, cancel_token),
+            page,
+            *batch_state['page_args'],
+            cancel_token=cancel_token,
+            page_timeout=batch_state['page_timeout'],
+            task_deadline=batch_state['task_deadline'],
+            provider=batch_state['throughput_key'],
+            limiter=limiter or batch_state['provider_limiter']
+        )
+        future.add_done_callback(
+            functools.partial(self._on_page_done, task_id, page, batch_state)
+        )
+    
+    def _run_page(
+        self,
+        task_id: str,
+        batch_state: Dict[str, Any],
+        cancel_token: CancellationToken,
+        page: Dict[str, Any],
+        *page_args
+    ) -> Dict[str, Any]:
+        """
+        执行单页作业：先检查共享进度中的取消标记，任务已被其他工作进程取消时不再调用服务商
+        
+        Args:
+            task_id: 任务ID
+            batch_state: 批次共享状态
+            cancel_token: 提交时的任务取消令牌
+            page: 页面信息
+            *page_args: 批次共享的生成参数（见 batch_state['page_args']）
+            
+        Returns:
+            生成结果
+        """
+        if not cancel_token.is_cancelled and self.progress_service.is_task_cancelled(task_id):
+            logger.info(f"任务已在其他进程取消，撤回剩余页面: {task_id}")
+            self._cancel_batch(task_id, batch_state)
+        if cancel_token.is_cancelled:
+            with batch_state['lock']:
+                batch_state['calls_avoided'] += 1
+            return {'success': False, 'cancelled': True}
+        return self._generate_single_image(page, *page_args, cancel_token=cancel_token)
+    
+    def _requeue_throttled_page(
+        self,
+        task_id: str,
+        page: Dict[str, Any],
+        batch_state: Dict[str, Any],
+        retry_after: Optional[float],
+        local_reason: Optional[str] = None,
+        full_limiter: Optional[Any] = None
+    ) -> bool:
+        """
+        被服务商限流的页面延迟后重新排队，而不是记为失败
+        
+        本地暂缓的页面只在第一次暂缓时推送进度，之后只记调试日志；
+        服务商并发名额已满时页面挂起在调度器中，名额释放后再执行，不再定时轮询。
+        
+        Args:
+            task_id: 任务ID
+            page: 页面信息
+            batch_state: 批次共享状态
+            retry_after: 服务商要求的等待时间（秒）
+            local_reason: 本地暂缓发送的原因（API 密钥限速、服务商并发名额已满、熔断探测中），
+                请求未发出，不计入重试次数，受任务时限约束
+            full_limiter: 并发名额已满的服务商限制器
+            
+        Returns:
+            是否已重新排队（超过最大重试次数时返回 False）
+        """
+        page_number = page.get('page_number', 0)
+        
+        with batch_state['lock']:
+            attempts = batch_state['throttle_retries'].get(page_number, 0)
+            first_deferral = False
+            if not local_reason:
+                attempts += 1
+                if attempts > self.MAX_THROTTLE_RETRIES:
+                    return False
+                batch_state['throttle_retries'][page_number] = attempts
+            elif page_number not in batch_state['deferred_pages']:
+                batch_state['deferred_pages'].add(page_number)
+                first_deferral = True
+        
+        if local_reason and full_limiter is not None:
+            # 并发名额已满：由调度器挂起到该服务商释放名额
+            self._submit_page(task_id, page, batch_state, limiter=full_limiter)
+            if first_deferral:
+                self.progress_service.update_progress(
                     task_id=task_id,
-                    message='所有图片生成完成！'
+                    current_page=page_number,
+                    message=f'第 {page_number} 页暂缓发送（{local_reason}），等待空闲名额'
                 )
-                logger.info(f"任务完成: {task_id}")
+                logger.info(f"页面 {page_number} 暂缓发送（{local_reason}），等待空闲名额")
+            else:
+                logger.debug(f"页面 {page_number} 暂缓发送（{local_reason}），继续等待空闲名额")
+            return True
+        
+        # 未给出 Retry-After 时按重试次数指数退避
+        delay = retry_after if retry_after else DEFAULT_RETRY_AFTER * (2 ** max(0, attempts - 1))
+        self._submit_page(task_id, page, batch_state, delay=delay)
+        
+        if local_reason:
+            if first_deferral:
+                self.progress_service.update_progress(
+                    task_id=task_id,
+                    current_page=page_number,
+                    message=f'第 {page_number} 页暂缓发送（{local_reason}），{delay:.0f} 秒后重试'
+                )
+                logger.info(f"页面 {page_number} 暂缓发送（{local_reason}），{delay:.1f}s 后重新排队")
+            else:
+                logger.debug(f"页面 {page_number} 暂缓发送（{local_reason}），{delay:.1f}s 后重新排队")
+        else:
+            self.progress_service.update_progress(
+                task_id=task_id,
+                current_page=page_number,
+                message=f'第 {page_number} 页被服务商限流，{delay:.0f} 秒后重试'
+            )
+            logger.warning(f"页面 {page_number} 被限流，{delay:.1f}s 后重新排队 (第 {attempts} 次)")
+        return True
+    
+    def _on_page_done(
+        self,
+        task_id: str,
+        page: Dict[str, Any],
+        batch_state: Dict[str, Any],
+        future: Future
+    ):
+        """
+        单页作业完成回调：记录页面结果，最后一页完成时收尾整个任务
+        
+        Args:
+            task_id: 任务ID
+            page: 页面信息
+            batch_state: 批次共享状态（总页数、剩余页数）
+            future: 页面作业的 Future
+        """
+        page_number = page.get('page_number', 0)
+        cancel_token = batch_state['cancel_token']
+        
+        try:
+            if future.cancelled():
+                # 任务已取消，该页从未发起调用
+                with batch_state['lock']:
+                    batch_state['calls_avoided'] += 1
+                result = {'success': False, 'cancelled': True}
             else:
-                completed = progress['completed_pages'] if progress else 0
-                self.progress_service.complete_task(
+                result = future.result()
+            
+            rate_limit_wait = result.get('rate_limit_wait', 0)
+            if rate_limit_wait:
+                with batch_state['lock']:
+                    batch_state['rate_limit_wait'] += rate_limit_wait
+            
+            if result.get('cancelled'):
+                # 已取消任务的页面不记为失败
+                pass
+            elif cancel_token.is_abandoned or (cancel_token.is_cancelled and not result['success']):
+                # 已取消任务：失败结果不再重试或记录，超过宽限期的结果直接放弃
+                logger.info(f"任务已取消，忽略页面 {page_number} 的结果")
+            elif not result['success'] and result.get('throttled') and self._requeue_throttled_page(
+                task_id, page, batch_state, result.get('retry_after'),
+                local_reason=result.get('error') if result.get('rate_limited') else None,
+                full_limiter=result.get('full_limiter')
+            ):
+                # 页面已重新排队，暂不计入完成
+                return
+            elif result['success']:
+                if result.get('cached'):
+                    with batch_state['lock']:
+                        batch_state['cache_hits'] += 1
+                    message = f'第 {page_number} 页命中缓存'
+                else:
+                    message = f'第 {page_number} 页生成完成'
+                if rate_limit_wait >= 1:
+                    message += f'（API 限速等待 {rate_limit_wait:.0f} 秒）'
+                
+                # 更新进度
+                self.progress_service.update_progress(
                     task_id=task_id,
-                    message=f'生成完成，成功 {completed}/{len(pages)} 页'
+                    current_page=page_number,
+                    image_url=result['image_url'],
+                    message=message
                 )
-                logger.warning(f"任务部分完成: {task_id}, 成功 {completed}/{len(pages)}")
+                self._journal('append', task_id, 'page_completed', {
+                    'page_number': page_number,
+                    'image_url': result['image_url']
+                })
+                logger.info(f"页面 {page_number} 生成成功")
+            else:
+                # 记录失败页面
+                error_msg = result.get('error', '未知错误')
+                self._record_page_failure(task_id, page_number, error_msg)
+                logger.error(f"页面 {page_number} 生成失败: {error_msg}")
+                # 继续生成其他页面，不中断整个任务
+                
+        except GenerationTimeoutError as e:
+            # 超时页面按时记为失败，可通过重试接口重新生成
+            if not cancel_token.is_cancelled:
+                self._record_page_failure(task_id, page_number, str(e))
+            logger.error(f"页面 {page_number} 生成超时: {e}")
             
         except Exception as e:
-            error_msg = f'批量生成失败: {str(e)}'
-            logger.error(f"任务失败: {task_id}, {error_msg}", exc_info=True)
-            self.progress_service.fail_task(task_id, error_msg)
+            # 其他异常情况也记录为失败
+            error_msg = f"处理结果异常: {str(e)}"
+            self._record_page_failure(task_id, page_number, error_msg)
+            logger.error(f"处理页面 {page_number} 结果时出错: {e}", exc_info=True)
+        
+        with batch_state['lock']:
+            batch_state['remaining'] -= 1
+            is_last = batch_state['remaining'] == 0
+        
+        if is_last:
+            if cancel_token.is_cancelled:
+                self._finish_cancelled(task_id, batch_state)
+            else:
+                self._finish_batch(task_id, batch_state)
+    
+    def _record_page_failure(self, task_id: str, page_number: int, error: str):
+        """记录失败页面并写入任务日志"""
+        self.progress_service.record_failed_page(
+            task_id=task_id,
+            page_number=page_number,
+            error=error
+        )
+        self._journal('append', task_id, 'page_failed', {'page_number': page_number, 'error': error})
+    
+    def _finish_cancelled(self, task_id: str, batch_state: Dict[str, Any]):
+        """
+        收尾已取消的任务：所有页面已结束或宽限期已到，二者先到者生效
+        
+        Args:
+            task_id: 任务ID
+            batch_state: 批次共享状态
+        """
+        with batch_state['lock']:
+            if batch_state['finalized']:
+                return
+            batch_state['finalized'] = True
+            calls_avoided = batch_state['calls_avoided']
+            in_flight = batch_state['remaining']
+        
+        progress = self.progress_service.get_progress(task_id)
+        completed = progress['completed_pages'] if progress else 0
+        self.progress_service.cancel_task(
+            task_id=task_id,
+            message=f'任务已取消，已完成 {completed}/{batch_state["total"]} 页，节省 {calls_avoided} 次生成调用',
+            calls_avoided=calls_avoided
+        )
+        self._journal('finish', task_id)
+        self._release_batch(task_id, batch_state)
+        if in_flight:
+            logger.warning(f"任务取消宽限期已到: {task_id}, 放弃 {in_flight} 个执行中的页面")
+        logger.info(f"任务已取消: {task_id}, 完成 {completed} 页, 避免调用 {calls_avoided} 次")
+    
+    def _finish_batch(self, task_id: str, batch_state: Dict[str, Any]):
+        """
+        所有页面处理完毕后更新任务最终状态
+        
+        Args:
+            task_id: 任务ID
+            batch_state: 批次共享状态
+        """
+        with batch_state['lock']:
+            batch_state['finalized'] = True
+        
+        total_pages = batch_state['total']
+        cache_hits = batch_state['cache_hits']
+        cache_note = f'（其中 {cache_hits} 页来自缓存）' if cache_hits else ''
+        if batch_state['rate_limit_wait'] > 0:
+            logger.info(f"任务 {task_id} 累计 API 限速等待 {batch_state['rate_limit_wait']:.1f}s")
+        
+        # 检查是否所有图片都生成成功
+        progress = self.progress_service.get_progress(task_id)
+        if progress and progress['status'] == 'cancelled':
+            # 取消请求由其他工作进程处理，保持取消状态
+            logger.info(f"任务已在其他进程取消，不再标记完成: {task_id}")
+        elif progress and progress['completed_pages'] == total_pages:
+            self.progress_service.complete_task(
+                task_id=task_id,
+                message=f'所有图片生成完成！{cache_note}'
+            )
+            logger.info(f"任务完成: {task_id}, 缓存命中 {cache_hits} 页")
+        else:
+            completed = progress['completed_pages'] if progress else 0
+            self.progress_service.complete_task(
+                task_id=task_id,
+                message=f'生成完成，成功 {completed}/{total_pages} 页{cache_note}'
+            )
+            logger.warning(f"任务部分完成: {task_id}, 成功 {completed}/{total_pages}")
+        
+        self._journal('finish', task_id)
+        self._release_batch(task_id, batch_state)
     
     def _generate_single_image(
         self,
@@ -211,29 +1125,32 @@ class ImageService:
         height: int,
         topic: str = '',
         all_pages: List[Dict[str, Any]] = None,
-        full_outline: str = ''
+        full_outline: str = '',
+        cache_context: Optional[tuple] = None,
+        cancel_token: Optional[CancellationToken] = None
     ) -> Dict[str, Any]:
         """
         生成单张图片
         
         Args:
             page: 页面信息
-            reference_image: 参考图片
+            reference_image: 已处理的参考图片（Data URL 或 HTTP URL，批次内只编码一次）
             width: 宽度
             height: 高度
             topic: 用户原始需求
             all_pages: 所有页面列表（用于获取封面信息）
             full_outline: 完整内容大纲
+            cache_context: 结果缓存上下文 (参考图摘要, 服务商, 模型)，None 表示不写入缓存
+            cancel_token: 任务取消令牌，超过取消宽限期后不再下载保存结果
             
         Returns:
             生成结果
         """
+        # 清零本线程的限速等待计时，生成结束后取出本页的等待时间
+        take_wait_time()
         try:
-            # 如果有参考图片且是本地路径，转换为 base64 Data URL
-            processed_reference = self._process_reference_image(reference_image)
-            
             # 构建提示词
-            prompt = self._build_prompt(page, topic, all_pages, full_outline, processed_reference)
+            prompt = self._build_prompt(page, topic, all_pages, full_outline, reference_image)
             
             # 生成图片 - 使用统一的 generate 接口
             generation_result = self.generator.generate(
@@ -241,23 +1158,43 @@ class ImageService:
                 prompt=prompt,
                 width=width,
                 height=height,
-                reference_image=processed_reference
+                reference_image=reference_image
             )
+            rate_limit_wait = take_wait_time()
             
             # 转换为旧格式以保持兼容性
+            if cancel_token is not None and cancel_token.is_abandoned:
+                # 任务已取消且超过宽限期，结果无人使用，不再下载保存
+                logger.info(f"任务已取消，放弃第 {page.get('page_number', 0)} 页的生成结果")
+                return {
+                    'success': False,
+                    'cancelled': True
+                }
+            
             if generation_result.success:
                 # 下载图片并保存到本地
                 image_url = generation_result.url
                 local_url = self._save_image_locally(image_url)
                 
+                # 只缓存已成功保存到本地的结果（临时 URL 会过期）
+                if cache_context and local_url.startswith('/uploads/'):
+                    cache_key = self._result_cache_key(prompt, width, height, cache_context)
+                    self.result_cache.put(cache_key, local_url)
+                
                 return {
                     'success': True,
-                    'image_url': local_url  # 返回本地 URL
+                    'image_url': local_url,  # 返回本地 URL
+                    'rate_limit_wait': rate_limit_wait
                 }
             else:
                 return {
                     'success': False,
-                    'error': generation_result.error
+                    'error': generation_result.error,
+                    'throttled': generation_result.metadata.get('throttled', False),
+                    'retry_after': generation_result.metadata.get('retry_after'),
+                    'rate_limited': generation_result.metadata.get('rate_limited', False),
+                    'full_limiter': generation_result.metadata.get('full_limiter'),
+                    'rate_limit_wait': rate_limit_wait
                 }
             
         except Exception as e:
@@ -447,7 +1384,11 @@ class ImageService:
     
     def cancel_task(self, task_id: str) -> bool:
         """
-        取消任务（标记为失败）
+        取消任务
+        
+        排队中的页面立即撤出调度队列，不再调用服务商；执行中的页面有
+        CANCEL_GRACE_PERIOD 秒宽限期，期间完成的图片仍然保留，超时后任务直接结束，
+        之后到达的结果被放弃。最终进度中的 calls_avoided 为节省的调用次数。
         
         Args:
             task_id: 任务ID
@@ -462,7 +1403,45 @@ class ImageService:
             logger.warning(f"任务已完成，无法取消: {task_id}")
             return False
         
-        return self.progress_service.fail_task(task_id, '用户取消任务')
+        with ImageService._batches_lock:
+            entry = ImageService._batches.get(task_id)
+        if entry is not None:
+            service, batch_state = entry
+            with batch_state['lock']:
+                running_here = not batch_state['finalized']
+            if running_here:
+                service._cancel_batch(task_id, batch_state)
+                return True
+        
+        # 批次不在本进程执行（由其他工作进程执行，或尚未提交）：只标记共享进度为已取消，
+        # 执行该批次的进程在下一页开始前发现取消标记，撤回剩余页面并收尾
+        return self.progress_service.cancel_task(task_id, '任务已取消')
+    
+    def _cancel_batch(self, task_id: str, batch_state: Dict[str, Any]):
+        """
+        取消本进程执行的批次：撤回排队中的页面，宽限期后收尾
+        
+        Args:
+            task_id: 任务ID
+            batch_state: 批次共享状态
+        """
+        cancel_token = batch_state['cancel_token']
+        grace_period = Config.CANCEL_GRACE_PERIOD
+        with batch_state['lock']:
+            if cancel_token.is_cancelled:
+                return
+            cancel_token.cancel(grace_period)
+        
+        # 撤回排队中的页面，回调中计入 calls_avoided；没有执行中的页面时会直接收尾
+        withdrawn = self.scheduler.cancel_task(task_id)
+        logger.info(f"任务取消中: {task_id}, 撤回 {withdrawn} 个排队页面")
+        
+        with batch_state['lock']:
+            pending = not batch_state['finalized']
+        if pending:
+            timer = threading.Timer(grace_period, self._finish_cancelled, args=(task_id, batch_state))
+            timer.daemon = True
+            timer.start()
     
     def get_task_progress(self, task_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -573,6 +1552,12 @@ class ImageService:
                 custom_model = self.model_config.get('model', '').strip()
                 raw_api_format = self.model_config.get('apiFormat', 'openai_dalle')
                 api_format = self._normalize_api_format(raw_api_format)
+                # 等价的备用端点（可选），未指定的字段沿用主配置
+                endpoints = [
+                    dict(endpoint, apiFormat=self._normalize_api_format(endpoint['apiFormat']))
+                    if endpoint.get('apiFormat') else endpoint
+                    for endpoint in self.model_config.get('endpoints') or []
+                ]
                 
                 # 验证必要配置
                 if not custom_key:
@@ -590,7 +1575,8 @@ class ImageService:
                         api_key=custom_key,
                         api_url=custom_url,
                         model=custom_model or 'dall-e-3',
-                        apiFormat=api_format
+                        apiFormat=api_format,
+                        endpoints=endpoints
                     )
                     
                 elif self.generator_type == 'openai':
@@ -598,7 +1584,8 @@ class ImageService:
                         provider='openai',
                         api_key=custom_key,
                         base_url=custom_url,
-                        model=custom_model or 'dall-e-3'
+                        model=custom_model or 'dall-e-3',
+                        endpoints=endpoints
                     )
                 else:
                     # 其他类型也使用 image_api 格式
@@ -607,7 +1594,8 @@ class ImageService:
                         api_key=custom_key,
                         api_url=custom_url,
                         model=custom_model or 'dall-e-3',
-                        apiFormat=api_format
+                        apiFormat=api_format,
+                        endpoints=endpoints
                     )
             
             # 如果没有前端配置，使用默认配置（工厂方法会从环境变量读取）
@@ -618,62 +1606,42 @@ class ImageService:
             logger.error(f"创建图片生成器失败: {e}", exc_info=True)
             return None
     
-    def _process_reference_image(self, reference_image: Optional[str]) -> Optional[str]:
+    def _get_timeouts(self) -> tuple[float, float]:
         """
-        处理参考图片：将本地文件路径转换为 base64 Data URL
+        获取当前服务商 API 格式对应的单页时限和任务时限
+        
+        Returns:
+            (单页时限, 任务时限) 秒
+        """
+        overrides = Config.GENERATION_TIMEOUTS.get(self._get_api_format(), {})
+        return (
+            float(overrides.get('page', Config.PAGE_TIMEOUT)),
+            float(overrides.get('task', Config.TASK_TIMEOUT))
+        )
+    
+    def _get_api_format(self) -> Optional[str]:
+        """
+        获取当前生成器使用的服务商 API 格式（Mock 生成器返回None）
+        
+        Returns:
+            API 格式 (openai_chat/openai_dalle/gemini)
+        """
+        client = getattr(self.generator, 'client', None)
+        return getattr(client, 'api_format', None)
+    
+    def _process_reference_image(
+        self,
+        reference_image: Optional[str],
+        api_format: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        处理参考图片：按服务商格式缩放压缩并转换为 base64 Data URL（带进程级缓存）
         
         Args:
             reference_image: 参考图片路径或URL
+            api_format: 服务商 API 格式，None 表示只编码不压缩
             
         Returns:
             处理后的图片（base64 Data URL 或 HTTP URL）
         """
-        if not reference_image:
-            return None
-        
-        # 如果已经是 Data URL 或 HTTP URL，直接返回
-        if reference_image.startswith('data:image') or \
-           reference_image.startswith('http://') or \
-           reference_image.startswith('https://'):
-            return reference_image
-        
-        # 本地文件路径，需要转换为 base64
-        try:
-            import base64
-            import mimetypes
-            from pathlib import Path
-            
-            # 构建完整文件路径
-            if reference_image.startswith('/uploads/'):
-                file_path = Path('uploads') / reference_image.replace('/uploads/', '')
-            elif reference_image.startswith('uploads/'):
-                file_path = Path(reference_image)
-            else:
-                file_path = Path('uploads') / reference_image
-            
-            if not file_path.exists():
-                logger.warning(f"参考图片文件不存在: {file_path}")
-                return None
-            
-            # 读取文件内容
-            with open(file_path, 'rb') as f:
-                image_data = f.read()
-            
-            # 编码为 base64
-            base64_data = base64.b64encode(image_data).decode('utf-8')
-            
-            # 获取 MIME 类型
-            mime_type, _ = mimetypes.guess_type(str(file_path))
-            if not mime_type:
-                mime_type = 'image/jpeg'  # 默认
-            
-            # 构建 Data URL
-            data_url = f"data:{mime_type};base64,{base64_data}"
-            
-            logger.info(f"参考图片转换为 base64 成功: {file_path} -> {len(base64_data)} 字符")
-            
-            return data_url
-            
-        except Exception as e:
-            logger.error(f"处理参考图片失败: {e}", exc_info=True)
-            return None
\ No newline at end of file
+        return self.reference_service.encode(reference_image, api_format=api_format)
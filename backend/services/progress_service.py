@@ -1,13 +1,17 @@
 """
 进度管理服务
-管理图片生成任务的实时进度
+管理图片生成任务的实时进度，并以增量事件的形式发布进度变化
 """
+import heapq
 import logging
 import threading
-from typing import Dict, Any, Optional
-from datetime import datetime
+import time
+from typing import Dict, Any, List, Optional, Set, Tuple
 from enum import Enum
 
+from config import Config
+from storage.progress_storage import ProgressEvent, TaskRecord, create_progress_storage, parse_timestamp
+
 logger = logging.getLogger(__name__)
 
 
@@ -17,10 +21,22 @@ class TaskStatus(Enum):
     RUNNING = 'running'
     COMPLETED = 'completed'
     FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+
+# 已结束的任务状态
+FINISHED_STATUSES = (TaskStatus.COMPLETED.value, TaskStatus.FAILED.value, TaskStatus.CANCELLED.value)
 
 
 class ProgressService:
-    """进度管理服务类 - 线程安全的单例模式"""
+    """进度管理服务类 - 线程安全的单例模式
+    
+    任务记录和事件由可插拔的进度存储保存（PROGRESS_BACKEND）：
+    默认 memory 为进程内存储；sqlite 为多个工作进程共享的 SQLite 文件，
+    任一进程创建和更新的任务都能被其他进程的 SSE 连接订阅。
+    
+    已结束的任务按结束时间（单调时钟）放入最小堆，清理时只弹出堆顶的过期任务。
+    """
     
     _instance = None
     _lock = threading.Lock()
@@ -36,20 +52,73 @@ class ProgressService:
     def __init__(self):
         """初始化服务"""
         if not hasattr(self, '_initialized'):
-            self._tasks: Dict[str, Dict[str, Any]] = {}
-            self._tasks_lock = threading.Lock()
+            self._storage = create_progress_storage(
+                Config.PROGRESS_BACKEND,
+                buffer_size=Config.PROGRESS_EVENT_BUFFER_SIZE,
+                db_path=Config.PROGRESS_DB_PATH,
+                poll_interval=Config.PROGRESS_POLL_INTERVAL
+            )
             self._initialized = True
             self._max_tasks = 1000  # 最大任务数限制
             self._cleanup_hours = 24  # 自动清理24小时前的完成任务
             
+            # 已结束任务的过期堆：(结束时的单调时钟, 任务ID)，_finished_at 用于识别已失效的堆元素
+            self._expiry_lock = threading.Lock()
+            self._expiry_heap: List[Tuple[float, str]] = []
+            self._finished_at: Dict[str, float] = {}
+            self._load_finished_tasks()
+            
             # 启动自动清理线程
             self._start_cleanup_thread()
-            logger.info("进度管理服务已初始化")
+            logger.info(f"进度管理服务已初始化: 存储={self._storage.name}")
+    
+    def _load_finished_tasks(self):
+        """将存储中已有的已结束任务（如 SQLite 中的历史任务）登记到过期堆"""
+        now_wall = time.time()
+        now_mono = time.monotonic()
+        for task_id, task in self._storage.get_all().items():
+            if task['status'] in FINISHED_STATUSES:
+                age = max(0.0, now_wall - parse_timestamp(task['updated_at']))
+                self._mark_finished(task_id, now_mono - age)
+    
+    def _mark_finished(self, task_id: str, finished_at: Optional[float] = None):
+        """登记任务结束时间"""
+        finished_at = time.monotonic() if finished_at is None else finished_at
+        with self._expiry_lock:
+            self._finished_at[task_id] = finished_at
+            heapq.heappush(self._expiry_heap, (finished_at, task_id))
+    
+    def _unmark_finished(self, task_id: str):
+        """任务重新开始或被删除时取消登记（堆中的旧元素在弹出时丢弃）"""
+        with self._expiry_lock:
+            self._finished_at.pop(task_id, None)
+    
+    def _pop_expired(self, cutoff: Optional[float] = None, limit: Optional[int] = None) -> List[str]:
+        """
+        从过期堆弹出最早结束的任务
+        
+        Args:
+            cutoff: 只弹出在该单调时钟之前结束的任务
+            limit: 最多弹出的任务数
+        
+        Returns:
+            任务ID列表
+        """
+        expired = []
+        with self._expiry_lock:
+            while self._expiry_heap and (limit is None or len(expired) < limit):
+                finished_at, task_id = self._expiry_heap[0]
+                if cutoff is not None and finished_at > cutoff:
+                    break
+                heapq.heappop(self._expiry_heap)
+                if self._finished_at.get(task_id) == finished_at:
+                    del self._finished_at[task_id]
+                    expired.append(task_id)
+        return expired
     
     def _start_cleanup_thread(self):
         """启动自动清理线程"""
         def cleanup_worker():
-            import time
             while True:
                 try:
                     # 每小时执行一次清理
@@ -58,24 +127,17 @@ class ProgressService:
                     if cleared > 0:
                         logger.info(f"自动清理了 {cleared} 个过期任务")
                     
-                    # 检查任务数是否超限
-                    with self._tasks_lock:
-                        if len(self._tasks) > self._max_tasks:
-                            # 超限时，删除最旧的已完成任务
-                            completed_tasks = [
-                                (task_id, task['updated_at'])
-                                for task_id, task in self._tasks.items()
-                                if task['status'] in ['completed', 'failed']
-                            ]
-                            completed_tasks.sort(key=lambda x: x[1])
-                            
-                            # 删除最旧的任务直到低于限制
-                            to_remove = len(self._tasks) - int(self._max_tasks * 0.8)
-                            for task_id, _ in completed_tasks[:to_remove]:
-                                del self._tasks[task_id]
-                            
-                            if to_remove > 0:
-                                logger.warning(f"任务数超限，清理了 {to_remove} 个最旧的已完成任务")
+                    # 检查任务数是否超限，超限时删除最早结束的任务直到低于限制
+                    total = self._storage.count()
+                    if total > self._max_tasks:
+                        to_remove = total - int(self._max_tasks * 0.8)
+                        removed = 0
+                        for task_id in self._pop_expired(limit=to_remove):
+                            if self._storage.delete(task_id):
+                                removed += 1
+                        
+                        if removed > 0:
+                            logger.warning(f"任务数超限，清理了 {removed} 个最旧的已完成任务")
                 
                 except Exception as e:
                     logger.error(f"自动清理任务异常: {e}", exc_info=True)
@@ -88,7 +150,8 @@ class ProgressService:
         self,
         task_id: str,
         total_pages: int,
-        topic: str = ''
+        topic: str = '',
+        client_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         创建新任务
@@ -97,31 +160,108 @@ class ProgressService:
             task_id: 任务ID
             total_pages: 总页数
             topic: 主题
-            
+            client_id: 发起任务的客户端标识（用于按客户端订阅所有任务的进度）
+        
         Returns:
             任务信息
         """
-        with self._tasks_lock:
-            task_data = {
-                'task_id': task_id,
-                'status': TaskStatus.PENDING.value,
-                'topic': topic,
-                'total_pages': total_pages,
-                'completed_pages': 0,
-                'current_page': 0,
-                'progress': 0,
-                'images': [],
-                'failed_pages': [],  # 新增：失败的页面列表
-                'message': '任务已创建，等待开始...',
-                'error': None,
-                'created_at': datetime.now().isoformat(),
-                'updated_at': datetime.now().isoformat()
+        record = TaskRecord(
+            task_id,
+            TaskStatus.PENDING.value,
+            total_pages,
+            topic=topic,
+            client_id=client_id,
+            message='任务已创建，等待开始...'
+        )
+        
+        self._unmark_finished(task_id)
+        self._storage.create(task_id, record, [('status', {
+            'status': record.status,
+            'total_pages': total_pages,
+            'completed_pages': 0,
+            'progress': 0,
+            'images': [],
+            'failed_pages': [],
+            'message': record.message
+        })])
+        logger.info(f"任务已创建: {task_id}, 总页数: {total_pages}")
+        
+        return record.to_dict()
+    
+    def restore_task(
+        self,
+        task_id: str,
+        total_pages: int,
+        images: Dict[int, str],
+        failures: Dict[int, str],
+        pending_pages: int,
+        topic: str = '',
+        client_id: Optional[str] = None
+    ) -> bool:
+        """
+        服务重启后按任务日志恢复任务进度
+        
+        共享存储（sqlite）中仍保留的任务沿用原记录；内存存储中的任务按日志重建，
+        事件序号以当前毫秒时间为起点，保证大于重启前发出的任何序号，
+        带旧 Last-Event-ID 重连的客户端会收到快照而不是错位的增量事件。
+        
+        Args:
+            task_id: 任务ID
+            total_pages: 总页数
+            images: 已完成的页面 {页码: 图片URL}
+            failures: 已失败的页面 {页码: 错误信息}
+            pending_pages: 需要重新生成的页数
+            topic: 主题
+            client_id: 客户端标识
+        
+        Returns:
+            是否成功
+        """
+        if not self._storage.exists(task_id):
+            now = time.time()
+            record = TaskRecord(
+                task_id,
+                TaskStatus.RUNNING.value,
+                total_pages,
+                topic=topic,
+                client_id=client_id
+            )
+            record.images = {
+                page_number: {'url': url, 'created_at': now} for page_number, url in images.items()
             }
-            
-            self._tasks[task_id] = task_data
-            logger.info(f"任务已创建: {task_id}, 总页数: {total_pages}")
-            
-            return task_data
+            record.failed_pages = [
+                {'page_number': page_number, 'error': error, 'failed_at': now}
+                for page_number, error in failures.items()
+            ]
+            record.completed_pages = len(record.images)
+            record.progress = int((record.completed_pages / total_pages) * 100) if total_pages > 0 else 0
+            self._storage.restore(task_id, record, int(now * 1000))
+        
+        self._unmark_finished(task_id)
+        
+        def mutation(task):
+            task.status = TaskStatus.RUNNING.value
+            task.message = f'服务重启后恢复任务，继续生成剩余 {pending_pages} 页...'
+            task.updated_at = time.time()
+            return [('status', {
+                'status': task.status,
+                'completed_pages': task.completed_pages,
+                'progress': task.progress,
+                'message': task.message
+            })]
+        
+        if not self._mutate(task_id, mutation):
+            return False
+        
+        logger.info(f"任务已恢复: {task_id}, 已完成 {len(images)} 页, 待生成 {pending_pages} 页")
+        return True
+    
+    def _mutate(self, task_id: str, mutation) -> bool:
+        """原子地修改任务并发布事件，任务不存在时记录错误"""
+        if not self._storage.mutate(task_id, mutation):
+            logger.error(f"任务不存在: {task_id}")
+            return False
+        return True
     
     def start_task(self, task_id: str) -> bool:
         """
@@ -129,21 +269,24 @@ class ProgressService:
         
         Args:
             task_id: 任务ID
-            
+        
         Returns:
             是否成功
         """
-        with self._tasks_lock:
-            if task_id not in self._tasks:
-                logger.error(f"任务不存在: {task_id}")
-                return False
-            
-            self._tasks[task_id]['status'] = TaskStatus.RUNNING.value
-            self._tasks[task_id]['message'] = '开始生成图片...'
-            self._tasks[task_id]['updated_at'] = datetime.now().isoformat()
-            
-            logger.info(f"任务已启动: {task_id}")
-            return True
+        def mutation(task):
+            task.status = TaskStatus.RUNNING.value
+            task.message = '开始生成图片...'
+            task.updated_at = time.time()
+            return [('status', {
+                'status': TaskStatus.RUNNING.value,
+                'message': task.message
+            })]
+        
+        if not self._mutate(task_id, mutation):
+            return False
+        
+        logger.info(f"任务已启动: {task_id}")
+        return True
     
     def update_progress(
         self,
@@ -160,48 +303,50 @@ class ProgressService:
             current_page: 当前页码
             image_url: 生成的图片URL
             message: 进度消息
-            
+        
         Returns:
             是否成功
         """
-        with self._tasks_lock:
-            if task_id not in self._tasks:
-                logger.error(f"任务不存在: {task_id}")
-                return False
-            
-            task = self._tasks[task_id]
-            task['current_page'] = current_page
-            task['updated_at'] = datetime.now().isoformat()
+        def mutation(task):
+            now = time.time()
+            task.current_page = current_page
+            task.updated_at = now
             
             if image_url:
-                # 检查是否已经存在该页面的图片（避免重复添加）
-                existing_pages = {img['page_number'] for img in task['images']}
-                if current_page not in existing_pages:
-                    task['images'].append({
-                        'page_number': current_page,
-                        'url': image_url,
-                        'created_at': datetime.now().isoformat()
-                    })
+                # 按页码索引，同一页重复生成时只更新图片 URL
+                image = task.images.get(current_page)
+                if image is None:
+                    task.images[current_page] = {'url': image_url, 'created_at': now}
                     # 只有新增图片时才增加完成数
-                    task['completed_pages'] = len(task['images'])
+                    task.completed_pages = len(task.images)
                 else:
-                    # 更新已存在的图片 URL
-                    for img in task['images']:
-                        if img['page_number'] == current_page:
-                            img['url'] = image_url
-                            img['created_at'] = datetime.now().isoformat()
-                            break
+                    image['url'] = image_url
+                    image['created_at'] = now
             
             # 基于实际完成的图片数量计算进度
-            task['progress'] = int((task['completed_pages'] / task['total_pages']) * 100) if task['total_pages'] > 0 else 0
+            task.progress = int((task.completed_pages / task.total_pages) * 100) if task.total_pages > 0 else 0
             
             if message:
-                task['message'] = message
+                task.message = message
             else:
-                task['message'] = f'正在生成第 {task["completed_pages"]}/{task["total_pages"]} 页...'
+                task.message = f'正在生成第 {task.completed_pages}/{task.total_pages} 页...'
             
-            logger.info(f"任务进度更新: {task_id}, 完成: {task['completed_pages']}/{task['total_pages']}, 进度: {task['progress']}%")
-            return True
+            payload = {
+                'current_page': current_page,
+                'completed_pages': task.completed_pages,
+                'progress': task.progress,
+                'message': task.message
+            }
+            if image_url:
+                payload['page'] = task.image_to_dict(current_page)
+                return [('page_completed', payload)]
+            return [('progress', payload)]
+        
+        if not self._mutate(task_id, mutation):
+            return False
+        
+        logger.info(f"任务进度更新: {task_id}, 页码: {current_page}")
+        return True
     
     def record_failed_page(
         self,
@@ -216,28 +361,69 @@ class ProgressService:
             task_id: 任务ID
             page_number: 页码
             error: 错误信息
-            
+        
         Returns:
             是否成功
         """
-        with self._tasks_lock:
-            if task_id not in self._tasks:
-                logger.error(f"任务不存在: {task_id}")
-                return False
-            
-            task = self._tasks[task_id]
-            
+        def mutation(task):
             # 添加失败记录
+            now = time.time()
             failed_info = {
                 'page_number': page_number,
                 'error': error,
-                'failed_at': datetime.now().isoformat()
+                'failed_at': now
             }
-            task['failed_pages'].append(failed_info)
-            task['updated_at'] = datetime.now().isoformat()
-            
-            logger.warning(f"记录失败页面: {task_id}, 页码: {page_number}, 错误: {error}")
-            return True
+            task.failed_pages.append(failed_info)
+            task.updated_at = now
+            return [('page_failed', {'failure': TaskRecord.failure_to_dict(failed_info)})]
+        
+        if not self._mutate(task_id, mutation):
+            return False
+        
+        logger.warning(f"记录失败页面: {task_id}, 页码: {page_number}, 错误: {error}")
+        return True
+    
+    def retry_pages(
+        self,
+        task_id: str,
+        page_numbers: List[int]
+    ) -> bool:
+        """
+        重新打开已结束的任务，准备重试指定页面
+        
+        Args:
+            task_id: 任务ID
+            page_numbers: 要重试的页码列表（会从失败列表中移除）
+        
+        Returns:
+            是否成功
+        """
+        retry_set = set(page_numbers)
+        
+        def mutation(task):
+            task.failed_pages = [
+                failed for failed in task.failed_pages
+                if failed['page_number'] not in retry_set
+            ]
+            task.status = TaskStatus.RUNNING.value
+            task.error = None
+            task.progress = int((task.completed_pages / task.total_pages) * 100) if task.total_pages > 0 else 0
+            task.message = f'正在重试 {len(retry_set)} 个失败页面...'
+            task.updated_at = time.time()
+            return [('status', {
+                'status': task.status,
+                'progress': task.progress,
+                'failed_pages': [TaskRecord.failure_to_dict(failed) for failed in task.failed_pages],
+                'message': task.message
+            })]
+        
+        if not self._mutate(task_id, mutation):
+            return False
+        
+        self._unmark_finished(task_id)
+        
+        logger.info(f"任务重试: {task_id}, 页码: {sorted(retry_set)}")
+        return True
     
     def complete_task(
         self,
@@ -245,28 +431,42 @@ class ProgressService:
         message: str = '所有图片生成完成！'
     ) -> bool:
         """
-        完成任务
+        完成任务（已被取消的任务保持取消状态，取消可能由其他工作进程发起）
         
         Args:
             task_id: 任务ID
             message: 完成消息
-            
+        
         Returns:
-            是否成功
+            是否成功（任务不存在或已取消时返回 False）
         """
-        with self._tasks_lock:
-            if task_id not in self._tasks:
-                logger.error(f"任务不存在: {task_id}")
-                return False
-            
-            task = self._tasks[task_id]
-            task['status'] = TaskStatus.COMPLETED.value
-            task['progress'] = 100
-            task['message'] = message
-            task['updated_at'] = datetime.now().isoformat()
-            
-            logger.info(f"任务已完成: {task_id}")
-            return True
+        cancelled = []
+        
+        def mutation(task):
+            if task.status == TaskStatus.CANCELLED.value:
+                cancelled.append(True)
+                return []
+            task.status = TaskStatus.COMPLETED.value
+            task.progress = 100
+            task.message = message
+            task.updated_at = time.time()
+            return [('status', {
+                'status': task.status,
+                'progress': 100,
+                'message': message
+            })]
+        
+        if not self._mutate(task_id, mutation):
+            return False
+        
+        if cancelled:
+            logger.info(f"任务已取消，保持取消状态: {task_id}")
+            return False
+        
+        self._mark_finished(task_id)
+        
+        logger.info(f"任务已完成: {task_id}")
+        return True
     
     def fail_task(
         self,
@@ -279,23 +479,136 @@ class ProgressService:
         Args:
             task_id: 任务ID
             error: 错误信息
-            
+        
         Returns:
             是否成功
         """
-        with self._tasks_lock:
-            if task_id not in self._tasks:
-                logger.error(f"任务不存在: {task_id}")
-                return False
-            
-            task = self._tasks[task_id]
-            task['status'] = TaskStatus.FAILED.value
-            task['error'] = error
-            task['message'] = f'生成失败: {error}'
-            task['updated_at'] = datetime.now().isoformat()
-            
-            logger.error(f"任务失败: {task_id}, 错误: {error}")
-            return True
+        def mutation(task):
+            task.status = TaskStatus.FAILED.value
+            task.error = error
+            task.message = f'生成失败: {error}'
+            task.updated_at = time.time()
+            return [('status', {
+                'status': task.status,
+                'message': task.message
+            })]
+        
+        if not self._mutate(task_id, mutation):
+            return False
+        
+        self._mark_finished(task_id)
+        
+        logger.error(f"任务失败: {task_id}, 错误: {error}")
+        return True
+    
+    def cancel_task(
+        self,
+        task_id: str,
+        message: str = '任务已取消',
+        calls_avoided: int = 0
+    ) -> bool:
+        """
+        标记任务已取消
+        
+        Args:
+            task_id: 任务ID
+            message: 取消消息
+            calls_avoided: 因取消而未发起的生成调用数
+        
+        Returns:
+            是否成功
+        """
+        def mutation(task):
+            task.status = TaskStatus.CANCELLED.value
+            task.calls_avoided = calls_avoided
+            task.message = message
+            task.updated_at = time.time()
+            return [('status', {
+                'status': task.status,
+                'calls_avoided': calls_avoided,
+                'message': message
+            })]
+        
+        if not self._mutate(task_id, mutation):
+            return False
+        
+        self._mark_finished(task_id)
+        
+        logger.info(f"任务已取消: {task_id}, 避免调用 {calls_avoided} 次")
+        return True
+    
+    def get_snapshot(self, task_id: str) -> Optional[Tuple[Dict[str, Any], int]]:
+        """
+        原子地获取任务完整进度和当前事件序号
+        
+        订阅者从返回的序号之后开始接收增量事件，既不会遗漏也不会重复。
+        
+        Args:
+            task_id: 任务ID
+        
+        Returns:
+            (任务信息副本, 事件序号)，任务不存在时返回None
+        """
+        return self._storage.snapshot(task_id)
+    
+    def wait_for_events(
+        self,
+        task_id: str,
+        after_seq: int,
+        timeout: float
+    ) -> Optional[Tuple[List[ProgressEvent], bool]]:
+        """
+        阻塞等待任务在指定序号之后的新事件
+        
+        Args:
+            task_id: 任务ID
+            after_seq: 订阅者已收到的最后一个事件序号
+            timeout: 最长等待秒数，超时返回空列表（用于发送保活注释）
+        
+        Returns:
+            (新事件列表, 是否有事件已被挤出缓冲区)；任务已删除时返回None。
+            有事件被挤出时订阅者应重新获取完整快照。
+        """
+        return self._storage.wait_for_events(task_id, after_seq, timeout)
+    
+    def get_snapshots(self, task_ids: List[str]) -> Dict[str, Tuple[Dict[str, Any], int]]:
+        """
+        批量获取多个任务的完整进度和事件序号
+        
+        Args:
+            task_ids: 任务ID列表
+        
+        Returns:
+            {任务ID: (任务信息副本, 事件序号)}，不存在的任务不包含在结果中
+        """
+        snapshots = {}
+        for task_id in task_ids:
+            snapshot = self._storage.snapshot(task_id)
+            if snapshot is not None:
+                snapshots[task_id] = snapshot
+        return snapshots
+    
+    def wait_for_many(
+        self,
+        cursors: Dict[str, int],
+        timeout: float,
+        client_id: Optional[str] = None,
+        ignored: Optional[Set[str]] = None
+    ) -> Dict[str, Optional[Tuple[List[ProgressEvent], bool]]]:
+        """
+        阻塞等待多个任务中任意一个的新事件（多路复用订阅，一个连接只占一个线程）
+        
+        Args:
+            cursors: {任务ID: 订阅者已收到的最后一个事件序号}
+            timeout: 最长等待秒数，超时返回空字典（用于发送保活注释）
+            client_id: 同时订阅该客户端的所有任务（包括之后新建的任务）
+            ignored: 不再报告的该客户端任务（超出订阅上限而放弃的任务）
+        
+        Returns:
+            只包含有变化的任务：{任务ID: (新事件列表, 是否需要重新获取快照)}；
+            任务已删除时值为None。不在 cursors 中的新任务以需要快照的形式返回。
+        """
+        return self._storage.wait_for_many(cursors, timeout, client_id, ignored)
     
     def get_progress(self, task_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -303,16 +616,12 @@ class ProgressService:
         
         Args:
             task_id: 任务ID
-            
+        
         Returns:
             任务信息，如果不存在则返回None
         """
-        with self._tasks_lock:
-            if task_id not in self._tasks:
-                return None
-            
-            # 返回任务数据的副本
-            return dict(self._tasks[task_id])
+        # 返回任务数据的副本
+        return self._storage.get(task_id)
     
     def get_all_tasks(self) -> Dict[str, Dict[str, Any]]:
         """
@@ -321,10 +630,8 @@ class ProgressService:
         Returns:
             所有任务的字典
         """
-        with self._tasks_lock:
-            # 返回所有任务的副本
-            return {task_id: dict(task_data) 
-                    for task_id, task_data in self._tasks.items()}
+        # 返回所有任务的副本
+        return self._storage.get_all()
     
     def delete_task(self, task_id: str) -> bool:
         """
@@ -332,16 +639,15 @@ class ProgressService:
         
         Args:
             task_id: 任务ID
-            
+        
         Returns:
             是否成功
         """
-        with self._tasks_lock:
-            if task_id in self._tasks:
-                del self._tasks[task_id]
-                logger.info(f"任务已删除: {task_id}")
-                return True
-            return False
+        self._unmark_finished(task_id)
+        if self._storage.delete(task_id):
+            logger.info(f"任务已删除: {task_id}")
+            return True
+        return False
     
     def task_exists(self, task_id: str) -> bool:
         """
@@ -349,12 +655,11 @@ class ProgressService:
         
         Args:
             task_id: 任务ID
-            
+        
         Returns:
             是否存在
         """
-        with self._tasks_lock:
-            return task_id in self._tasks
+        return self._storage.exists(task_id)
     
     def is_task_running(self, task_id: str) -> bool:
         """
@@ -362,14 +667,23 @@ class ProgressService:
         
         Args:
             task_id: 任务ID
-            
+        
         Returns:
             是否正在运行
         """
-        with self._tasks_lock:
-            if task_id not in self._tasks:
-                return False
-            return self._tasks[task_id]['status'] == TaskStatus.RUNNING.value
+        return self._storage.get_status(task_id) == TaskStatus.RUNNING.value
+    
+    def is_task_cancelled(self, task_id: str) -> bool:
+        """
+        检查任务是否已取消（共享存储下可能由其他工作进程取消）
+        
+        Args:
+            task_id: 任务ID
+        
+        Returns:
+            是否已取消
+        """
+        return self._storage.get_status(task_id) == TaskStatus.CANCELLED.value
     
     def is_task_completed(self, task_id: str) -> bool:
         """
@@ -377,15 +691,11 @@ class ProgressService:
         
         Args:
             task_id: 任务ID
-            
+        
         Returns:
             是否已完成
         """
-        with self._tasks_lock:
-            if task_id not in self._tasks:
-                return False
-            status = self._tasks[task_id]['status']
-            return status in [TaskStatus.COMPLETED.value, TaskStatus.FAILED.value]
+        return self._storage.get_status(task_id) in FINISHED_STATUSES
     
     def clear_completed_tasks(self, max_age_hours: int = 24) -> int:
         """
@@ -393,33 +703,17 @@ class ProgressService:
         
         Args:
             max_age_hours: 最大保留时间（小时）
-            
+        
         Returns:
             清理的任务数量
         """
-        from datetime import timedelta
-        
+        cutoff = time.monotonic() - max_age_hours * 3600
         cleared_count = 0
-        current_time = datetime.now()
-        
-        with self._tasks_lock:
-            tasks_to_remove = []
-            
-            for task_id, task_data in self._tasks.items():
-                if not self.is_task_completed(task_id):
-                    continue
-                
-                updated_at = datetime.fromisoformat(task_data['updated_at'])
-                age = current_time - updated_at
-                
-                if age > timedelta(hours=max_age_hours):
-                    tasks_to_remove.append(task_id)
-            
-            for task_id in tasks_to_remove:
-                del self._tasks[task_id]
+        for task_id in self._pop_expired(cutoff=cutoff):
+            if self._storage.delete(task_id):
                 cleared_count += 1
-            
-            if cleared_count > 0:
-                logger.info(f"清理了 {cleared_count} 个过期任务")
         
-        return cleared_count
\ No newline at end of file
+        if cleared_count > 0:
+            logger.info(f"清理了 {cleared_count} 个过期任务")
+        
+        return cleared_count
@@ -0,0 +1,322 @@
+"""
+参考图片服务
+将参考图片转换为可直接放入请求体的 base64 Data URL：
+按服务商 API 格式缩放、去除元数据并重新压缩，编码结果在进程内缓存
+"""
+import base64
+import hashlib
+import io
+import logging
+import mimetypes
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# 路径索引最多记录的文件数（只存摘要，占用很小）
+MAX_PATH_INDEX_ENTRIES = 1024
+
+# Pillow 保存格式对应的 MIME 类型
+FORMAT_MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+    'PNG': 'image/png',
+}
+
+
+class ReferenceImageService:
+    """参考图片服务类 - 线程安全的单例模式
+
+    缓存分两层：
+    - 路径索引: (路径, mtime, 大小) -> 内容摘要，命中时无需读盘
+    - 编码缓存: (内容摘要, 预处理参数) -> Data URL，按字节预算 LRU 淘汰
+    文件被覆盖后 mtime/大小变化，旧索引自然失效；不同路径的相同内容共享同一份编码结果。
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        """单例模式实现"""
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        """初始化服务"""
+        if not hasattr(self, '_initialized'):
+            self._path_index: 'OrderedDict[Tuple[str, int, int], str]' = OrderedDict()
+            # LRU 缓存: {(sha256, profile): data_url}
+            self._cache: 'OrderedDict[Tuple[str, Tuple], str]' = OrderedDict()
+            self._cache_lock = threading.Lock()
+            self._cache_bytes = 0
+            self.max_cache_bytes = Config.REFERENCE_CACHE_MAX_BYTES
+            self._hits = 0
+            self._misses = 0
+            self._bytes_in = 0
+            self._bytes_out = 0
+            self._initialized = True
+
+            if Image is None:
+                logger.warning("Pillow 未安装，参考图片将不做缩放压缩，请运行: pip install Pillow")
+            logger.info(f"参考图片服务已初始化: 缓存上限={self.max_cache_bytes} 字节")
+
+    @staticmethod
+    def _resolve_path(reference_image: str) -> Path:
+        """将 /uploads/xxx、uploads/xxx 或相对路径解析为本地文件路径"""
+        if reference_image.startswith('/uploads/'):
+            return Path('uploads') / reference_image.replace('/uploads/', '', 1)
+        elif reference_image.startswith('uploads/'):
+            return Path(reference_image)
+        else:
+            return Path('uploads') / reference_image
+
+    @staticmethod
+    def get_profile(api_format: Optional[str]) -> Optional[Tuple[int, str, int]]:
+        """
+        获取指定 API 格式的预处理参数
+
+        Args:
+            api_format: 服务商 API 格式（openai_chat/openai_dalle/gemini），None 表示不预处理
+
+        Returns:
+            (最长边, 输出格式, 质量)，不预处理时返回None
+        """
+        if not api_format or Image is None:
+            return None
+
+        overrides = Config.REFERENCE_PROFILES.get(api_format, {})
+        image_format = overrides.get('format', Config.REFERENCE_FORMAT).upper()
+        if image_format not in FORMAT_MIME_TYPES:
+            image_format = 'JPEG'
+
+        return (
+            int(overrides.get('max_edge', Config.REFERENCE_MAX_EDGE)),
+            image_format,
+            int(overrides.get('quality', Config.REFERENCE_QUALITY))
+        )
+
+    def encode(self, reference_image: Optional[str], api_format: Optional[str] = None) -> Optional[str]:
+        """
+        处理参考图片：将本地文件或 Data URL 预处理后输出 base64 Data URL
+
+        Args:
+            reference_image: 参考图片路径、Data URL 或 HTTP URL
+            api_format: 服务商 API 格式，用于选择缩放/压缩参数
+
+        Returns:
+            处理后的图片（base64 Data URL 或 HTTP URL）
+        """
+        if not reference_image:
+            return None
+
+        # HTTP URL 由服务商自行拉取，直接返回
+        if reference_image.startswith('http://') or reference_image.startswith('https://'):
+            return reference_image
+
+        profile = self.get_profile(api_format)
+
+        try:
+            if reference_image.startswith('data:image'):
+                if profile is None:
+                    return reference_image
+                header, base64_data = reference_image.split(',', 1)
+                mime_type = header.split(':')[1].split(';')[0]
+                return self._encode_bytes(base64.b64decode(base64_data), mime_type, profile)
+
+            # 本地文件路径，需要转换为 base64
+            file_path = self._resolve_path(reference_image)
+
+            if not file_path.exists():
+                logger.warning(f"参考图片文件不存在: {file_path}")
+                return None
+
+            stat = file_path.stat()
+            path_key = (str(file_path.resolve()), stat.st_mtime_ns, stat.st_size)
+
+            cached = self._get_cached_by_path(path_key, profile)
+            if cached is not None:
+                logger.info(f"参考图片命中缓存: {file_path}")
+                return cached
+
+            # 读取文件内容
+            with open(file_path, 'rb') as f:
+                image_data = f.read()
+
+            # 获取 MIME 类型
+            mime_type, _ = mimetypes.guess_type(str(file_path))
+            if not mime_type:
+                mime_type = 'image/jpeg'  # 默认
+
+            data_url = self._encode_bytes(image_data, mime_type, profile, path_key)
+            logger.info(f"参考图片转换为 base64 成功: {file_path} -> {len(data_url)} 字符")
+            return data_url
+
+        except Exception as e:
+            logger.error(f"处理参考图片失败: {e}", exc_info=True)
+            return None
+
+    def _encode_bytes(
+        self,
+        image_data: bytes,
+        mime_type: str,
+        profile: Optional[Tuple[int, str, int]],
+        path_key: Optional[Tuple[str, int, int]] = None
+    ) -> str:
+        """按内容摘要查缓存，未命中时预处理并编码"""
+        digest = hashlib.sha256(image_data).hexdigest()
+        cache_key = (digest, profile or ())
+
+        with self._cache_lock:
+            if path_key is not None:
+                self._remember_path(path_key, digest)
+            data_url = self._cache.get(cache_key)
+            if data_url is not None:
+                self._cache.move_to_end(cache_key)
+                self._hits += 1
+                return data_url
+            self._misses += 1
+
+        if profile is not None:
+            image_data, mime_type = self._preprocess(image_data, mime_type, profile)
+
+        data_url = f"data:{mime_type};base64,{base64.b64encode(image_data).decode('utf-8')}"
+        self._put_cached(cache_key, data_url)
+        return data_url
+
+    def _preprocess(
+        self,
+        image_data: bytes,
+        mime_type: str,
+        profile: Tuple[int, str, int]
+    ) -> Tuple[bytes, str]:
+        """
+        缩放到最长边以内、去除 EXIF 等元数据并按目标质量重新压缩
+
+        重新编码后反而更大（小图、已高度压缩）时保留原图。
+
+        Args:
+            image_data: 原始图片字节
+            mime_type: 原始 MIME 类型
+            profile: (最长边, 输出格式, 质量)
+
+        Returns:
+            (处理后的字节, MIME 类型)
+        """
+        max_edge, image_format, quality = profile
+
+        try:
+            with Image.open(io.BytesIO(image_data)) as image:
+                original_size = image.size
+                # 按 EXIF 方向摆正，之后保存时不再携带任何元数据
+                image = ImageOps.exif_transpose(image)
+                image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+                resized = image.size != original_size
+
+                if image_format == 'JPEG':
+                    if image.mode in ('RGBA', 'LA', 'P'):
+                        rgba = image.convert('RGBA')
+                        background = Image.new('RGB', rgba.size, (255, 255, 255))
+                        background.paste(rgba, mask=rgba.getchannel('A'))
+                        image = background
+                    elif image.mode != 'RGB':
+                        image = image.convert('RGB')
+                elif image.mode not in ('RGB', 'RGBA'):
+                    image = image.convert('RGBA')
+
+                output = io.BytesIO()
+                image.save(output, format=image_format, quality=quality, optimize=True)
+                processed = output.getvalue()
+        except Exception as e:
+            logger.warning(f"参考图片预处理失败，使用原图: {e}")
+            return image_data, mime_type
+
+        if not resized and len(processed) >= len(image_data):
+            return image_data, mime_type
+
+        with self._cache_lock:
+            self._bytes_in += len(image_data)
+            self._bytes_out += len(processed)
+
+        logger.info(
+            f"参考图片预处理: {original_size[0]}x{original_size[1]} -> {image.size[0]}x{image.size[1]}, "
+            f"{len(image_data)} -> {len(processed)} 字节 ({image_format}, q={quality})"
+        )
+        return processed, FORMAT_MIME_TYPES[image_format]
+
+    def _remember_path(self, path_key: Tuple[str, int, int], digest: str):
+        """记录路径到内容摘要的映射（调用方需持有 _cache_lock）"""
+        self._path_index[path_key] = digest
+        self._path_index.move_to_end(path_key)
+        while len(self._path_index) > MAX_PATH_INDEX_ENTRIES:
+            self._path_index.popitem(last=False)
+
+    def _get_cached_by_path(
+        self,
+        path_key: Tuple[str, int, int],
+        profile: Optional[Tuple[int, str, int]]
+    ) -> Optional[str]:
+        """通过路径索引读取缓存，命中时无需读盘"""
+        with self._cache_lock:
+            digest = self._path_index.get(path_key)
+            if digest is None:
+                return None
+
+            cache_key = (digest, profile or ())
+            data_url = self._cache.get(cache_key)
+            if data_url is None:
+                return None
+
+            self._cache.move_to_end(cache_key)
+            self._hits += 1
+            return data_url
+
+    def _put_cached(self, key: Tuple[str, Tuple], data_url: str):
+        """写入缓存，超出字节预算时淘汰最久未使用的条目"""
+        size = len(data_url)
+        if size > self.max_cache_bytes:
+            # 单张图片超过整个预算，不缓存
+            return
+
+        with self._cache_lock:
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._cache_bytes -= len(old)
+
+            self._cache[key] = data_url
+            self._cache_bytes += size
+
+            while self._cache_bytes > self.max_cache_bytes and self._cache:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= len(evicted)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取缓存与压缩统计
+
+        Returns:
+            统计信息字典
+        """
+        with self._cache_lock:
+            total = self._hits + self._misses
+            return {
+                'entries': len(self._cache),
+                'bytes': self._cache_bytes,
+                'max_bytes': self.max_cache_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / total, 4) if total else 0.0,
+                'preprocessed_bytes_in': self._bytes_in,
+                'preprocessed_bytes_out': self._bytes_out
+            }
@@ -1,13 +1,33 @@
 """
 热榜服务
 统一管理所有热榜数据源，提供缓存和并发获取功能
+
+后台刷新器按各数据源的 interval 在缓存过期前主动刷新，用户请求始终从缓存返回：
+缓存过期（正在刷新或刷新失败）时仍返回旧数据并标记 stale，直到超过 TRENDING_STALE_TTL。
+
+同一数据源同时只有一个上游抓取（single-flight）：后台刷新、冷启动未命中和强制刷新
+都加入正在进行的抓取并共享结果，跨线程（各请求的 asyncio.run）也是如此。
+
+每次刷新成功后写入磁盘快照（TRENDING_SNAPSHOT_PATH），启动时按原抓取时间加载，重启后立即可用；
+多个工作进程共享快照，到期刷新前先采用其他进程已写入的更新数据；
+后台刷新需先取得快照库中该数据源的刷新租约，同一时间只有一个进程抓取上游，其他进程等待并采用其结果。
+刷新结果同时追加到热榜历史（TRENDING_HISTORY_PATH），用于查询排名轨迹和榜单变化。
 """
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Optional
+from concurrent.futures import Future
 import asyncio
 import logging
-from datetime import datetime, timedelta
+import os
+import random
+import time
+import uuid
+from datetime import datetime
 from threading import Lock
 
+from config import Config
+from sources.http_client import get_http_client
+from storage.trending_history import TrendingHistoryStore
+from storage.trending_snapshot import TrendingSnapshotStore
 from sources.source_manager import SourceManager
 from sources.baidu_hot_source import BaiduHotSource
 from sources.zhihu_hot_source import ZhihuHotSource
@@ -22,15 +42,41 @@ from sources.thepaper_hot_source import ThePaperHotSource
 
 logger = logging.getLogger(__name__)
 
+# 后台刷新租约时长（秒），需覆盖一次抓取（含重试）的最长耗时，持有进程异常退出时到期后由其他进程接手
+REFRESH_LEASE_SECONDS = 60
+# 未取得租约时检查其他进程刷新结果的间隔（秒）
+REFRESH_LEASE_POLL_SECONDS = 2
+
 
 class TrendingService:
     """热榜服务类"""
     
     def __init__(self):
         self.source_manager = SourceManager()
-        self._cache: Dict[str, Dict] = {}  # 缓存结构: {source_id: {data: [], timestamp: datetime}}
+        # 缓存结构: {source_id: {data: [], timestamp: 抓取时间戳, error: 最近一次刷新失败原因}}
+        self._cache: Dict[str, Dict] = {}
         self._cache_lock = Lock()
+        # 正在进行的上游抓取: {source_id: Future}，所有等待者共享
+        self._inflight: Dict[str, Future] = {}
+        # 抓取统计: {source_id: {fetches, coalesced, max_waiters}}
+        self._flight_stats: Dict[str, Dict[str, int]] = {}
+        # 当前抓取的等待者数（不含发起者）
+        self._inflight_waiters: Dict[str, int] = {}
+        self._refresher_started = False
+        # 刷新租约的持有者标识（本进程本次运行）
+        self._lease_owner = f'{os.getpid()}:{uuid.uuid4().hex[:12]}'
         self._init_sources()
+        
+        self._snapshot: Optional[TrendingSnapshotStore] = None
+        if Config.TRENDING_SNAPSHOT_ENABLED:
+            self._snapshot = TrendingSnapshotStore(Config.TRENDING_SNAPSHOT_PATH)
+            self._load_snapshot()
+        
+        self.history: Optional[TrendingHistoryStore] = None
+        if Config.TRENDING_HISTORY_ENABLED:
+            self.history = TrendingHistoryStore(
+                Config.TRENDING_HISTORY_PATH, Config.TRENDING_HISTORY_RETENTION_DAYS
+            )
     
     def _init_sources(self):
         """初始化所有热榜数据源"""
@@ -60,69 +106,285 @@ class TrendingService:
         """
         return self.source_manager.get_sources_info()
     
-    def _is_cache_valid(self, source_id: str) -> bool:
+    def _fresh_ttl(self, source_id: str) -> float:
         """
-        检查缓存是否有效
+        缓存保鲜时间：数据源的刷新间隔，不超过 TRENDING_CACHE_TTL
         
         Args:
             source_id: 数据源ID
             
         Returns:
-            bool: 缓存是否有效
+            float: 秒数
         """
-        with self._cache_lock:
-            if source_id not in self._cache:
-                return False
-            
-            cache_entry = self._cache[source_id]
-            timestamp = cache_entry.get('timestamp')
-            
-            if not timestamp:
-                return False
-            
-            # 获取数据源配置的刷新间隔
-            source = self.source_manager.get_source(source_id)
-            if not source:
-                return False
-            
-            cache_duration = timedelta(seconds=source.interval)
-            return datetime.now() - timestamp < cache_duration
+        source = self.source_manager.get_source(source_id)
+        interval = source.interval if source else Config.TRENDING_CACHE_TTL
+        return min(interval, Config.TRENDING_CACHE_TTL)
     
-    def _get_from_cache(self, source_id: str) -> Optional[List[Dict]]:
+    def _get_cache_entry(self, source_id: str) -> Optional[Dict]:
         """
-        从缓存获取数据
+        获取可用的缓存条目（未超过过期数据保留期）
         
         Args:
             source_id: 数据源ID
             
         Returns:
-            Optional[List[Dict]]: 缓存的数据，如果不存在或已过期则返回None
+            Optional[Dict]: 缓存条目副本（附带 age 和 stale），不存在或超过保留期则返回None
         """
-        if not self._is_cache_valid(source_id):
+        with self._cache_lock:
+            cache_entry = self._cache.get(source_id)
+            if not cache_entry:
+                return None
+            cache_entry = dict(cache_entry)
+        
+        age = time.time() - cache_entry['timestamp']
+        fresh_ttl = self._fresh_ttl(source_id)
+        if age >= max(fresh_ttl, Config.TRENDING_STALE_TTL):
             return None
         
-        with self._cache_lock:
-            cache_entry = self._cache.get(source_id, {})
-            return cache_entry.get('data')
+        cache_entry['age'] = age
+        cache_entry['stale'] = age >= fresh_ttl
+        return cache_entry
     
-    def _set_cache(self, source_id: str, data: List[Dict]):
+    def _set_cache(self, source_id: str, data: List[Dict], timestamp: Optional[float] = None):
         """
         设置缓存
         
         Args:
             source_id: 数据源ID
             data: 要缓存的数据
+            timestamp: 抓取时间戳，默认为当前时间
         """
         with self._cache_lock:
             self._cache[source_id] = {
                 'data': data,
-                'timestamp': datetime.now()
+                'timestamp': timestamp or time.time(),
+                'error': None
             }
     
+    def _load_snapshot(self):
+        """启动时从磁盘快照预热缓存（保留原抓取时间，超过过期数据保留期的不加载）"""
+        try:
+            snapshots = self._snapshot.load_all(since=time.time() - Config.TRENDING_STALE_TTL)
+        except Exception as e:
+            logger.warning(f"加载热榜快照失败: {e}")
+            return
+        
+        for source_id, (data, fetched_at) in snapshots.items():
+            if self.source_manager.get_source(source_id):
+                self._set_cache(source_id, data, fetched_at)
+        if snapshots:
+            logger.info(f"已从快照加载 {len(snapshots)} 个热榜数据源")
+    
+    def _persist(self, source_id: str, data: List[Dict], timestamp: float):
+        """
+        写入磁盘快照和热榜历史（失败只记录日志，不影响刷新结果）
+        
+        Args:
+            source_id: 数据源ID
+            data: 最新数据
+            timestamp: 抓取时间戳
+        """
+        if self._snapshot:
+            try:
+                self._snapshot.save(source_id, data, timestamp)
+            except Exception as e:
+                logger.warning(f"保存 {source_id} 热榜快照失败: {e}")
+        if self.history:
+            try:
+                self.history.append(source_id, data, timestamp)
+            except Exception as e:
+                logger.warning(f"写入 {source_id} 热榜历史失败: {e}")
+    
+    def _adopt_snapshot(self, source_id: str) -> bool:
+        """
+        采用其他进程写入的更新快照
+        
+        Args:
+            source_id: 数据源ID
+            
+        Returns:
+            bool: 是否采用了更新的数据
+        """
+        with self._cache_lock:
+            cache_entry = self._cache.get(source_id)
+            timestamp = cache_entry['timestamp'] if cache_entry else 0
+        
+        try:
+            snapshot = self._snapshot.load(source_id, newer_than=timestamp)
+        except Exception as e:
+            logger.warning(f"读取 {source_id} 热榜快照失败: {e}")
+            return False
+        if snapshot is None:
+            return False
+        
+        data, fetched_at = snapshot
+        self._set_cache(source_id, data, fetched_at)
+        return True
+    
+    def _acquire_refresh_lease(self, source_id: str) -> bool:
+        """
+        获取数据源的后台刷新租约（未启用快照时每个进程各自刷新）
+        
+        Args:
+            source_id: 数据源ID
+            
+        Returns:
+            bool: 本进程是否可以刷新
+        """
+        if not self._snapshot:
+            return True
+        try:
+            return self._snapshot.acquire_lease(source_id, self._lease_owner, REFRESH_LEASE_SECONDS)
+        except Exception as e:
+            # 快照库不可用时退回各进程各自刷新
+            logger.warning(f"获取 {source_id} 刷新租约失败: {e}")
+            return True
+    
+    def _release_refresh_lease(self, source_id: str):
+        """释放数据源的后台刷新租约"""
+        if not self._snapshot:
+            return
+        try:
+            self._snapshot.release_lease(source_id, self._lease_owner)
+        except Exception as e:
+            logger.warning(f"释放 {source_id} 刷新租约失败: {e}")
+    
+    def _set_cache_error(self, source_id: str, error: str):
+        """
+        记录刷新失败（保留原有数据，继续作为过期数据返回）
+        
+        Args:
+            source_id: 数据源ID
+            error: 失败原因
+        """
+        with self._cache_lock:
+            if source_id in self._cache:
+                self._cache[source_id]['error'] = error
+    
+    async def _refresh(self, source_id: str) -> List[Dict]:
+        """
+        从上游抓取数据并写入缓存（在共享事件循环中执行）
+        
+        Args:
+            source_id: 数据源ID
+            
+        Returns:
+            List[Dict]: 最新数据
+            
+        Raises:
+            Exception: 抓取失败或数据为空（缓存保持不变）
+        """
+        try:
+            items = await self.source_manager.fetch_source_data(source_id)
+            if not items:
+                # 多数数据源在抓取失败时返回空列表，不能用它覆盖已有数据
+                raise Exception("数据源返回空数据")
+        except Exception as e:
+            self._set_cache_error(source_id, str(e))
+            raise
+        
+        data = [item.to_dict() for item in items]
+        timestamp = time.time()
+        self._set_cache(source_id, data, timestamp)
+        if self._snapshot or self.history:
+            # SQLite 写入放到线程池，不阻塞共享事件循环中的其他抓取
+            await asyncio.to_thread(self._persist, source_id, data, timestamp)
+        return data
+    
+    def _single_flight(self, source_id: str) -> Future:
+        """
+        获取数据源正在进行的抓取，没有则在共享事件循环中发起一个
+        
+        Args:
+            source_id: 数据源ID
+            
+        Returns:
+            Future: 抓取结果（最新数据列表或异常），所有调用方共享
+        """
+        with self._cache_lock:
+            stats = self._flight_stats.setdefault(source_id, {'fetches': 0, 'coalesced': 0, 'max_waiters': 0})
+            future = self._inflight.get(source_id)
+            if future is not None:
+                waiters = self._inflight_waiters[source_id] = self._inflight_waiters[source_id] + 1
+                stats['coalesced'] += 1
+                stats['max_waiters'] = max(stats['max_waiters'], waiters)
+                return future
+            
+            future = asyncio.run_coroutine_threadsafe(self._refresh(source_id), get_http_client().loop)
+            self._inflight[source_id] = future
+            self._inflight_waiters[source_id] = 0
+            stats['fetches'] += 1
+        
+        future.add_done_callback(lambda done: self._finish_flight(source_id, done))
+        return future
+    
+    def _finish_flight(self, source_id: str, future: Future):
+        """抓取结束后移除登记，之后的调用方将发起新的抓取"""
+        with self._cache_lock:
+            if self._inflight.get(source_id) is future:
+                del self._inflight[source_id]
+                waiters = self._inflight_waiters.pop(source_id, 0)
+            else:
+                waiters = 0
+        if waiters:
+            logger.info(f"{source_id} 抓取完成，合并了 {waiters} 个并发请求")
+    
+    async def _fetch_now(self, source_id: str) -> List[Dict]:
+        """
+        等待抓取结果（可在任意事件循环中调用，抓取在共享事件循环中执行）
+        
+        Args:
+            source_id: 数据源ID
+            
+        Returns:
+            List[Dict]: 最新数据
+        """
+        # shield: 单个等待者被取消时不取消共享的抓取
+        return await asyncio.shield(asyncio.wrap_future(self._single_flight(source_id)))
+    
+    def _refresh_in_background(self, source_id: str):
+        """
+        触发后台刷新（不等待结果，已有抓取进行中时直接复用）
+        
+        Args:
+            source_id: 数据源ID
+        """
+        def log_failure(done: Future):
+            if not done.cancelled() and done.exception():
+                logger.warning(f"后台刷新 {source_id} 失败，继续返回过期数据: {done.exception()}")
+        
+        self._single_flight(source_id).add_done_callback(log_failure)
+    
+    def _build_response(self, source_id: str, cache_entry: Dict) -> Dict:
+        """
+        根据缓存条目构造响应
+        
+        Args:
+            source_id: 数据源ID
+            cache_entry: _get_cache_entry() 返回的缓存条目
+            
+        Returns:
+            Dict: 包含数据和元信息的字典
+        """
+        result = {
+            'success': True,
+            'source_id': source_id,
+            'data': cache_entry['data'],
+            'from_cache': True,
+            'stale': cache_entry['stale'],
+            'update_time': datetime.fromtimestamp(cache_entry['timestamp']).isoformat()
+        }
+        if cache_entry['stale'] and cache_entry.get('error'):
+            result['error'] = cache_entry['error']
+        return result
+    
     async def get_trending_data(self, source_id: str, force_refresh: bool = False) -> Dict:
         """
         获取指定数据源的热榜数据
         
+        有缓存时直接返回（过期数据标记 stale 并触发后台刷新），不等待上游；
+        只有没有可用缓存（冷启动）或强制刷新时才等待抓取结果。
+        
         Args:
             source_id: 数据源ID
             force_refresh: 是否强制刷新（忽略缓存）
@@ -130,36 +392,45 @@ class TrendingService:
         Returns:
             Dict: 包含数据和元信息的字典
         """
+        if not self.source_manager.get_source(source_id):
+            return {
+                'success': False,
+                'source_id': source_id,
+                'error': f"数据源不存在: {source_id}",
+                'data': []
+            }
+        
+        cache_entry = self._get_cache_entry(source_id)
+        
         # 检查缓存
-        if not force_refresh:
-            cached_data = self._get_from_cache(source_id)
-            if cached_data is not None:
+        if cache_entry and not force_refresh:
+            if cache_entry['stale']:
+                self._refresh_in_background(source_id)
+                logger.info(f"返回 {source_id} 过期缓存（{cache_entry['age']:.0f}s），后台刷新中")
+            else:
                 logger.info(f"从缓存返回 {source_id} 数据")
-                return {
-                    'success': True,
-                    'source_id': source_id,
-                    'data': cached_data,
-                    'from_cache': True,
-                    'update_time': self._cache[source_id]['timestamp'].isoformat()
-                }
+            return self._build_response(source_id, cache_entry)
         
         # 获取新数据
         try:
-            items = await self.source_manager.fetch_source_data(source_id)
-            data = [item.to_dict() for item in items]
-            
-            # 更新缓存
-            self._set_cache(source_id, data)
-            
+            data = await self._fetch_now(source_id)
             return {
                 'success': True,
                 'source_id': source_id,
                 'data': data,
                 'from_cache': False,
+                'stale': False,
                 'update_time': datetime.now().isoformat()
             }
         except Exception as e:
             logger.error(f"获取 {source_id} 数据失败: {e}")
+            # 强制刷新失败时退回已有数据
+            cache_entry = self._get_cache_entry(source_id)
+            if cache_entry:
+                response = self._build_response(source_id, cache_entry)
+                response['stale'] = True
+                response['error'] = str(e)
+                return response
             return {
                 'success': False,
                 'source_id': source_id,
@@ -196,6 +467,82 @@ class TrendingService:
         
         return trending_data
     
+    def start_refresher(self):
+        """启动后台刷新器（每个进程只启动一次）"""
+        with self._cache_lock:
+            if self._refresher_started:
+                return
+            self._refresher_started = True
+        
+        loop = get_http_client().loop
+        for source_id in self.source_manager.get_all_sources():
+            asyncio.run_coroutine_threadsafe(self._refresh_loop(source_id), loop)
+        logger.info(f"热榜后台刷新器已启动，提前刷新比例={Config.TRENDING_REFRESH_AHEAD}")
+    
+    async def _refresh_loop(self, source_id: str):
+        """
+        单个数据源的刷新循环：在缓存保鲜期结束前刷新，失败后按指数退避重试
+        
+        Args:
+            source_id: 数据源ID
+        """
+        failures = 0
+        while True:
+            fresh_ttl = self._fresh_ttl(source_id)
+            with self._cache_lock:
+                cache_entry = self._cache.get(source_id)
+                timestamp = cache_entry['timestamp'] if cache_entry else 0
+            
+            # 按数据时间计算下次刷新时间，强制刷新或请求触发的刷新也会推迟下一次
+            wait = timestamp + fresh_ttl * Config.TRENDING_REFRESH_AHEAD - time.time()
+            if wait > 0:
+                # 随机抖动，多个工作进程共享快照时错开检查
+                await asyncio.sleep(wait + random.uniform(0, fresh_ttl * 0.05))
+                continue
+            
+            if self._snapshot and await asyncio.to_thread(self._adopt_snapshot, source_id):
+                continue
+            
+            if not await asyncio.to_thread(self._acquire_refresh_lease, source_id):
+                # 其他进程正在刷新，稍后采用其结果
+                await asyncio.sleep(REFRESH_LEASE_POLL_SECONDS)
+                continue
+            
+            try:
+                await self._fetch_now(source_id)
+                failures = 0
+                await asyncio.to_thread(self._release_refresh_lease, source_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 失败时保留租约直到到期，其他进程不会同时向故障的上游重试
+                failures += 1
+                retry_in = min(fresh_ttl, Config.TRENDING_REFRESH_RETRY_BASE * (2 ** (failures - 1)))
+                logger.warning(f"后台刷新 {source_id} 失败（第 {failures} 次），{retry_in:.0f}s 后重试: {e}")
+                await asyncio.sleep(retry_in)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取各数据源的缓存和抓取统计
+        
+        Returns:
+            Dict[str, Any]: {source_id: 统计}，coalesced 为合并到已有抓取的请求数
+        """
+        now = time.time()
+        stats = {}
+        with self._cache_lock:
+            for source_id in self.source_manager.get_all_sources():
+                flight = self._flight_stats.get(source_id, {'fetches': 0, 'coalesced': 0, 'max_waiters': 0})
+                cache_entry = self._cache.get(source_id)
+                stats[source_id] = {
+                    'cache_age': round(now - cache_entry['timestamp'], 1) if cache_entry else None,
+                    'last_error': cache_entry['error'] if cache_entry else None,
+                    'in_flight': source_id in self._inflight,
+                    'waiters': self._inflight_waiters.get(source_id, 0),
+                    **flight
+                }
+        return stats
+    
     def clear_cache(self, source_id: Optional[str] = None):
         """
         清除缓存
@@ -215,11 +562,14 @@ class TrendingService:
 
 # 全局服务实例
 _trending_service_instance = None
+_trending_service_lock = Lock()
 
 
 def get_trending_service() -> TrendingService:
     """获取热榜服务单例"""
     global _trending_service_instance
     if _trending_service_instance is None:
-        _trending_service_instance = TrendingService()
-    return _trending_service_instance
\ No newline at end of file
+        with _trending_service_lock:
+            if _trending_service_instance is None:
+                _trending_service_instance = TrendingService()
+    return _trending_service_instance
@@ -7,11 +7,14 @@ from abc import ABC, abstractmethod
 from typing import List, Dict, Optional, Any, Callable
 from dataclasses import dataclass, asdict
 from functools import wraps
-import requests
+import asyncio
+import json
 import logging
-import time
 import random
 
+from config import Config
+from .http_client import HTTPRequestError, get_http_client
+
 logger = logging.getLogger(__name__)
 
 
@@ -26,32 +29,35 @@ USER_AGENTS = [
 ]
 
 
-def retry_on_failure(max_retries: int = 3, backoff_factor: float = 1.0):
+def retry_on_failure(max_retries: Optional[int] = None, backoff_factor: Optional[float] = None):
     """
     请求重试装饰器 - 参考 next-daily-hot 的重试机制
+    退避等待使用 asyncio.sleep，不阻塞事件循环中的其他请求
     
     Args:
-        max_retries: 最大重试次数
-        backoff_factor: 退避因子（指数退避）
+        max_retries: 最大重试次数，默认使用实例的 max_retries
+        backoff_factor: 退避因子（指数退避），默认使用实例的 backoff_factor
     """
     def decorator(func: Callable) -> Callable:
         @wraps(func)
-        async def wrapper(*args, **kwargs):
+        async def wrapper(self, *args, **kwargs):
+            retries = max(1, max_retries or self.max_retries)
+            factor = backoff_factor if backoff_factor is not None else self.backoff_factor
             last_exception = None
-            for attempt in range(max_retries):
+            for attempt in range(retries):
                 try:
-                    return await func(*args, **kwargs)
+                    return await func(self, *args, **kwargs)
                 except Exception as e:
                     last_exception = e
-                    if attempt < max_retries - 1:
-                        wait_time = backoff_factor * (2 ** attempt) + random.uniform(0, 1)
+                    if attempt < retries - 1:
+                        wait_time = factor * (2 ** attempt) + random.uniform(0, 1)
                         logger.warning(
-                            f"Attempt {attempt + 1}/{max_retries} failed: {e}. "
+                            f"Attempt {attempt + 1}/{retries} failed: {e}. "
                             f"Retrying in {wait_time:.2f}s..."
                         )
-                        time.sleep(wait_time)
+                        await asyncio.sleep(wait_time)
                     else:
-                        logger.error(f"All {max_retries} attempts failed: {e}")
+                        logger.error(f"All {retries} attempts failed: {e}")
             raise last_exception
         return wrapper
     return decorator
@@ -102,9 +108,10 @@ class BaseSource(ABC):
         self.source_name: str = ""  # 数据源名称
         self.icon: str = ""  # 图标URL
         self.interval: int = 600  # 刷新间隔（秒），默认10分钟
-        self.timeout: int = 10  # 请求超时时间
-        self.max_retries: int = 3  # 最大重试次数
-        self.proxy: Optional[str] = None  # 代理地址
+        self.timeout: int = Config.TRENDING_REQUEST_TIMEOUT  # 请求超时时间
+        self.max_retries: int = Config.TRENDING_MAX_RETRIES  # 最大重试次数
+        self.backoff_factor: float = Config.TRENDING_BACKOFF_FACTOR  # 重试退避因子
+        self.proxy: Optional[str] = Config.TRENDING_PROXY or None  # 代理地址（由共享 HTTP 客户端使用）
         
     @abstractmethod
     async def fetch_data(self) -> List[TrendingItem]:
@@ -141,43 +148,66 @@ class BaseSource(ABC):
             'Upgrade-Insecure-Requests': '1',
         }
     
-    @retry_on_failure(max_retries=3, backoff_factor=1.0)
-    async def fetch_html(self, url: str, timeout: Optional[int] = None) -> str:
+    async def _get(self, url: str, timeout: Optional[int] = None) -> str:
         """
-        获取网页HTML内容 - 带重试机制
+        通过共享异步 HTTP 客户端发送 GET 请求并解码响应
         
         Args:
             url: 目标URL
             timeout: 超时时间（秒），默认使用实例配置
             
         Returns:
-            str: HTML内容
+            str: 响应文本
             
         Raises:
             Exception: 请求失败时抛出异常
         """
         timeout = timeout or self.timeout
-        proxies = {'http': self.proxy, 'https': self.proxy} if self.proxy else None
         
         try:
-            response = requests.get(
-                url,
-                headers=self.get_headers(),
-                timeout=timeout,
-                proxies=proxies,
-                verify=True
+            _, body, charset = await get_http_client().get(
+                url, headers=self.get_headers(), timeout=timeout, proxy=self.proxy
             )
-            response.raise_for_status()
-            response.encoding = response.apparent_encoding
-            return response.text
-        except requests.Timeout:
+        except asyncio.TimeoutError:
             logger.error(f"Timeout fetching {url}")
             raise Exception(f"请求超时: {url}")
-        except requests.RequestException as e:
+        except HTTPRequestError as e:
             logger.error(f"Failed to fetch {url}: {e}")
             raise Exception(f"请求失败: {str(e)}")
+        
+        return self._decode(body, charset)
+    
+    @staticmethod
+    def _decode(body: bytes, charset: Optional[str]) -> str:
+        """按响应声明的字符集解码，未声明时依次尝试 UTF-8 和 GB18030"""
+        if charset:
+            try:
+                return body.decode(charset, errors='replace')
+            except LookupError:
+                pass
+        try:
+            return body.decode('utf-8')
+        except UnicodeDecodeError:
+            return body.decode('gb18030', errors='replace')
+    
+    @retry_on_failure()
+    async def fetch_html(self, url: str, timeout: Optional[int] = None) -> str:
+        """
+        获取网页HTML内容 - 带重试机制
+        
+        Args:
+            url: 目标URL
+            timeout: 超时时间（秒），默认使用实例配置
+            
+        Returns:
+            str: HTML内容
+            
+        Raises:
+            Exception: 请求失败时抛出异常
+        """
+        return await self._get(url, timeout)
     
-    @retry_on_failure(max_retries=3, backoff_factor=1.0)
+    @retry_on_failure()
     async def fetch_json(self, url: str, timeout: Optional[int] = None) -> Dict:
         """
         获取JSON数据 - 带重试机制
@@ -192,28 +222,13 @@ class BaseSource(ABC):
         Raises:
             Exception: 请求失败时抛出异常
         """
-        timeout = timeout or self.timeout
-        proxies = {'http': self.proxy, 'https': self.proxy} if self.proxy else None
+        text = await self._get(url, timeout)
         
         try:
-            response = requests.get(
-                url,
-                headers=self.get_headers(),
-                timeout=timeout,
-                proxies=proxies,
-                verify=True
-            )
-            response.raise_for_status()
-            return response.json()
-        except requests.Timeout:
-            logger.error(f"Timeout fetching JSON from {url}")
-            raise Exception(f"请求超时: {url}")
-        except requests.JSONDecodeError as e:
+            return json.loads(text)
+        except json.JSONDecodeError as e:
             logger.error(f"Invalid JSON response from {url}: {e}")
             raise Exception(f"JSON解析失败: {str(e)}")
-        except requests.RequestException as e:
-            logger.error(f"Failed to fetch JSON from {url}: {e}")
-            raise Exception(f"请求失败: {str(e)}")
     
     def get_source_info(self) -> Dict[str, Any]:
         """
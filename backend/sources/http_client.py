@@ -0,0 +1,182 @@
+"""
+热榜异步 HTTP 客户端
+所有数据源共用一个后台事件循环和 aiohttp.ClientSession（连接复用、按主机限制并发连接数），
+请求真正并发执行，抓取全部数据源的耗时取决于最慢的一个而不是所有数据源之和。
+
+调用方可以在任意事件循环中 await（如路由里的 asyncio.run），请求会转交给共享循环执行。
+"""
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from config import Config
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    import brotli  # noqa: F401  aiohttp 解压 br 编码需要
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPRequestError(Exception):
+    """HTTP 请求失败（连接错误、状态码错误等）"""
+
+
+class HTTPStatusError(HTTPRequestError):
+    """HTTP 状态码错误"""
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+class AsyncHTTPClient:
+    """热榜异步 HTTP 客户端 - 线程安全的单例模式"""
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        """单例模式实现"""
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        """初始化客户端（后台事件循环在首次请求时启动）"""
+        if not hasattr(self, '_initialized'):
+            if aiohttp is None:
+                raise ImportError("aiohttp 未安装，请运行: pip install aiohttp")
+            self.max_connections = Config.TRENDING_MAX_CONNECTIONS
+            self.max_connections_per_host = Config.TRENDING_MAX_CONNECTIONS_PER_HOST
+            self._loop: Optional[asyncio.AbstractEventLoop] = None
+            self._session: Optional['aiohttp.ClientSession'] = None
+            self._loop_lock = threading.Lock()
+            self._initialized = True
+            logger.info(
+                f"热榜 HTTP 客户端已初始化: 最大连接数={self.max_connections}, "
+                f"单主机连接数={self.max_connections_per_host}"
+            )
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """共享事件循环（首次访问时在后台线程中启动）"""
+        if self._loop is None:
+            with self._loop_lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(
+                        target=self._run_loop, args=(loop,), daemon=True, name='trending-http'
+                    ).start()
+                    self._loop = loop
+        return self._loop
+
+    @staticmethod
+    def _run_loop(loop: asyncio.AbstractEventLoop):
+        """后台线程主循环"""
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def run(self, coro, timeout: Optional[float] = None) -> Any:
+        """
+        在共享事件循环中执行协程并同步等待结果（供同步代码调用）
+
+        Args:
+            coro: 协程
+            timeout: 最长等待时间（秒）
+
+        Returns:
+            协程返回值
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def _get_session(self) -> 'aiohttp.ClientSession':
+        """获取共享会话（只在共享事件循环中调用）"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.max_connections_per_host,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    @staticmethod
+    def _prepare_headers(headers: Optional[Dict[str, str]]) -> Optional[Dict[str, str]]:
+        """未安装 brotli 时不声明 br 编码，避免服务端返回无法解压的响应"""
+        if not headers or BROTLI_AVAILABLE:
+            return headers
+        encoding = headers.get('Accept-Encoding')
+        if encoding and 'br' in encoding:
+            headers = dict(headers)
+            headers['Accept-Encoding'] = ', '.join(
+                part.strip() for part in encoding.split(',') if part.strip() != 'br'
+            )
+        return headers
+
+    async def _request(
+        self, url: str, headers: Optional[Dict[str, str]], timeout: float, proxy: Optional[str]
+    ) -> tuple:
+        """在共享事件循环中发送 GET 请求，返回 (状态码, 响应体字节, 字符集)"""
+        try:
+            async with self._get_session().get(
+                url,
+                headers=self._prepare_headers(headers),
+                proxy=proxy,
+                timeout=aiohttp.ClientTimeout(total=timeout)
+            ) as response:
+                body = await response.read()
+                if response.status >= 400:
+                    raise HTTPStatusError(f"HTTP {response.status}: {url}", response.status)
+                return response.status, body, response.charset
+        except aiohttp.ClientError as e:
+            raise HTTPRequestError(str(e) or e.__class__.__name__) from e
+
+    async def get(
+        self,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: float = 10,
+        proxy: Optional[str] = None
+    ) -> tuple:
+        """
+        发送 GET 请求（可在任意事件循环中 await）
+
+        Args:
+            url: 请求地址
+            headers: 请求头
+            timeout: 总超时时间（秒）
+            proxy: 代理地址（如 TRENDING_PROXY）
+
+        Returns:
+            (状态码, 响应体字节, 响应声明的字符集或None)
+
+        Raises:
+            HTTPStatusError: 状态码 >= 400
+            HTTPRequestError: 连接等错误
+            asyncio.TimeoutError: 请求超时
+        """
+        coro = self._request(url, headers, timeout, proxy)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop and running is not None:
+            return await coro
+        # 在其他事件循环中调用：转交共享循环执行，共用连接池
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+
+def get_http_client() -> AsyncHTTPClient:
+    """获取热榜异步 HTTP 客户端"""
+    return AsyncHTTPClient()
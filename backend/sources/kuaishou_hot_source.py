@@ -34,10 +34,7 @@ class KuaishouHotSource(BaseSource):
         url = "https://www.kuaishou.com/?isHome=1"
         
         try:
-            import requests
-            response = requests.get(url, headers=self.get_headers(), timeout=self.timeout)
-            response.raise_for_status()
-            html_content = response.text
+            html_content = await self.fetch_html(url)
             
             # 从页面中提取 __APOLLO_STATE__ 数据
             pattern = r'window\.__APOLLO_STATE__=(.*?);\(function\(\)'
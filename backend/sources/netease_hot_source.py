@@ -32,10 +32,7 @@ class NeteaseHotSource(BaseSource):
         url = "https://m.163.com/fe/api/hot/news/flow"
         
         try:
-            import requests
-            response = requests.get(url, headers=self.get_headers(), timeout=self.timeout)
-            response.raise_for_status()
-            data = response.json()
+            data = await self.fetch_json(url)
             
             # 检查返回状态
             if data.get('msg') != 'success':
@@ -32,10 +32,7 @@ class QQNewsHotSource(BaseSource):
         url = "https://r.inews.qq.com/gw/event/hot_ranking_list"
         
         try:
-            import requests
-            response = requests.get(url, headers=self.get_headers(), timeout=self.timeout)
-            response.raise_for_status()
-            data = response.json()
+            data = await self.fetch_json(url)
             
             # 检查返回状态
             if data.get('ret') != 0:
@@ -5,7 +5,6 @@
 from typing import List, Dict
 from .base_source import BaseSource, TrendingItem
 import logging
-import requests
 import random
 
 logger = logging.getLogger(__name__)
@@ -54,28 +53,8 @@ class ToutiaoHotSource(BaseSource):
         url = "https://www.toutiao.com/hot-event/hot-board/?origin=toutiao_pc"
         
         try:
-            # 使用自定义请求头直接请求
-            response = requests.get(
-                url,
-                headers=self.get_headers(),
-                timeout=self.timeout,
-                verify=True
-            )
-            
-            # 检查响应状态
-            if response.status_code != 200:
-                logger.warning(f"今日头条请求失败，状态码: {response.status_code}")
-                # 记录响应内容用于调试
-                logger.debug(f"响应内容: {response.text[:500] if response.text else 'empty'}")
-                return []
-            
-            # 尝试解析JSON
-            try:
-                data = response.json()
-            except Exception as e:
-                logger.error(f"今日头条JSON解析失败: {e}")
-                logger.debug(f"响应内容: {response.text[:500] if response.text else 'empty'}")
-                return []
+            # 使用自定义请求头请求（get_headers 已覆盖）
+            data = await self.fetch_json(url)
             
             # 检查状态
             if data.get('status') != 'success':
@@ -115,12 +94,6 @@ class ToutiaoHotSource(BaseSource):
             logger.info(f"成功获取今日头条热榜 {len(items)} 条")
             return items
             
-        except requests.Timeout:
-            logger.error(f"今日头条请求超时")
-            return []
-        except requests.RequestException as e:
-            logger.error(f"今日头条请求异常: {e}")
-            return []
         except Exception as e:
             logger.error(f"获取今日头条热榜失败: {e}")
             return []
\ No newline at end of file
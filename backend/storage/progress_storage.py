@@ -0,0 +1,820 @@
+"""
+任务进度存储
+保存图片生成任务的进度记录和增量事件，支持两种实现：
+- memory: 进程内字典（默认，单进程部署）
+- sqlite: WAL 模式的本地 SQLite 文件，多个工作进程共享同一份进度和事件
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 终止状态：发布这些状态的事件后订阅者可以结束推送
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+
+
+def format_timestamp(timestamp: float) -> str:
+    """将 time.time() 时间戳格式化为 ISO 字符串（只在序列化时调用）"""
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+
+def parse_timestamp(value: Optional[str]) -> float:
+    """解析 ISO 字符串为时间戳"""
+    return datetime.fromisoformat(value).timestamp() if value else time.time()
+
+
+class TaskRecord:
+    """任务进度记录
+
+    使用 __slots__ 减少每个任务的内存占用；图片按页码索引（page_number -> 图片信息），
+    时间戳保存为浮点数，只在转换为字典（快照、接口响应）时格式化。
+    """
+
+    __slots__ = (
+        'task_id', 'status', 'topic', 'client_id', 'total_pages', 'completed_pages',
+        'current_page', 'progress', 'images', 'failed_pages', 'message', 'error',
+        'calls_avoided', 'created_at', 'updated_at'
+    )
+
+    def __init__(
+        self,
+        task_id: str,
+        status: str,
+        total_pages: int,
+        topic: str = '',
+        client_id: Optional[str] = None,
+        message: str = ''
+    ):
+        now = time.time()
+        self.task_id = task_id
+        self.status = status
+        self.topic = topic
+        self.client_id = client_id
+        self.total_pages = total_pages
+        self.completed_pages = 0
+        self.current_page = 0
+        self.progress = 0
+        self.images: Dict[int, Dict[str, Any]] = {}
+        self.failed_pages: List[Dict[str, Any]] = []
+        self.message = message
+        self.error: Optional[str] = None
+        self.calls_avoided = 0
+        self.created_at = now
+        self.updated_at = now
+
+    def image_to_dict(self, page_number: int) -> Dict[str, Any]:
+        """序列化单页图片信息"""
+        image = self.images[page_number]
+        return {
+            'page_number': page_number,
+            'url': image['url'],
+            'created_at': format_timestamp(image['created_at'])
+        }
+
+    @staticmethod
+    def failure_to_dict(failed: Dict[str, Any]) -> Dict[str, Any]:
+        """序列化单条失败记录"""
+        return {
+            'page_number': failed['page_number'],
+            'error': failed['error'],
+            'failed_at': format_timestamp(failed['failed_at'])
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为接口使用的字典格式（新对象，调用方可自由修改）"""
+        return {
+            'task_id': self.task_id,
+            'status': self.status,
+            'topic': self.topic,
+            'client_id': self.client_id,
+            'total_pages': self.total_pages,
+            'completed_pages': self.completed_pages,
+            'current_page': self.current_page,
+            'progress': self.progress,
+            'images': [self.image_to_dict(page_number) for page_number in self.images],
+            'failed_pages': [self.failure_to_dict(failed) for failed in self.failed_pages],
+            'message': self.message,
+            'error': self.error,
+            'calls_avoided': self.calls_avoided,
+            'created_at': format_timestamp(self.created_at),
+            'updated_at': format_timestamp(self.updated_at)
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'TaskRecord':
+        """从字典格式还原（SQLite 存储读取时使用）"""
+        record = cls(
+            data['task_id'],
+            data['status'],
+            data['total_pages'],
+            topic=data.get('topic', ''),
+            client_id=data.get('client_id'),
+            message=data.get('message', '')
+        )
+        record.completed_pages = data.get('completed_pages', 0)
+        record.current_page = data.get('current_page', 0)
+        record.progress = data.get('progress', 0)
+        record.images = {
+            img['page_number']: {'url': img['url'], 'created_at': parse_timestamp(img.get('created_at'))}
+            for img in data.get('images', [])
+        }
+        record.failed_pages = [
+            {
+                'page_number': failed['page_number'],
+                'error': failed['error'],
+                'failed_at': parse_timestamp(failed.get('failed_at'))
+            }
+            for failed in data.get('failed_pages', [])
+        ]
+        record.error = data.get('error')
+        record.calls_avoided = data.get('calls_avoided', 0)
+        record.created_at = parse_timestamp(data.get('created_at'))
+        record.updated_at = parse_timestamp(data.get('updated_at'))
+        return record
+
+
+# 进度变更函数：就地修改任务记录，返回要发布的事件 [(事件类型, 变化字段)]
+Mutation = Callable[[TaskRecord], List[Tuple[str, Dict[str, Any]]]]
+
+
+class ProgressEvent:
+    """单条进度事件（发布时序列化一次，所有订阅者共享）"""
+
+    def __init__(self, seq: int, event_type: str, data: str, terminal: bool):
+        self.seq = seq
+        self.type = event_type
+        self.data = data
+        self.terminal = terminal
+
+
+def build_event(task_id: str, seq: int, event_type: str, payload: Dict[str, Any]) -> ProgressEvent:
+    """
+    补全事件公共字段并序列化
+
+    Args:
+        task_id: 任务ID
+        seq: 事件序号
+        event_type: 事件类型 (status/progress/page_completed/page_failed)
+        payload: 事件内容（只包含变化的字段）
+
+    Returns:
+        ProgressEvent 实例
+    """
+    payload['type'] = event_type
+    payload['task_id'] = task_id
+    payload['timestamp'] = datetime.now().isoformat()
+    terminal = event_type == 'status' and payload.get('status') in TERMINAL_STATUSES
+    return ProgressEvent(seq, event_type, json.dumps(payload, ensure_ascii=False), terminal)
+
+
+class ProgressStorage(ABC):
+    """任务进度存储基类
+
+    所有修改都通过 create/mutate 完成：变更函数在存储的临界区（或事务）内执行，
+    任务记录的修改和事件的追加是原子的，订阅者看到的快照和事件序号始终一致。
+    """
+
+    name = 'base'
+
+    def __init__(self, buffer_size: int):
+        """
+        初始化存储
+
+        Args:
+            buffer_size: 每个任务保留的最近事件数
+        """
+        self.buffer_size = max(1, buffer_size)
+
+    @abstractmethod
+    def create(self, task_id: str, record: TaskRecord, events: List[Tuple[str, Dict[str, Any]]]):
+        """创建（或覆盖）任务记录并发布事件，同一任务ID的事件序号延续"""
+        pass
+
+    @abstractmethod
+    def restore(self, task_id: str, record: TaskRecord, seq: int):
+        """恢复任务记录（服务重启后），事件序号从 seq 开始，缓冲中没有历史事件"""
+        pass
+
+    @abstractmethod
+    def mutate(self, task_id: str, mutation: Mutation) -> bool:
+        """
+        原子地修改任务记录并发布变更函数返回的事件
+
+        Returns:
+            任务是否存在
+        """
+        pass
+
+    @abstractmethod
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务记录副本，不存在时返回None"""
+        pass
+
+    @abstractmethod
+    def get_all(self) -> Dict[str, Dict[str, Any]]:
+        """获取所有任务记录副本"""
+        pass
+
+    @abstractmethod
+    def snapshot(self, task_id: str) -> Optional[Tuple[Dict[str, Any], int]]:
+        """原子地获取任务记录副本和当前事件序号"""
+        pass
+
+    @abstractmethod
+    def delete(self, task_id: str) -> bool:
+        """删除任务记录和事件，唤醒该任务的所有订阅者"""
+        pass
+
+    @abstractmethod
+    def wait_for_events(
+        self,
+        task_id: str,
+        after_seq: int,
+        timeout: float
+    ) -> Optional[Tuple[List[ProgressEvent], bool]]:
+        """
+        阻塞等待任务在指定序号之后的新事件
+
+        Returns:
+            (新事件列表, 是否有事件已被挤出缓冲区)；任务已删除时返回None
+        """
+        pass
+
+    @abstractmethod
+    def wait_for_many(
+        self,
+        cursors: Dict[str, int],
+        timeout: float,
+        client_id: Optional[str] = None,
+        ignored: Optional[Set[str]] = None
+    ) -> Dict[str, Optional[Tuple[List[ProgressEvent], bool]]]:
+        """
+        阻塞等待多个任务中任意一个出现新事件（一个线程订阅多个任务）
+
+        Args:
+            cursors: {任务ID: 订阅者已收到的最后一个事件序号}
+            timeout: 最长等待秒数
+            client_id: 同时订阅该客户端的所有任务，cursors 之外的新任务视为需要补发快照
+            ignored: 不再报告的该客户端任务（订阅者已达任务数上限而放弃的任务）
+
+        Returns:
+            只包含有变化的任务：{任务ID: (新事件列表, 是否需要重新获取快照)}，
+            任务已删除时值为None；超时返回空字典
+        """
+        pass
+
+    def exists(self, task_id: str) -> bool:
+        """检查任务是否存在"""
+        return self.get(task_id) is not None
+
+    def count(self) -> int:
+        """任务总数"""
+        return len(self.get_all())
+
+    def get_status(self, task_id: str) -> Optional[str]:
+        """获取任务状态，不存在时返回None"""
+        task = self.get(task_id)
+        return task['status'] if task is not None else None
+
+
+class TaskEventChannel:
+    """单个任务的记录和事件通道：任务锁 + 递增序号 + 最近事件环形缓冲 + 条件变量
+
+    每个任务使用独立的锁，修改一个任务不会阻塞其他任务的更新和订阅者。
+    事件序号同时作为 SSE 的 id，断线重连时按 Last-Event-ID 从缓冲中补发。
+    """
+
+    __slots__ = ('lock', 'cond', 'record', 'events', 'seq', 'closed')
+
+    def __init__(self, buffer_size: int):
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self.record: Optional[TaskRecord] = None
+        self.events: deque = deque(maxlen=buffer_size)
+        self.seq = 0
+        self.closed = False
+
+
+class MemoryProgressStorage(ProgressStorage):
+    """进程内进度存储（默认）
+
+    注册表锁只保护任务字典的增删查，任务记录的修改和事件发布在各自的任务锁内完成。
+    多任务订阅者通过单独的条件变量等待，只有存在这类订阅者时发布方才会获取该锁。
+    """
+
+    name = 'memory'
+
+    def __init__(self, buffer_size: int):
+        super().__init__(buffer_size)
+        self._channels: Dict[str, TaskEventChannel] = {}
+        self.lock = threading.Lock()
+        # 任意任务发生变化时唤醒多任务订阅者
+        self._changed = threading.Condition()
+        self._many_waiters = 0
+
+    def _channel(self, task_id: str) -> Optional[TaskEventChannel]:
+        with self.lock:
+            return self._channels.get(task_id)
+
+    def _publish(self, task_id: str, channel: TaskEventChannel, events: List[Tuple[str, Dict[str, Any]]]):
+        """追加事件并唤醒单任务订阅者（调用方需持有 channel.lock）"""
+        if not events:
+            return
+        for event_type, payload in events:
+            channel.seq += 1
+            channel.events.append(build_event(task_id, channel.seq, event_type, payload))
+        channel.cond.notify_all()
+
+    def _notify_many(self):
+        """唤醒多任务订阅者（不持有任务锁时调用）"""
+        if self._many_waiters:
+            with self._changed:
+                self._changed.notify_all()
+
+    def create(self, task_id: str, record: TaskRecord, events: List[Tuple[str, Dict[str, Any]]]):
+        with self.lock:
+            # 同一任务ID重新创建时沿用原通道，已连接的订阅者会收到新的状态事件
+            channel = self._channels.get(task_id)
+            if channel is None:
+                channel = self._channels[task_id] = TaskEventChannel(self.buffer_size)
+        with channel.lock:
+            channel.record = record
+            self._publish(task_id, channel, events)
+        self._notify_many()
+
+    def restore(self, task_id: str, record: TaskRecord, seq: int):
+        with self.lock:
+            channel = self._channels.get(task_id)
+            if channel is None:
+                channel = self._channels[task_id] = TaskEventChannel(self.buffer_size)
+        with channel.lock:
+            channel.record = record
+            channel.seq = max(channel.seq, seq)
+        self._notify_many()
+
+    def mutate(self, task_id: str, mutation: Mutation) -> bool:
+        channel = self._channel(task_id)
+        if channel is None:
+            return False
+        with channel.lock:
+            if channel.closed or channel.record is None:
+                return False
+            self._publish(task_id, channel, mutation(channel.record))
+        self._notify_many()
+        return True
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        snapshot = self.snapshot(task_id)
+        return snapshot[0] if snapshot is not None else None
+
+    def get_all(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            channels = list(self._channels.items())
+        tasks = {}
+        for task_id, channel in channels:
+            with channel.lock:
+                if not channel.closed and channel.record is not None:
+                    tasks[task_id] = channel.record.to_dict()
+        return tasks
+
+    def snapshot(self, task_id: str) -> Optional[Tuple[Dict[str, Any], int]]:
+        channel = self._channel(task_id)
+        if channel is None:
+            return None
+        with channel.lock:
+            if channel.closed or channel.record is None:
+                return None
+            return channel.record.to_dict(), channel.seq
+
+    def delete(self, task_id: str) -> bool:
+        with self.lock:
+            channel = self._channels.pop(task_id, None)
+        if channel is None:
+            return False
+        with channel.lock:
+            channel.closed = True
+            channel.cond.notify_all()
+        self._notify_many()
+        return True
+
+    def exists(self, task_id: str) -> bool:
+        with self.lock:
+            return task_id in self._channels
+
+    def count(self) -> int:
+        with self.lock:
+            return len(self._channels)
+
+    def get_status(self, task_id: str) -> Optional[str]:
+        channel = self._channel(task_id)
+        if channel is None:
+            return None
+        with channel.lock:
+            if channel.closed or channel.record is None:
+                return None
+            return channel.record.status
+
+    def wait_for_events(
+        self,
+        task_id: str,
+        after_seq: int,
+        timeout: float
+    ) -> Optional[Tuple[List[ProgressEvent], bool]]:
+        channel = self._channel(task_id)
+        if channel is None:
+            return None
+
+        with channel.lock:
+            channel.cond.wait_for(lambda: channel.closed or channel.seq > after_seq, timeout)
+            if channel.closed:
+                return None
+
+            return _collect_events(list(channel.events), channel.seq, after_seq)
+
+    def wait_for_many(
+        self,
+        cursors: Dict[str, int],
+        timeout: float,
+        client_id: Optional[str] = None,
+        ignored: Optional[Set[str]] = None
+    ) -> Dict[str, Optional[Tuple[List[ProgressEvent], bool]]]:
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            self._many_waiters += 1
+            try:
+                while True:
+                    # 先登记再检查，发布方看到登记后必然会唤醒，不会错过变化
+                    changes = self._collect_changes(cursors, client_id, ignored)
+                    remaining = deadline - time.monotonic()
+                    if changes or remaining <= 0:
+                        return changes
+                    self._changed.wait(remaining)
+            finally:
+                self._many_waiters -= 1
+
+    def _collect_changes(
+        self,
+        cursors: Dict[str, int],
+        client_id: Optional[str],
+        ignored: Optional[Set[str]]
+    ) -> Dict[str, Optional[Tuple[List[ProgressEvent], bool]]]:
+        """收集有变化的任务"""
+        with self.lock:
+            channels = {task_id: self._channels.get(task_id) for task_id in cursors}
+            if client_id:
+                candidates = [
+                    (task_id, channel) for task_id, channel in self._channels.items()
+                    if task_id not in cursors and not (ignored and task_id in ignored)
+                ]
+            else:
+                candidates = []
+
+        changes = {}
+        for task_id, channel in channels.items():
+            if channel is None:
+                changes[task_id] = None
+                continue
+            with channel.lock:
+                if channel.closed:
+                    changes[task_id] = None
+                elif channel.seq > cursors[task_id]:
+                    changes[task_id] = _collect_events(list(channel.events), channel.seq, cursors[task_id])
+
+        for task_id, channel in candidates:
+            record = channel.record
+            if record is not None and record.client_id == client_id:
+                changes[task_id] = ([], True)
+        return changes
+
+
+class SQLiteProgressStorage(ProgressStorage):
+    """SQLite 进度存储（WAL 模式，多进程共享）
+
+    任务记录以 JSON 保存在 progress_tasks 表，事件追加到 progress_events 表并只保留最近
+    buffer_size 条。修改在 BEGIN IMMEDIATE 事务内完成，多个进程并发写入时按顺序执行。
+    订阅者轮询任务的事件序号（主键查询），本进程内的写入会立即唤醒等待中的订阅者。
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, buffer_size: int, db_path: Path, poll_interval: float = 0.25):
+        """
+        初始化存储
+
+        Args:
+            buffer_size: 每个任务保留的最近事件数
+            db_path: 数据库文件路径（所有工作进程需指向同一文件）
+            poll_interval: 等待事件时检查其他进程写入的间隔（秒）
+        """
+        super().__init__(buffer_size)
+        self.db_path = Path(db_path)
+        self.poll_interval = max(0.01, poll_interval)
+        self._local = threading.local()
+        self._changed = threading.Condition()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._init_schema()
+        logger.info(f"SQLite 进度存储已初始化: {self.db_path}")
+
+    def _connect(self) -> sqlite3.Connection:
+        """获取当前线程的数据库连接（每个线程一个连接）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        """创建表结构"""
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS progress_tasks ('
+            ' task_id TEXT PRIMARY KEY,'
+            ' data TEXT NOT NULL,'
+            ' seq INTEGER NOT NULL DEFAULT 0,'
+            ' client_id TEXT'
+            ')'
+        )
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_progress_tasks_client ON progress_tasks (client_id)'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS progress_events ('
+            ' task_id TEXT NOT NULL,'
+            ' seq INTEGER NOT NULL,'
+            ' type TEXT NOT NULL,'
+            ' data TEXT NOT NULL,'
+            ' terminal INTEGER NOT NULL,'
+            ' PRIMARY KEY (task_id, seq)'
+            ') WITHOUT ROWID'
+        )
+
+    def _write(self, task_id: str, apply: Callable[[sqlite3.Connection], Optional[List[Tuple[str, Dict[str, Any]]]]]) -> bool:
+        """
+        在写事务内读取-修改-写回任务记录并追加事件
+
+        Args:
+            task_id: 任务ID
+            apply: 接收连接，返回要发布的事件；返回None表示任务不存在
+
+        Returns:
+            任务是否存在
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            events = apply(conn)
+            if events is None:
+                conn.execute('ROLLBACK')
+                return False
+
+            if events:
+                row = conn.execute(
+                    'SELECT seq FROM progress_tasks WHERE task_id = ?', (task_id,)
+                ).fetchone()
+                seq = row[0]
+                rows = []
+                for event_type, payload in events:
+                    seq += 1
+                    event = build_event(task_id, seq, event_type, payload)
+                    rows.append((task_id, event.seq, event.type, event.data, int(event.terminal)))
+                conn.executemany(
+                    'INSERT OR REPLACE INTO progress_events (task_id, seq, type, data, terminal) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    rows
+                )
+                conn.execute('UPDATE progress_tasks SET seq = ? WHERE task_id = ?', (seq, task_id))
+                conn.execute(
+                    'DELETE FROM progress_events WHERE task_id = ? AND seq <= ?',
+                    (task_id, seq - self.buffer_size)
+                )
+
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        with self._changed:
+            self._changed.notify_all()
+        return True
+
+    def create(self, task_id: str, record: TaskRecord, events: List[Tuple[str, Dict[str, Any]]]):
+        def apply(conn):
+            # 同一任务ID重新创建时保留事件序号，已连接的订阅者会收到新的状态事件
+            conn.execute(
+                'INSERT INTO progress_tasks (task_id, data, seq, client_id) VALUES (?, ?, 0, ?) '
+                'ON CONFLICT(task_id) DO UPDATE SET data = excluded.data, client_id = excluded.client_id',
+                (task_id, json.dumps(record.to_dict(), ensure_ascii=False), record.client_id)
+            )
+            return events
+
+        self._write(task_id, apply)
+
+    def restore(self, task_id: str, record: TaskRecord, seq: int):
+        def apply(conn):
+            conn.execute(
+                'INSERT INTO progress_tasks (task_id, data, seq, client_id) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(task_id) DO UPDATE SET data = excluded.data, '
+                'seq = MAX(progress_tasks.seq, excluded.seq), client_id = excluded.client_id',
+                (task_id, json.dumps(record.to_dict(), ensure_ascii=False), seq, record.client_id)
+            )
+            return []
+
+        self._write(task_id, apply)
+
+    def mutate(self, task_id: str, mutation: Mutation) -> bool:
+        def apply(conn):
+            row = conn.execute(
+                'SELECT data FROM progress_tasks WHERE task_id = ?', (task_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            record = TaskRecord.from_dict(json.loads(row[0]))
+            events = mutation(record)
+            conn.execute(
+                'UPDATE progress_tasks SET data = ? WHERE task_id = ?',
+                (json.dumps(record.to_dict(), ensure_ascii=False), task_id)
+            )
+            return events
+
+        return self._write(task_id, apply)
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            'SELECT data FROM progress_tasks WHERE task_id = ?', (task_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def get_all(self) -> Dict[str, Dict[str, Any]]:
+        rows = self._connect().execute('SELECT task_id, data FROM progress_tasks').fetchall()
+        return {task_id: json.loads(data) for task_id, data in rows}
+
+    def snapshot(self, task_id: str) -> Optional[Tuple[Dict[str, Any], int]]:
+        row = self._connect().execute(
+            'SELECT data, seq FROM progress_tasks WHERE task_id = ?', (task_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def delete(self, task_id: str) -> bool:
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            deleted = conn.execute('DELETE FROM progress_tasks WHERE task_id = ?', (task_id,)).rowcount
+            conn.execute('DELETE FROM progress_events WHERE task_id = ?', (task_id,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        with self._changed:
+            self._changed.notify_all()
+        return deleted > 0
+
+    def exists(self, task_id: str) -> bool:
+        row = self._connect().execute(
+            'SELECT 1 FROM progress_tasks WHERE task_id = ?', (task_id,)
+        ).fetchone()
+        return row is not None
+
+    def count(self) -> int:
+        return self._connect().execute('SELECT COUNT(*) FROM progress_tasks').fetchone()[0]
+
+    def wait_for_events(
+        self,
+        task_id: str,
+        after_seq: int,
+        timeout: float
+    ) -> Optional[Tuple[List[ProgressEvent], bool]]:
+        conn = self._connect()
+        deadline = time.monotonic() + timeout
+
+        while True:
+            row = conn.execute(
+                'SELECT seq FROM progress_tasks WHERE task_id = ?', (task_id,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            current_seq = row[0]
+            if current_seq > after_seq:
+                return self._read_events(conn, task_id, current_seq, after_seq)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return [], False
+
+            # 本进程写入时立即唤醒，其他进程的写入靠轮询发现
+            with self._changed:
+                self._changed.wait(min(self.poll_interval, remaining))
+
+    def wait_for_many(
+        self,
+        cursors: Dict[str, int],
+        timeout: float,
+        client_id: Optional[str] = None,
+        ignored: Optional[Set[str]] = None
+    ) -> Dict[str, Optional[Tuple[List[ProgressEvent], bool]]]:
+        conn = self._connect()
+        deadline = time.monotonic() + timeout
+
+        while True:
+            # 一次查询取回所有订阅任务（及该客户端的任务）的当前序号
+            current = {}
+            if cursors:
+                placeholders = ','.join('?' * len(cursors))
+                rows = conn.execute(
+                    f'SELECT task_id, seq FROM progress_tasks WHERE task_id IN ({placeholders})',
+                    list(cursors)
+                ).fetchall()
+                current.update(rows)
+            if client_id:
+                rows = conn.execute(
+                    'SELECT task_id, seq FROM progress_tasks WHERE client_id = ?', (client_id,)
+                ).fetchall()
+                current.update(rows)
+
+            changes = {}
+            for task_id, current_seq in current.items():
+                if task_id not in cursors:
+                    if not (ignored and task_id in ignored):
+                        changes[task_id] = ([], True)
+                elif current_seq > cursors[task_id]:
+                    changes[task_id] = self._read_events(conn, task_id, current_seq, cursors[task_id])
+            for task_id in cursors:
+                if task_id not in current:
+                    changes[task_id] = None
+
+            remaining = deadline - time.monotonic()
+            if changes or remaining <= 0:
+                return changes
+
+            with self._changed:
+                self._changed.wait(min(self.poll_interval, remaining))
+
+    def _read_events(
+        self,
+        conn: sqlite3.Connection,
+        task_id: str,
+        current_seq: int,
+        after_seq: int
+    ) -> Tuple[List[ProgressEvent], bool]:
+        """读取任务在指定序号之后的事件"""
+        rows = conn.execute(
+            'SELECT seq, type, data, terminal FROM progress_events '
+            'WHERE task_id = ? AND seq > ? ORDER BY seq',
+            (task_id, after_seq)
+        ).fetchall()
+        events = [ProgressEvent(seq, event_type, data, bool(terminal)) for seq, event_type, data, terminal in rows]
+        return _collect_events(events, current_seq, after_seq)
+
+
+def _collect_events(
+    events: List[ProgressEvent],
+    current_seq: int,
+    after_seq: int
+) -> Tuple[List[ProgressEvent], bool]:
+    """筛选指定序号之后的事件，并判断是否有事件已被挤出缓冲区"""
+    events = [event for event in events if event.seq > after_seq]
+    if events:
+        missed = events[0].seq > after_seq + 1
+    else:
+        missed = current_seq > after_seq
+    return events, missed
+
+
+def create_progress_storage(
+    backend: str,
+    buffer_size: int,
+    db_path: Optional[Path] = None,
+    poll_interval: float = 0.25
+) -> ProgressStorage:
+    """
+    按配置创建进度存储
+
+    Args:
+        backend: 存储类型 (memory/sqlite)
+        buffer_size: 每个任务保留的最近事件数
+        db_path: SQLite 数据库文件路径
+        poll_interval: SQLite 存储检查其他进程写入的间隔（秒）
+
+    Returns:
+        ProgressStorage 实例
+    """
+    backend = (backend or 'memory').lower()
+    if backend == 'sqlite':
+        return SQLiteProgressStorage(buffer_size, db_path, poll_interval)
+    if backend != 'memory':
+        logger.warning(f"未知的进度存储类型: {backend}，使用内存存储")
+    return MemoryProgressStorage(buffer_size)
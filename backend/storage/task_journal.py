@@ -0,0 +1,263 @@
+"""
+图片生成任务日志
+以追加方式记录未结束批次的创建参数、页面完成和失败，进程重启后据此恢复进度并重新排队剩余页面。
+任务结束（完成、失败、取消）后删除页面记录，创建参数再保留一段时间，
+任意工作进程都可以据此重建批次上下文、重试失败页面。
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 已结束任务的创建参数保留时间（秒），与进度记录的保留时间一致
+FINISHED_RETENTION_SECONDS = 24 * 3600
+
+
+def _process_alive(pid: int) -> bool:
+    """检查本机进程是否仍在运行"""
+    if os.name == 'nt':
+        # Windows 下 os.kill 会终止目标进程，无法用于探测；开发环境只有单进程，视为已退出
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _process_start_time(pid: int) -> str:
+    """读取进程启动时间（Linux /proc，开机后的时钟节拍数），无法读取时返回空字符串"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+    except OSError:
+        return ''
+    # 进程名可能含空格和括号，从最后一个右括号之后解析，starttime 是第 22 个字段
+    return stat[stat.rindex(')') + 2:].split()[19]
+
+
+_owner_ids: Dict[int, str] = {}
+
+
+def _owner_id() -> str:
+    """
+    本进程本次运行的标识：PID + 启动时间 + 随机数
+
+    进程重启后即使拿到相同的 PID（如容器中的 PID 1）标识也不同；按 PID 缓存，fork 出的子进程各自生成。
+    """
+    pid = os.getpid()
+    owner = _owner_ids.get(pid)
+    if owner is None:
+        owner = f'{pid}:{_process_start_time(pid)}:{uuid.uuid4().hex[:12]}'
+        _owner_ids[pid] = owner
+    return owner
+
+
+def _owner_alive(owner: Optional[str], pid: int) -> bool:
+    """
+    检查任务所属的进程运行是否仍在
+
+    Args:
+        owner: 登记时的进程运行标识（旧版本记录为None）
+        pid: 登记时的进程ID
+
+    Returns:
+        是否仍在运行
+    """
+    if owner == _owner_id():
+        return True
+    if pid == os.getpid():
+        # 相同 PID 的上一次运行
+        return False
+    if not _process_alive(pid):
+        return False
+    start_time = owner.split(':')[1] if owner else ''
+    if start_time:
+        # PID 已被其他进程复用时启动时间不同
+        current = _process_start_time(pid)
+        if current and current != start_time:
+            return False
+    return True
+
+
+class TaskJournal:
+    """任务日志（SQLite，多进程共享同一文件）
+
+    task_journal 表按写入顺序保存事件；task_journal_owners 记录每个任务由哪个进程的哪次运行执行
+    （PID + 启动时间 + 随机数），重启恢复时只接管所属进程已退出的任务，多个工作进程不会重复恢复同一批次，
+    重启后复用原 PID 的进程也能接管上一次运行留下的任务。
+    已结束的任务在 task_journal_owners 中记有结束时间，不再被接管。
+    """
+
+    def __init__(self, db_path: Path):
+        """
+        初始化日志
+
+        Args:
+            db_path: 数据库文件路径
+        """
+        self.db_path = Path(db_path)
+        self._local = threading.local()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._init_schema()
+        logger.info(f"任务日志已初始化: {self.db_path}")
+
+    def _connect(self) -> sqlite3.Connection:
+        """获取当前线程的数据库连接（每个线程一个连接）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        """创建表结构"""
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS task_journal ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' task_id TEXT NOT NULL,'
+            ' kind TEXT NOT NULL,'
+            ' data TEXT NOT NULL,'
+            ' created_at REAL NOT NULL'
+            ')'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_task_journal_task ON task_journal (task_id, id)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS task_journal_owners ('
+            ' task_id TEXT PRIMARY KEY,'
+            ' pid INTEGER NOT NULL,'
+            ' finished_at REAL,'
+            ' owner TEXT'
+            ')'
+        )
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(task_journal_owners)')}
+        if 'finished_at' not in columns:
+            conn.execute('ALTER TABLE task_journal_owners ADD COLUMN finished_at REAL')
+        if 'owner' not in columns:
+            conn.execute('ALTER TABLE task_journal_owners ADD COLUMN owner TEXT')
+
+    def start(self, task_id: str, params: Dict[str, Any], entries: Optional[List[Tuple[str, Dict[str, Any]]]] = None):
+        """
+        记录批次开始：清除该任务的旧记录，写入创建参数和已有的页面结果，并登记为本进程所有
+
+        Args:
+            task_id: 任务ID
+            params: 批次参数（重新生成剩余页面所需的全部输入）
+            entries: 已有的页面结果 [(类型, 数据)]（重试已结束的任务时使用）
+        """
+        now = time.time()
+        rows = [(task_id, 'created', json.dumps(params, ensure_ascii=False), now)]
+        for kind, data in entries or []:
+            rows.append((task_id, kind, json.dumps(data, ensure_ascii=False), now))
+
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM task_journal WHERE task_id = ?', (task_id,))
+            conn.executemany(
+                'INSERT INTO task_journal (task_id, kind, data, created_at) VALUES (?, ?, ?, ?)',
+                rows
+            )
+            conn.execute(
+                'INSERT OR REPLACE INTO task_journal_owners (task_id, pid, finished_at, owner) '
+                'VALUES (?, ?, NULL, ?)',
+                (task_id, os.getpid(), _owner_id())
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def append(self, task_id: str, kind: str, data: Dict[str, Any]):
+        """
+        追加一条记录
+
+        Args:
+            task_id: 任务ID
+            kind: 记录类型 (page_completed/page_failed)
+            data: 记录内容
+        """
+        self._connect().execute(
+            'INSERT INTO task_journal (task_id, kind, data, created_at) VALUES (?, ?, ?, ?)',
+            (task_id, kind, json.dumps(data, ensure_ascii=False), time.time())
+        )
+
+    def finish(self, task_id: str):
+        """任务结束：删除页面记录，保留创建参数供之后重试，并清理超过保留时间的已结束任务"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute("DELETE FROM task_journal WHERE task_id = ? AND kind != 'created'", (task_id,))
+            conn.execute('UPDATE task_journal_owners SET finished_at = ? WHERE task_id = ?', (now, task_id))
+            expired = [
+                row[0] for row in conn.execute(
+                    'SELECT task_id FROM task_journal_owners WHERE finished_at < ?',
+                    (now - FINISHED_RETENTION_SECONDS,)
+                )
+            ]
+            conn.executemany('DELETE FROM task_journal WHERE task_id = ?', [(tid,) for tid in expired])
+            conn.executemany('DELETE FROM task_journal_owners WHERE task_id = ?', [(tid,) for tid in expired])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def load_params(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """
+        读取任务的创建参数（进行中或保留期内的已结束任务）
+
+        Args:
+            task_id: 任务ID
+
+        Returns:
+            批次参数，没有记录时返回None
+        """
+        row = self._connect().execute(
+            "SELECT data FROM task_journal WHERE task_id = ? AND kind = 'created' ORDER BY id DESC LIMIT 1",
+            (task_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def claim_orphans(self) -> Dict[str, List[Tuple[str, Dict[str, Any]]]]:
+        """
+        接管所属进程已退出的未结束任务
+
+        Returns:
+            {任务ID: [(记录类型, 记录内容)]}，按写入顺序排列
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            owners = conn.execute(
+                'SELECT task_id, pid, owner FROM task_journal_owners WHERE finished_at IS NULL'
+            ).fetchall()
+            claimed = [task_id for task_id, pid, owner in owners if not _owner_alive(owner, pid)]
+            conn.executemany(
+                'UPDATE task_journal_owners SET pid = ?, owner = ? WHERE task_id = ?',
+                [(os.getpid(), _owner_id(), task_id) for task_id in claimed]
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        tasks = {}
+        for task_id in claimed:
+            rows = conn.execute(
+                'SELECT kind, data FROM task_journal WHERE task_id = ? ORDER BY id', (task_id,)
+            ).fetchall()
+            tasks[task_id] = [(kind, json.loads(data)) for kind, data in rows]
+        return tasks
@@ -0,0 +1,451 @@
+"""
+热榜时间序列存储
+每次刷新的榜单追加为一条快照，支持查询话题排名轨迹、任意时刻的榜单和一段时间内排名变化最大的话题。
+
+存储结构（SQLite，多个工作进程共享同一文件）：
+- 按 UTC 自然日分段，每段两张表：标题字典 seg_YYYYMMDD_titles（同一段内每个标题只存一次）
+  和快照表 seg_YYYYMMDD_snapshots（每条快照一行，标题ID、排名、热度按榜单顺序打包成定长数组并压缩）
+- 排名连续（1..n）时不存排名数组，缺失的热度值记为 -1
+- 超过保留期的分段整段删除，不需要逐行清理，释放的空间通过增量 VACUUM 归还
+"""
+import logging
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from array import array
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SECONDS = 86400
+
+# 热度值缺失
+MISSING_HOT_VALUE = -1
+
+_HOT_VALUE_UNITS = {'万': 10000, '亿': 100000000}
+_HOT_VALUE_PATTERN = re.compile(r'([\d.]+)\s*([万亿]?)')
+
+
+def parse_hot_value(value: Any) -> int:
+    """
+    把热度值（如 "123456"、"123.0"、"45万"）转换为整数
+
+    Args:
+        value: 原始热度值
+
+    Returns:
+        整数热度，无法解析时返回 MISSING_HOT_VALUE
+    """
+    if value is None or value == '':
+        return MISSING_HOT_VALUE
+    match = _HOT_VALUE_PATTERN.search(str(value).replace(',', ''))
+    if not match:
+        return MISSING_HOT_VALUE
+    try:
+        number = float(match.group(1))
+    except ValueError:
+        return MISSING_HOT_VALUE
+    return int(number * _HOT_VALUE_UNITS.get(match.group(2), 1))
+
+
+def segment_of(timestamp: float) -> int:
+    """时间戳所在分段（UTC 日期，如 20261017）"""
+    return int(time.strftime('%Y%m%d', time.gmtime(timestamp)))
+
+
+class TrendingHistoryStore:
+    """热榜时间序列存储"""
+
+    def __init__(self, db_path: Path, retention_days: int):
+        """
+        初始化存储
+
+        Args:
+            db_path: 数据库文件路径
+            retention_days: 历史保留天数（0 表示不清理）
+        """
+        self.db_path = Path(db_path)
+        self.retention_days = retention_days
+        self._local = threading.local()
+        # 本进程已确认存在的分段
+        self._known_segments: set = set()
+        self._segments_lock = threading.Lock()
+        self._last_cleanup = 0.0
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._init_schema()
+        logger.info(f"热榜历史已初始化: {self.db_path}, 保留 {retention_days or '不限'} 天")
+
+    def _connect(self) -> sqlite3.Connection:
+        """获取当前线程的数据库连接（每个线程一个连接）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            # 只对新建的数据库生效，删除分段后可用 incremental_vacuum 缩小文件
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        """创建分段登记表"""
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS trending_segments ('
+            ' segment INTEGER PRIMARY KEY'
+            ')'
+        )
+
+    def _ensure_segment(self, conn: sqlite3.Connection, segment: int):
+        """创建分段的表（调用方需在事务内）"""
+        if segment in self._known_segments:
+            return
+        conn.execute(
+            f'CREATE TABLE IF NOT EXISTS seg_{segment}_titles ('
+            ' id INTEGER PRIMARY KEY,'
+            ' title TEXT NOT NULL UNIQUE'
+            ')'
+        )
+        conn.execute(
+            f'CREATE TABLE IF NOT EXISTS seg_{segment}_snapshots ('
+            ' source_id TEXT NOT NULL,'
+            ' ts REAL NOT NULL,'
+            ' title_ids BLOB NOT NULL,'
+            ' ranks BLOB,'
+            ' hot_values BLOB NOT NULL,'
+            ' PRIMARY KEY (source_id, ts)'
+            ') WITHOUT ROWID'
+        )
+        conn.execute('INSERT OR IGNORE INTO trending_segments (segment) VALUES (?)', (segment,))
+        with self._segments_lock:
+            self._known_segments.add(segment)
+
+    def _segments(self, start: float, end: float) -> List[int]:
+        """与时间范围重叠的已有分段（按时间升序）"""
+        rows = self._connect().execute(
+            'SELECT segment FROM trending_segments WHERE segment BETWEEN ? AND ? ORDER BY segment',
+            (segment_of(start), segment_of(end))
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def _intern(self, conn: sqlite3.Connection, segment: int, titles: List[str]) -> List[int]:
+        """把标题转换为分段内的ID，新标题写入字典（调用方需在事务内）"""
+        conn.executemany(
+            f'INSERT OR IGNORE INTO seg_{segment}_titles (title) VALUES (?)',
+            [(title,) for title in set(titles)]
+        )
+        ids = {}
+        unique = list(set(titles))
+        # SQLite 单条语句的参数个数有上限，分批查询
+        for i in range(0, len(unique), 500):
+            chunk = unique[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            ids.update(conn.execute(
+                f'SELECT title, id FROM seg_{segment}_titles WHERE title IN ({placeholders})', chunk
+            ).fetchall())
+        return [ids[title] for title in titles]
+
+    def append(self, source_id: str, items: List[Dict[str, Any]], timestamp: float):
+        """
+        追加一条榜单快照
+
+        Args:
+            source_id: 数据源ID
+            items: 热榜条目列表（TrendingItem.to_dict() 格式）
+            timestamp: 抓取时间戳
+        """
+        items = [item for item in items if item.get('title')]
+        if not items:
+            return
+
+        ranks = [item.get('index') or position + 1 for position, item in enumerate(items)]
+        hot_values = array('q', (parse_hot_value(item.get('hot_value')) for item in items))
+        segment = segment_of(timestamp)
+
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._ensure_segment(conn, segment)
+            title_ids = array('I', self._intern(conn, segment, [item['title'] for item in items]))
+            # 大多数榜单排名就是顺序号，此时省去排名数组
+            rank_blob = None if ranks == list(range(1, len(ranks) + 1)) else array('H', ranks).tobytes()
+            conn.execute(
+                f'INSERT OR IGNORE INTO seg_{segment}_snapshots (source_id, ts, title_ids, ranks, hot_values) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (
+                    source_id,
+                    timestamp,
+                    zlib.compress(title_ids.tobytes()),
+                    rank_blob,
+                    zlib.compress(hot_values.tobytes())
+                )
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        self._cleanup_if_due()
+
+    def _cleanup_if_due(self):
+        """每小时最多检查一次，删除超过保留期的分段"""
+        now = time.time()
+        if not self.retention_days or now - self._last_cleanup < 3600:
+            return
+        self._last_cleanup = now
+
+        cutoff = segment_of(now - self.retention_days * SEGMENT_SECONDS)
+        conn = self._connect()
+        expired = [row[0] for row in conn.execute(
+            'SELECT segment FROM trending_segments WHERE segment < ?', (cutoff,)
+        ).fetchall()]
+        for segment in expired:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(f'DROP TABLE IF EXISTS seg_{segment}_snapshots')
+                conn.execute(f'DROP TABLE IF EXISTS seg_{segment}_titles')
+                conn.execute('DELETE FROM trending_segments WHERE segment = ?', (segment,))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            with self._segments_lock:
+                self._known_segments.discard(segment)
+        if expired:
+            # execute() 每次只释放一页，executescript() 才会执行完毕
+            conn.executescript('PRAGMA incremental_vacuum;')
+            logger.info(f"已删除 {len(expired)} 个超过保留期的热榜历史分段")
+
+    @staticmethod
+    def _decode_row(title_ids: bytes, ranks: Optional[bytes], hot_values: bytes) -> Tuple[array, List[int], array]:
+        """解码快照行的数组列"""
+        ids = array('I')
+        ids.frombytes(zlib.decompress(title_ids))
+        values = array('q')
+        values.frombytes(zlib.decompress(hot_values))
+        if ranks is None:
+            rank_list = list(range(1, len(ids) + 1))
+        else:
+            rank_array = array('H')
+            rank_array.frombytes(ranks)
+            rank_list = rank_array.tolist()
+        return ids, rank_list, values
+
+    @staticmethod
+    def _hot_value(value: int) -> Optional[int]:
+        """存储的热度值转换为返回值（缺失为None）"""
+        return None if value == MISSING_HOT_VALUE else value
+
+    def get_trajectory(self, source_id: str, title: str, start: float, end: float) -> Dict[str, Any]:
+        """
+        查询话题在时间范围内的排名轨迹
+
+        Args:
+            source_id: 数据源ID
+            title: 话题标题（精确匹配）
+            start: 起始时间戳
+            end: 结束时间戳
+
+        Returns:
+            {'points': [{'ts', 'rank', 'hot_value'}], 'first_seen', 'last_seen',
+             'on_board_seconds': 在榜时长（按相邻快照间隔累计）, 'best_rank', 'snapshots': 扫描的快照数}
+        """
+        conn = self._connect()
+        points = []
+        on_board = 0.0
+        scanned = 0
+        previous_ts = None
+        previous_on_board = False
+
+        for segment in self._segments(start, end):
+            row = conn.execute(f'SELECT id FROM seg_{segment}_titles WHERE title = ?', (title,)).fetchone()
+            title_id = row[0] if row else None
+            rows = conn.execute(
+                f'SELECT ts, title_ids, ranks, hot_values FROM seg_{segment}_snapshots '
+                'WHERE source_id = ? AND ts BETWEEN ? AND ? ORDER BY ts',
+                (source_id, start, end)
+            )
+            for ts, title_ids, ranks, hot_values in rows:
+                scanned += 1
+                position = -1
+                if title_id is not None:
+                    ids = array('I')
+                    ids.frombytes(zlib.decompress(title_ids))
+                    try:
+                        position = ids.index(title_id)
+                    except ValueError:
+                        position = -1
+
+                if previous_on_board and previous_ts is not None:
+                    on_board += ts - previous_ts
+                previous_ts = ts
+                previous_on_board = position >= 0
+
+                if position >= 0:
+                    _, rank_list, values = self._decode_row(title_ids, ranks, hot_values)
+                    points.append({
+                        'ts': ts,
+                        'rank': rank_list[position],
+                        'hot_value': self._hot_value(values[position])
+                    })
+
+        return {
+            'source_id': source_id,
+            'title': title,
+            'points': points,
+            'first_seen': points[0]['ts'] if points else None,
+            'last_seen': points[-1]['ts'] if points else None,
+            'on_board_seconds': round(on_board, 1),
+            'best_rank': min((point['rank'] for point in points), default=None),
+            'snapshots': scanned
+        }
+
+    def _snapshot_at(self, source_id: str, timestamp: float, before: bool = True) -> Optional[Tuple[int, tuple]]:
+        """
+        查找不晚于（或不早于）指定时间的最近一条快照
+
+        Returns:
+            (分段, (ts, title_ids, ranks, hot_values))，没有时返回None
+        """
+        conn = self._connect()
+        if before:
+            segments = conn.execute(
+                'SELECT segment FROM trending_segments WHERE segment <= ? ORDER BY segment DESC',
+                (segment_of(timestamp),)
+            ).fetchall()
+            sql = 'WHERE source_id = ? AND ts <= ? ORDER BY ts DESC LIMIT 1'
+        else:
+            segments = conn.execute(
+                'SELECT segment FROM trending_segments WHERE segment >= ? ORDER BY segment',
+                (segment_of(timestamp),)
+            ).fetchall()
+            sql = 'WHERE source_id = ? AND ts >= ? ORDER BY ts LIMIT 1'
+
+        for (segment,) in segments:
+            row = conn.execute(
+                f'SELECT ts, title_ids, ranks, hot_values FROM seg_{segment}_snapshots {sql}',
+                (source_id, timestamp)
+            ).fetchone()
+            if row:
+                return segment, row
+        return None
+
+    def _resolve_titles(self, segment: int, ids: List[int]) -> Dict[int, str]:
+        """把分段内的标题ID转换为标题"""
+        conn = self._connect()
+        titles = {}
+        unique = list(set(ids))
+        for i in range(0, len(unique), 500):
+            chunk = unique[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            titles.update(conn.execute(
+                f'SELECT id, title FROM seg_{segment}_titles WHERE id IN ({placeholders})', chunk
+            ).fetchall())
+        return titles
+
+    def _decode_snapshot(self, segment: int, row: tuple, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """把快照行解码为 [{'rank', 'title', 'hot_value'}]"""
+        _, title_ids, ranks, hot_values = row
+        ids, rank_list, values = self._decode_row(title_ids, ranks, hot_values)
+        count = len(ids) if limit is None else min(limit, len(ids))
+        titles = self._resolve_titles(segment, ids[:count].tolist())
+        return [
+            {'rank': rank_list[i], 'title': titles.get(ids[i], ''), 'hot_value': self._hot_value(values[i])}
+            for i in range(count)
+        ]
+
+    def get_top(self, source_id: str, timestamp: float, limit: int = 10) -> Optional[Dict[str, Any]]:
+        """
+        查询指定时刻的榜单（不晚于该时刻的最近一次快照）
+
+        Args:
+            source_id: 数据源ID
+            timestamp: 查询时刻
+            limit: 返回前几名
+
+        Returns:
+            {'ts': 快照时间, 'items': [{'rank', 'title', 'hot_value'}]}，没有历史时返回None
+        """
+        found = self._snapshot_at(source_id, timestamp)
+        if found is None:
+            return None
+        segment, row = found
+        return {'source_id': source_id, 'ts': row[0], 'items': self._decode_snapshot(segment, row, limit)}
+
+    def get_movers(self, source_id: str, start: float, end: float, limit: int = 10) -> Optional[Dict[str, Any]]:
+        """
+        查询时间范围内排名上升最多的话题
+
+        以范围起点附近的快照为基准、终点前最近的快照为当前榜单，
+        新上榜的话题按（基准榜单长度 + 1 - 当前排名）计算上升幅度；
+        已跌出榜单的话题当前排名为None，按（基准排名 - 当前榜单长度 - 1）计算下降幅度，至少下降一位。
+
+        Args:
+            source_id: 数据源ID
+            start: 起始时间戳
+            end: 结束时间戳
+            limit: 返回条数
+
+        Returns:
+            {'from_ts', 'to_ts', 'risers': [...], 'fallers': [...]}，
+            每项为 {'title', 'rank', 'previous_rank', 'change', 'hot_value', 'hot_value_change'}，
+            跌出榜单的话题 rank、hot_value 为None；
+            范围内快照不足时返回None
+        """
+        current = self._snapshot_at(source_id, end)
+        baseline = self._snapshot_at(source_id, start) or self._snapshot_at(source_id, start, before=False)
+        if current is None or baseline is None or baseline[1][0] >= current[1][0]:
+            return None
+
+        previous = {item['title']: item for item in self._decode_snapshot(*baseline)}
+        latest = self._decode_snapshot(*current)
+        floor = len(previous) + 1
+        dropped_floor = len(latest) + 1
+
+        moves = []
+        for item in latest:
+            before = previous.get(item['title'])
+            previous_rank = before['rank'] if before else None
+            hot_change = None
+            if before and item['hot_value'] is not None and before['hot_value'] is not None:
+                hot_change = item['hot_value'] - before['hot_value']
+            moves.append({
+                'title': item['title'],
+                'rank': item['rank'],
+                'previous_rank': previous_rank,
+                'change': (previous_rank or floor) - item['rank'],
+                'hot_value': item['hot_value'],
+                'hot_value_change': hot_change
+            })
+
+        on_board = {item['title'] for item in latest}
+        for title, before in previous.items():
+            if title in on_board:
+                continue
+            moves.append({
+                'title': title,
+                'rank': None,
+                'previous_rank': before['rank'],
+                # 基准排名靠后时按至少下降一位计，跌出榜单总算作下降
+                'change': min(before['rank'] - dropped_floor, -1),
+                'hot_value': None,
+                'hot_value_change': None
+            })
+
+        def position(move: Dict[str, Any]) -> int:
+            return move['rank'] if move['rank'] is not None else dropped_floor
+
+        risers = sorted((m for m in moves if m['change'] > 0), key=lambda m: (-m['change'], position(m)))
+        fallers = sorted(
+            (m for m in moves if m['change'] < 0),
+            key=lambda m: (m['change'], position(m), m['previous_rank'])
+        )
+        return {
+            'source_id': source_id,
+            'from_ts': baseline[1][0],
+            'to_ts': current[1][0],
+            'risers': risers[:limit],
+            'fallers': fallers[:limit]
+        }
@@ -0,0 +1,147 @@
+"""
+热榜数据快照
+每次刷新成功后保存各数据源的最新列表和抓取时间，服务启动时据此预热缓存，重启后无需等待上游即可响应；
+抓取时间原样保留，过期规则照常生效。多个工作进程共享同一文件，可直接采用其他进程刚刷新的数据；
+刷新租约保证同一数据源同一时间只有一个进程在后台抓取上游。
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TrendingSnapshotStore:
+    """热榜快照（SQLite，每个数据源只保留最新一份）
+
+    trending_refresh_leases 记录每个数据源当前由哪个进程负责刷新及租约到期时间，
+    持有者异常退出时租约到期后由其他进程接手。
+    """
+
+    def __init__(self, db_path: Path):
+        """
+        初始化快照存储
+
+        Args:
+            db_path: 数据库文件路径
+        """
+        self.db_path = Path(db_path)
+        self._local = threading.local()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._init_schema()
+        logger.info(f"热榜快照已初始化: {self.db_path}")
+
+    def _connect(self) -> sqlite3.Connection:
+        """获取当前线程的数据库连接（每个线程一个连接）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        """创建表结构"""
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS trending_snapshots ('
+            ' source_id TEXT PRIMARY KEY,'
+            ' data TEXT NOT NULL,'
+            ' fetched_at REAL NOT NULL'
+            ')'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS trending_refresh_leases ('
+            ' source_id TEXT PRIMARY KEY,'
+            ' owner TEXT NOT NULL,'
+            ' expires_at REAL NOT NULL'
+            ')'
+        )
+
+    def acquire_lease(self, source_id: str, owner: str, ttl: float) -> bool:
+        """
+        获取（或续期）数据源的刷新租约
+
+        Args:
+            source_id: 数据源ID
+            owner: 进程标识
+            ttl: 租约时长（秒）
+
+        Returns:
+            是否持有租约（其他进程的租约未到期时返回False）
+        """
+        now = time.time()
+        cursor = self._connect().execute(
+            'INSERT INTO trending_refresh_leases (source_id, owner, expires_at) VALUES (?, ?, ?) '
+            'ON CONFLICT(source_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at '
+            'WHERE trending_refresh_leases.owner = excluded.owner OR trending_refresh_leases.expires_at < ?',
+            (source_id, owner, now + ttl, now)
+        )
+        return cursor.rowcount > 0
+
+    def release_lease(self, source_id: str, owner: str):
+        """
+        释放刷新租约（只释放自己持有的）
+
+        Args:
+            source_id: 数据源ID
+            owner: 进程标识
+        """
+        self._connect().execute(
+            'DELETE FROM trending_refresh_leases WHERE source_id = ? AND owner = ?', (source_id, owner)
+        )
+
+    def save(self, source_id: str, data: List[Dict[str, Any]], fetched_at: float):
+        """
+        保存数据源的最新列表（其他进程已写入更新的数据时不覆盖）
+
+        Args:
+            source_id: 数据源ID
+            data: 热榜条目列表
+            fetched_at: 抓取时间戳
+        """
+        self._connect().execute(
+            'INSERT INTO trending_snapshots (source_id, data, fetched_at) VALUES (?, ?, ?) '
+            'ON CONFLICT(source_id) DO UPDATE SET data = excluded.data, fetched_at = excluded.fetched_at '
+            'WHERE excluded.fetched_at > trending_snapshots.fetched_at',
+            (source_id, json.dumps(data, ensure_ascii=False, separators=(',', ':')), fetched_at)
+        )
+
+    def load(self, source_id: str, newer_than: float = 0) -> Optional[Tuple[List[Dict[str, Any]], float]]:
+        """
+        读取数据源的快照
+
+        Args:
+            source_id: 数据源ID
+            newer_than: 只返回抓取时间晚于此时间戳的快照
+
+        Returns:
+            (热榜条目列表, 抓取时间戳)，没有符合条件的快照时返回None
+        """
+        row = self._connect().execute(
+            'SELECT data, fetched_at FROM trending_snapshots WHERE source_id = ? AND fetched_at > ?',
+            (source_id, newer_than)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def load_all(self, since: float = 0) -> Dict[str, Tuple[List[Dict[str, Any]], float]]:
+        """
+        读取所有数据源的快照
+
+        Args:
+            since: 只返回抓取时间晚于此时间戳的快照（超过保留期的数据无需加载）
+
+        Returns:
+            {数据源ID: (热榜条目列表, 抓取时间戳)}
+        """
+        rows = self._connect().execute(
+            'SELECT source_id, data, fetched_at FROM trending_snapshots WHERE fetched_at > ?', (since,)
+        ).fetchall()
+        return {source_id: (json.loads(data), fetched_at) for source_id, data, fetched_at in rows}
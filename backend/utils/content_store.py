@@ -0,0 +1,294 @@
+"""
+内容寻址存储
+按 sha256 存放图片文件：相同内容只落盘一次，路径即内容摘要，可永久缓存
+
+不维护引用计数：同一文件可能被多条历史记录、结果缓存和进度记录引用，删除记录时不删除文件。
+改为定期标记清除：扫描历史、素材、模板、进度记录和任务日志中出现的摘要，
+删除未被引用、且超过 CONTENT_GC_MIN_AGE_DAYS 未写入或复用的文件（复用时刷新修改时间）。
+只存在于内存中的引用（结果缓存、执行中的批次）由最短保留时间兜底。
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# 内容寻址文件的相对路径格式: <subdir>/ab/cd/<sha256>.<ext>
+CONTENT_PATH_PATTERN = re.compile(r'^[\w-]+/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})\.\w+$')
+
+# 引用扫描时识别的摘要（JSON 和 SQLite 文件中的 URL 均为明文）
+DIGEST_PATTERN = re.compile(rb'[0-9a-f]{64}')
+
+# 清理检查间隔（秒）
+GC_INTERVAL_SECONDS = 24 * 3600
+
+# 未完成的临时文件超过此时间（秒）视为写入中断，清理时删除
+TEMP_FILE_MAX_AGE = 3600
+
+
+def _reference_paths() -> List[Path]:
+    """可能引用内容寻址文件的持久化记录（目录或文件，SQLite 含 WAL 文件）"""
+    paths = [
+        Config.HISTORY_FOLDER,
+        Config.MATERIALS_FOLDER,
+        Config.STORAGE_FOLDER / 'templates'
+    ]
+    for db_path in (Config.PROGRESS_DB_PATH, Config.TASK_JOURNAL_PATH):
+        paths.append(Path(db_path))
+        paths.append(Path(f'{db_path}-wal'))
+    return paths
+
+
+def collect_referenced_digests(paths: Iterable[Path]) -> Set[str]:
+    """
+    收集记录中出现的所有内容摘要
+
+    Args:
+        paths: 记录文件或目录（目录递归扫描）
+
+    Returns:
+        摘要集合（误识别只会多保留文件，不会误删）
+    """
+    digests: Set[str] = set()
+    for path in paths:
+        path = Path(path)
+        files = path.rglob('*') if path.is_dir() else [path]
+        for file_path in files:
+            try:
+                if not file_path.is_file():
+                    continue
+                data = file_path.read_bytes()
+            except OSError:
+                continue
+            digests.update(match.decode('ascii') for match in DIGEST_PATTERN.findall(data))
+    return digests
+
+
+class ContentStore:
+    """内容寻址存储类
+
+    文件按 <subdir>/<摘要前2位>/<摘要3-4位>/<摘要>.<ext> 分片存放，
+    写入时边写边计算摘要，内容已存在时直接复用，不重复落盘。
+    写入时每天最多触发一次后台清理（见 sweep）。
+    """
+
+    def __init__(self, root_dir: Path, min_age_days: Optional[int] = None):
+        """
+        初始化存储
+
+        Args:
+            root_dir: 上传根目录
+            min_age_days: 未被引用的文件保留天数，默认 CONTENT_GC_MIN_AGE_DAYS（0 表示不清理）
+        """
+        self.root_dir = Path(root_dir)
+        self.temp_dir = self.root_dir / 'temp'
+        self.min_age_days = Config.CONTENT_GC_MIN_AGE_DAYS if min_age_days is None else min_age_days
+        self.lock = threading.Lock()
+        # 本进程的写入统计
+        self._stored_count = 0
+        self._stored_bytes = 0
+        self._reused_count = 0
+        self._reused_bytes = 0
+        # 本进程的清理统计
+        self._last_sweep = 0.0
+        self._swept_count = 0
+        self._swept_bytes = 0
+
+    @staticmethod
+    def content_path(subdir: str, digest: str, ext: str) -> str:
+        """
+        计算内容寻址的相对路径
+
+        Args:
+            subdir: 子目录 (generated/references)
+            digest: sha256 十六进制摘要
+            ext: 扩展名
+
+        Returns:
+            相对路径
+        """
+        return f"{subdir}/{digest[:2]}/{digest[2:4]}/{digest}.{ext}"
+
+    @staticmethod
+    def is_content_path(relative_path: str) -> bool:
+        """判断相对路径是否为内容寻址路径"""
+        return CONTENT_PATH_PATTERN.match(relative_path) is not None
+
+    def put_bytes(self, data: bytes, subdir: str, ext: str) -> str:
+        """
+        存入一段字节内容
+
+        Args:
+            data: 文件内容
+            subdir: 子目录
+            ext: 扩展名
+
+        Returns:
+            相对路径
+        """
+        return self.put_stream([data], subdir, ext)
+
+    def put_stream(self, chunks: Iterable[bytes], subdir: str, ext: str) -> str:
+        """
+        流式存入内容：边写临时文件边计算摘要，完成后移动到内容寻址路径
+
+        Args:
+            chunks: 内容分块迭代器
+            subdir: 子目录
+            ext: 扩展名
+
+        Returns:
+            相对路径
+        """
+        self.temp_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.temp_dir / f"{uuid.uuid4().hex}.part"
+        hasher = hashlib.sha256()
+        size = 0
+
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    if not chunk:
+                        continue
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+
+            relative_path = self.content_path(subdir, hasher.hexdigest(), ext)
+            full_path = self.root_dir / relative_path
+
+            with self.lock:
+                if full_path.exists():
+                    # 相同内容已存在，丢弃临时文件；刷新修改时间，避免刚复用的文件被清理
+                    tmp_path.unlink()
+                    os.utime(full_path)
+                    self._reused_count += 1
+                    self._reused_bytes += size
+                    logger.info(f"内容已存在，复用文件: {relative_path}")
+                else:
+                    full_path.parent.mkdir(parents=True, exist_ok=True)
+                    os.replace(tmp_path, full_path)
+                    self._stored_count += 1
+                    self._stored_bytes += size
+
+            self._sweep_if_due()
+            return relative_path
+
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def _sweep_if_due(self):
+        """每天最多一次，在后台线程中清理未被引用的文件"""
+        now = time.time()
+        with self.lock:
+            if not self.min_age_days or now - self._last_sweep < GC_INTERVAL_SECONDS:
+                return
+            self._last_sweep = now
+        threading.Thread(target=self._sweep_background, name='content-gc', daemon=True).start()
+
+    def _sweep_background(self):
+        """后台清理（异常只记录日志）"""
+        try:
+            self.sweep(collect_referenced_digests(_reference_paths()), self.min_age_days * 86400)
+        except Exception as e:
+            logger.error(f"清理内容寻址文件失败: {e}", exc_info=True)
+
+    def sweep(self, referenced: Set[str], min_age: float) -> Dict[str, int]:
+        """
+        删除未被引用、且超过 min_age 秒未写入或复用的内容寻址文件，以及中断写入遗留的临时文件
+
+        Args:
+            referenced: 仍被引用的摘要
+            min_age: 最短保留时间（秒）
+
+        Returns:
+            {'removed_files', 'removed_bytes', 'kept_files'}
+        """
+        cutoff = time.time() - min_age
+        removed_files = removed_bytes = kept_files = 0
+
+        for path in self.root_dir.glob('*/??/??/*.*'):
+            match = CONTENT_PATH_PATTERN.match(path.relative_to(self.root_dir).as_posix())
+            if match is None:
+                continue
+            if match.group(1) in referenced:
+                kept_files += 1
+                continue
+            with self.lock:
+                # 在锁内复查修改时间，与本进程的复用写入互斥
+                try:
+                    stat = path.stat()
+                    if stat.st_mtime > cutoff:
+                        kept_files += 1
+                        continue
+                    path.unlink()
+                except FileNotFoundError:
+                    continue
+            removed_files += 1
+            removed_bytes += stat.st_size
+
+        if self.temp_dir.exists():
+            for tmp_path in self.temp_dir.glob('*.part'):
+                try:
+                    if tmp_path.stat().st_mtime < time.time() - TEMP_FILE_MAX_AGE:
+                        tmp_path.unlink()
+                except FileNotFoundError:
+                    continue
+
+        with self.lock:
+            self._swept_count += removed_files
+            self._swept_bytes += removed_bytes
+        logger.info(
+            f"内容寻址文件清理完成: 删除 {removed_files} 个（{removed_bytes} 字节），保留 {kept_files} 个"
+        )
+        return {'removed_files': removed_files, 'removed_bytes': removed_bytes, 'kept_files': kept_files}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取本进程的写入统计
+
+        Returns:
+            统计信息字典（新写入的文件数和字节数、因内容已存在而复用的次数和节省的字节数、清理删除的文件数和字节数）
+        """
+        with self.lock:
+            return {
+                'stored_files': self._stored_count,
+                'stored_bytes': self._stored_bytes,
+                'reused_files': self._reused_count,
+                'deduplicated_bytes': self._reused_bytes,
+                'swept_files': self._swept_count,
+                'swept_bytes': self._swept_bytes
+            }
+
+
+_stores: Dict[str, ContentStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_content_store(root_dir: Path) -> ContentStore:
+    """
+    获取指定上传根目录的内容存储（进程内共享）
+
+    Args:
+        root_dir: 上传根目录
+
+    Returns:
+        ContentStore 实例
+    """
+    key = str(Path(root_dir).resolve())
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = ContentStore(Path(root_dir))
+            _stores[key] = store
+        return store
+
@@ -3,7 +3,6 @@
 处理文件上传、保存和管理
 """
 import os
-import uuid
 import logging
 import base64
 import requests
@@ -13,6 +12,9 @@ from werkzeug.utils import secure_filename
 from werkzeug.datastructures import FileStorage
 from datetime import datetime
 
+from .http_pool import get_http_session
+from .content_store import get_content_store
+
 logger = logging.getLogger(__name__)
 
 # 允许的图片文件扩展名
@@ -34,6 +36,8 @@ class FileUtils:
         """
         self.upload_dir = Path(upload_dir)
         self._ensure_upload_dir()
+        # 生成图片和参考图片按内容寻址存放，相同内容只保存一份
+        self.content_store = get_content_store(self.upload_dir)
     
     def _ensure_upload_dir(self):
         """确保上传目录存在"""
@@ -98,20 +102,16 @@ class FileUtils:
             original_filename = secure_filename(file.filename)
             ext = original_filename.rsplit('.', 1)[1].lower()
             
-            # 使用UUID生成唯一文件名
-            unique_filename = f"{uuid.uuid4().hex}.{ext}"
-            
-            # 构建完整路径
-            save_dir = self.upload_dir / subdir
-            file_path = save_dir / unique_filename
-            
-            # 保存文件
-            file.save(str(file_path))
+            # 按内容摘要保存（边写边计算 sha256）
+            relative_path = self.content_store.put_stream(
+                iter(lambda: file.stream.read(8192), b''),
+                subdir,
+                ext
+            )
             
-            logger.info(f"文件保存成功: {file_path}")
+            logger.info(f"文件保存成功: {relative_path}")
             
             # 返回相对路径
-            relative_path = f"{subdir}/{unique_filename}"
             return True, relative_path, ''
             
         except Exception as e:
@@ -129,6 +129,11 @@ class FileUtils:
             是否成功
         """
         try:
+            # 内容寻址文件可能被多处引用，保留文件，不再被引用后由内容存储定期清理（见 ContentStore.sweep）
+            if self.content_store.is_content_path(file_path):
+                logger.info(f"内容寻址文件可能被其他记录引用，保留至定期清理: {file_path}")
+                return True
+            
             full_path = self.upload_dir / file_path
             
             if full_path.exists() and full_path.is_file():
@@ -321,21 +326,12 @@ class FileUtils:
             # 解码 base64
             image_data = base64.b64decode(base64_data)
             
-            # 生成唯一文件名
-            unique_filename = f"{uuid.uuid4().hex}.{ext}"
-            
-            # 构建完整路径
-            save_dir = self.upload_dir / subdir
-            file_path = save_dir / unique_filename
-            
-            # 保存文件
-            with open(file_path, 'wb') as f:
-                f.write(image_data)
+            # 按内容摘要保存，相同图片只落盘一次
+            relative_path = self.content_store.put_bytes(image_data, subdir, ext)
             
-            logger.info(f"Base64 图片保存成功: {file_path}")
+            logger.info(f"Base64 图片保存成功: {relative_path}")
             
             # 返回相对路径
-            relative_path = f"{subdir}/{unique_filename}"
             return True, relative_path, ''
             
         except Exception as e:
@@ -360,45 +356,38 @@ class FileUtils:
             (是否成功, 本地文件路径, 错误信息)
         """
         try:
-            # 发送请求下载图片
-            response = requests.get(
+            # 发送请求下载图片（复用共享连接池中的 keep-alive 连接）
+            with get_http_session(url).get(
                 url,
                 timeout=timeout,
                 headers={
                     'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
                 },
                 stream=True
-            )
-            response.raise_for_status()
-            
-            # 从 Content-Type 或 URL 确定扩展名
-            content_type = response.headers.get('Content-Type', '')
-            ext = self._get_extension_from_content_type(content_type)
-            
-            if not ext:
-                # 尝试从 URL 获取扩展名
-                ext = self._get_extension_from_url(url)
-            
-            if not ext:
-                ext = 'png'  # 默认扩展名
-            
-            # 生成唯一文件名
-            unique_filename = f"{uuid.uuid4().hex}.{ext}"
-            
-            # 构建完整路径
-            save_dir = self.upload_dir / subdir
-            file_path = save_dir / unique_filename
-            
-            # 保存文件
-            with open(file_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
+            ) as response:
+                response.raise_for_status()
+                
+                # 从 Content-Type 或 URL 确定扩展名
+                content_type = response.headers.get('Content-Type', '')
+                ext = self._get_extension_from_content_type(content_type)
+                
+                if not ext:
+                    # 尝试从 URL 获取扩展名
+                    ext = self._get_extension_from_url(url)
+                
+                if not ext:
+                    ext = 'png'  # 默认扩展名
+                
+                # 边下载边计算摘要，按内容寻址保存
+                relative_path = self.content_store.put_stream(
+                    response.iter_content(chunk_size=8192),
+                    subdir,
+                    ext
+                )
             
-            logger.info(f"HTTP 图片下载保存成功: {file_path}")
+            logger.info(f"HTTP 图片下载保存成功: {relative_path}")
             
             # 返回相对路径
-            relative_path = f"{subdir}/{unique_filename}"
             return True, relative_path, ''
             
         except requests.exceptions.Timeout:
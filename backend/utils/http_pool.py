@@ -0,0 +1,207 @@
+"""
+HTTP 连接池
+按服务地址（scheme://host:port）共享 keep-alive 的 requests.Session，
+避免每次请求都重新建立 TCP + TLS 连接。会话数不超过 HTTP_POOL_MAX_HOSTS，
+超出时关闭最久未使用的会话（结果下载的 CDN 地址常常按请求变化，不能无限保留）
+
+另提供按线程的请求发出通知：生成调度器在执行作业前登记回调，客户端在请求实际发出前调用
+notify_request_sent()，单页时限因此不包含发送前的本地限速等待
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_request_local = threading.local()
+
+
+class HTTPSessionPool:
+    """HTTP 会话池 - 线程安全的单例模式"""
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        """单例模式实现"""
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        """初始化会话池"""
+        if not hasattr(self, '_initialized'):
+            # 按最近使用排序，最久未用的在前
+            self._sessions: 'OrderedDict[str, requests.Session]' = OrderedDict()
+            self._sessions_lock = threading.Lock()
+            # 每个服务地址的最大连接数，与生成调度器的全局并发保持一致
+            self.pool_maxsize = Config.MAX_CONCURRENT_GENERATIONS
+            self.max_hosts = max(1, Config.HTTP_POOL_MAX_HOSTS)
+            self._session_hits = 0
+            self._session_misses = 0
+            self._session_evictions = 0
+            self._initialized = True
+            logger.info(f"HTTP 连接池已初始化: 单地址最大连接数={self.pool_maxsize}")
+
+    def configure(self, pool_maxsize: int):
+        """
+        设置单个服务地址的最大连接数（仅影响之后新建的会话）
+
+        Args:
+            pool_maxsize: 最大连接数
+        """
+        self.pool_maxsize = max(1, pool_maxsize)
+
+    @staticmethod
+    def _base_url(url: str) -> str:
+        """提取 scheme://host:port 作为会话键"""
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}".lower()
+
+    def get_session(self, url: str) -> requests.Session:
+        """
+        获取指定地址对应的共享会话
+
+        Args:
+            url: 请求地址（可包含路径和查询参数）
+
+        Returns:
+            requests.Session 实例
+        """
+        key = self._base_url(url)
+        evicted = []
+
+        with self._sessions_lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                self._sessions.move_to_end(key)
+                self._session_hits += 1
+                return session
+
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=self.pool_maxsize
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._sessions[key] = session
+            self._session_misses += 1
+            while len(self._sessions) > self.max_hosts:
+                evicted.append(self._sessions.popitem(last=False))
+                self._session_evictions += 1
+
+        logger.info(f"创建 HTTP 会话: {key}")
+        for evicted_key, evicted_session in evicted:
+            # 关闭空闲连接；仍在进行的请求结束后其连接直接丢弃
+            evicted_session.close()
+            logger.info(f"关闭最久未用的 HTTP 会话: {evicted_key}")
+        return session
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取连接池统计
+
+        连接命中数 = 请求数 - 新建连接数（复用已有 keep-alive 连接的请求）
+
+        Returns:
+            统计信息字典
+        """
+        with self._sessions_lock:
+            sessions = list(self._sessions.items())
+            session_hits = self._session_hits
+            session_misses = self._session_misses
+            session_evictions = self._session_evictions
+
+        hosts = []
+        total_requests = 0
+        total_connections = 0
+        for key, session in sessions:
+            requests_count = 0
+            connections_count = 0
+            adapter = session.get_adapter(key)
+            pools = adapter.poolmanager.pools
+            for pool_key in list(pools.keys()):
+                pool = pools.get(pool_key)
+                if pool is None:
+                    continue
+                requests_count += pool.num_requests
+                connections_count += pool.num_connections
+
+            total_requests += requests_count
+            total_connections += connections_count
+            hosts.append({
+                'host': key,
+                'requests': requests_count,
+                'connections': connections_count,
+                'hits': requests_count - connections_count,
+                'misses': connections_count
+            })
+
+        return {
+            'pool_maxsize': self.pool_maxsize,
+            'sessions': len(sessions),
+            'session_hits': session_hits,
+            'session_misses': session_misses,
+            'session_evictions': session_evictions,
+            'max_hosts': self.max_hosts,
+            'requests': total_requests,
+            'hits': total_requests - total_connections,
+            'misses': total_connections,
+            'hit_rate': round((total_requests - total_connections) / total_requests, 4) if total_requests else 0.0,
+            'hosts': hosts
+        }
+
+
+def get_http_session(url: str) -> requests.Session:
+    """
+    获取指定地址对应的共享会话
+
+    Args:
+        url: 请求地址
+
+    Returns:
+        requests.Session 实例
+    """
+    return HTTPSessionPool().get_session(url)
+
+
+def get_http_pool_stats() -> Dict[str, Any]:
+    """
+    获取 HTTP 连接池统计
+
+    Returns:
+        统计信息字典
+    """
+    return HTTPSessionPool().get_stats()
+
+
+def set_request_listener(listener: Optional[Callable[[], None]]):
+    """
+    设置当前线程发出请求时的回调
+
+    Args:
+        listener: 无参回调，None 表示清除
+    """
+    _request_local.listener = listener
+
+
+def get_request_listener() -> Optional[Callable[[], None]]:
+    """获取当前线程的请求回调（转交其他线程执行请求时使用）"""
+    return getattr(_request_local, 'listener', None)
+
+
+def notify_request_sent():
+    """通知当前线程的回调：请求即将发出"""
+    listener = get_request_listener()
+    if listener is not None:
+        listener()
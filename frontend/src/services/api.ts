@@ -51,11 +51,12 @@ export interface GenerateImagesParams {
     aspectRatio: string
   }
   full_outline?: string  // 新增：完整内容大纲
+  client_id?: string  // 客户端标识（默认自动带上，用于按客户端订阅进度）
 }
 
 export interface ProgressData {
   task_id: string
-  status: 'pending' | 'running' | 'completed' | 'failed'
+  status: 'pending' | 'running' | 'completed' | 'failed' | 'cancelled'
   progress: number
   total_pages: number
   completed_pages: number
@@ -74,6 +75,46 @@ export interface ProgressData {
   timestamp: string
   done?: boolean
   error?: string
+  calls_avoided?: number
+}
+
+// SSE 进度事件：snapshot 为完整快照，其余为只包含变化字段的增量事件
+type ProgressEvent = Partial<ProgressData> & {
+  type?: 'snapshot' | 'status' | 'progress' | 'page_completed' | 'page_failed' | 'removed' | 'end'
+  page?: ProgressData['images'][number]
+  failure?: ProgressData['failed_pages'][number]
+}
+
+// SSE 断线后允许浏览器自动重连的连续次数
+const MAX_SSE_RECONNECTS = 5
+
+// 将增量事件合并到当前进度
+const applyProgressEvent = (state: ProgressData | null, event: ProgressEvent): ProgressData => {
+  const { type, page, failure, ...fields } = event
+  if (!state || !type || type === 'snapshot') {
+    return { images: [], failed_pages: [], ...(fields as ProgressData) }
+  }
+
+  const next: ProgressData = { ...state, ...fields }
+  if (page) {
+    next.images = [...state.images.filter(img => img.page_number !== page.page_number), page]
+  }
+  if (failure) {
+    next.failed_pages = [...state.failed_pages, failure]
+  }
+  return next
+}
+
+// 当前浏览器的客户端标识，保存在 localStorage 中
+const CLIENT_ID_KEY = 'tupal_client_id'
+
+export const getClientId = (): string => {
+  let clientId = localStorage.getItem(CLIENT_ID_KEY)
+  if (!clientId) {
+    clientId = `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`
+    localStorage.setItem(CLIENT_ID_KEY, clientId)
+  }
+  return clientId
 }
 
 // 生成大纲
@@ -88,9 +129,13 @@ export const generateImages = (params: GenerateImagesParams) => {
     data: {
       task_id: string
       total_pages: number
+      // 前面排队的页数、开始前的预计等待秒数和预计完成秒数
+      queue_position: number
+      estimated_wait: number
+      eta_seconds: number
     }
     message?: string
-  }>('/generate-images', params)
+  }>('/generate-images', { client_id: getClientId(), ...params })
 }
 
 // 订阅进度更新（SSE）
@@ -101,10 +146,13 @@ export const subscribeProgress = (
   onComplete?: () => void
 ): EventSource => {
   const eventSource = new EventSource(`${API_BASE_URL}/progress/${taskId}`)
+  let state: ProgressData | null = null
+  let reconnectAttempts = 0
 
   eventSource.onmessage = (event) => {
+    reconnectAttempts = 0
     try {
-      const data: ProgressData = JSON.parse(event.data)
+      const data: ProgressEvent = JSON.parse(event.data)
 
       // 检查是否有错误
       if (data.error) {
@@ -125,8 +173,9 @@ export const subscribeProgress = (
         return
       }
 
-      // 调用进度回调
-      onProgress(data)
+      // 合并增量事件后调用进度回调
+      state = applyProgressEvent(state, data)
+      onProgress(state)
 
       // 如果任务完成，关闭连接
       if (data.done) {
@@ -144,6 +193,96 @@ export const subscribeProgress = (
   }
 
   eventSource.onerror = (error) => {
+    // 浏览器会带上 Last-Event-ID 自动重连，服务端只补发错过的事件
+    if (eventSource.readyState === EventSource.CONNECTING && reconnectAttempts < MAX_SSE_RECONNECTS) {
+      reconnectAttempts++
+      console.warn(`SSE connection lost, reconnecting (${reconnectAttempts}/${MAX_SSE_RECONNECTS})`)
+      return
+    }
+
+    console.error('SSE connection error:', error)
+    if (onError) {
+      onError(new Error('连接中断，请检查网络'))
+    }
+    eventSource.close()
+  }
+
+  return eventSource
+}
+
+// 批量获取多个任务的进度快照
+export const getProgressBatch = (taskIds: string[]) => {
+  return api.get<any, {
+    success: boolean
+    data: {
+      tasks: Record<string, ProgressData & { seq: number }>
+      missing: string[]
+    }
+  }>('/progress', { params: { ids: taskIds.join(',') } })
+}
+
+// 在一个连接上订阅多个任务的进度（SSE），不传 taskIds 时订阅当前客户端的所有任务
+export const subscribeProgressMany = (
+  taskIds: string[] | null,
+  onProgress: (taskId: string, data: ProgressData) => void,
+  onRemoved?: (taskId: string) => void,
+  onError?: (error: Error) => void,
+  onComplete?: () => void
+): EventSource => {
+  const query = taskIds
+    ? `ids=${encodeURIComponent(taskIds.join(','))}`
+    : `client_id=${encodeURIComponent(getClientId())}`
+  const eventSource = new EventSource(`${API_BASE_URL}/progress/stream?${query}`)
+  const states: Record<string, ProgressData> = {}
+
+  eventSource.onmessage = (event) => {
+    try {
+      const data: ProgressEvent = JSON.parse(event.data)
+
+      if (data.error) {
+        console.error('Progress error:', data.error)
+        if (onError) {
+          onError(new Error(data.error))
+        }
+        eventSource.close()
+        return
+      }
+
+      // 所有任务都已结束
+      if (data.type === 'end') {
+        if (onComplete) {
+          onComplete()
+        }
+        eventSource.close()
+        return
+      }
+
+      const taskId = data.task_id as string
+      if (data.type === 'removed') {
+        delete states[taskId]
+        if (onRemoved) {
+          onRemoved(taskId)
+        }
+        return
+      }
+
+      states[taskId] = applyProgressEvent(states[taskId] || null, data)
+      onProgress(taskId, states[taskId])
+    } catch (error) {
+      console.error('Failed to parse SSE data:', error)
+      if (onError) {
+        onError(error as Error)
+      }
+    }
+  }
+
+  eventSource.onerror = (error) => {
+    // 断线后浏览器自动重连，服务端会重新推送所有任务的快照
+    if (eventSource.readyState === EventSource.CONNECTING) {
+      console.warn('SSE connection lost, reconnecting')
+      return
+    }
+
     console.error('SSE connection error:', error)
     if (onError) {
       onError(new Error('连接中断，请检查网络'))
@@ -31,6 +31,7 @@ export interface TrendingResponse {
   source_id: string
   data: TrendingItem[]
   from_cache?: boolean
+  stale?: boolean
   update_time?: string
   error?: string
 }